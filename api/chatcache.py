@@ -0,0 +1,91 @@
+"""
+Cache of chatbot answers generated by the model.
+
+Farmers ask the same questions against the same session metrics, so an
+answer is kept under the normalized question plus the context fields
+build_prompt() puts in the prompt. Entries expire after CHATBOT_CACHE_TTL
+seconds and the least recently used one is evicted beyond
+CHATBOT_CACHE_MAX_ENTRIES (0 disables the cache).
+
+Nothing is invalidated when a session lands: the key holds the metrics
+themselves, so a farmer whose data changed simply misses, and other
+farmers' answers stay warm. The TTL bounds how long answers nobody will
+ask for again are kept.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import counters
+
+# Context fields build_prompt() uses
+PROMPT_CONTEXT_FIELDS = (
+    "has_data",
+    "user_role",
+    "canopy_cover",
+    "stress_level",
+    "yield_estimate",
+    "analysis_date",
+)
+
+_entries = OrderedDict()  # key -> (expires at, answer), least recently used first
+_lock = threading.Lock()
+
+
+def cache_limits():
+    """(CHATBOT_CACHE_MAX_ENTRIES, CHATBOT_CACHE_TTL in seconds)."""
+    return (
+        getattr(settings, "CHATBOT_CACHE_MAX_ENTRIES", 1024),
+        getattr(settings, "CHATBOT_CACHE_TTL", 3600),
+    )
+
+
+def normalize_message(message):
+    """Case-folded, whitespace collapsed, without trailing punctuation."""
+    return " ".join(message.casefold().split()).rstrip("?!. ")
+
+
+def cache_key(message, context):
+    return (normalize_message(message),) + tuple(context.get(field) for field in PROMPT_CONTEXT_FIELDS)
+
+
+def get(message, context):
+    """Cached answer to message in context, or None."""
+    max_entries, _ = cache_limits()
+    if max_entries <= 0:
+        return None
+    key = cache_key(message, context)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del _entries[key]
+            entry = None
+        if entry is not None:
+            _entries.move_to_end(key)
+    counters.incr("chat_cache.hits" if entry is not None else "chat_cache.misses")
+    return entry[1] if entry is not None else None
+
+
+def put(message, context, answer):
+    max_entries, ttl = cache_limits()
+    if max_entries <= 0:
+        return
+    key = cache_key(message, context)
+    with _lock:
+        _entries[key] = (time.monotonic() + ttl, answer)
+        _entries.move_to_end(key)
+        evicted = 0
+        while len(_entries) > max_entries:
+            _entries.popitem(last=False)
+            evicted += 1
+    if evicted:
+        counters.incr("chat_cache.evictions", evicted)
+
+
+def clear():
+    """Drop every cached answer."""
+    with _lock:
+        _entries.clear()
+    counters.incr("chat_cache.invalidations")
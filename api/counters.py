@@ -0,0 +1,29 @@
+"""
+In-process counters for operational metrics (cache hits, queue depth...).
+
+Counters live in the memory of the current worker process and reset on
+restart; they are meant for live monitoring through the metrics endpoint,
+not as a source of truth.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def gauge(name, value):
+    """Set a counter that reports a current level (a queue depth) rather than a total."""
+    with _lock:
+        _counters[name] = value
+
+
+def snapshot():
+    """Return a copy of every counter."""
+    with _lock:
+        return dict(_counters)
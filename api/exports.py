@@ -0,0 +1,179 @@
+"""
+Streaming exports of analysis history as CSV, NDJSON or Parquet.
+
+Rows are read in chunks along a unique key (keyset pagination, the same
+idea as the history endpoints) and each chunk is encoded and handed to
+the response before the next one is read. Memory therefore holds one
+chunk whatever the export size, on every backend: QuerySet.iterator()
+streams on PostgreSQL, but MySQLdb buffers a whole result set
+client-side.
+
+Parquet needs pyarrow; every chunk becomes one row group.
+"""
+import csv
+import io
+import json
+
+try:
+    import pyarrow as pa  # optional, needed for Parquet exports
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Rows read and encoded per step
+EXPORT_CHUNK_ROWS = 2000
+
+_METRICS = {
+    "canopy_cover": "float",
+    "stress_percentage": "float",
+    "yield_estimate": "float",
+    "vari": "float",
+    "gli": "float",
+    "exg": "float",
+    "extra_indices": "json",
+}
+
+# Exported columns and their types, per export kind
+EXPORT_COLUMNS = {
+    "sessions": {
+        "session_id": "int",
+        "created_at": "datetime",
+        "status": "str",
+        "weighting": "str",
+        "images_total": "int",
+        "images_done": "int",
+        **_METRICS,
+    },
+    "images": {
+        "id": "int",
+        "session_id": "int",
+        "image": "str",
+        "timestamp": "datetime",
+        "processed": "bool",
+        "reused": "bool",
+        "analysis_mode": "str",
+        "decode_scale": "int",
+        "representative_id": "int",
+        "analysis_weight": "float",
+        "pixel_count": "int",
+        **_METRICS,
+    },
+}
+
+# Primary key each export kind is read along
+EXPORT_KEYS = {"sessions": "session_id", "images": "id"}
+
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_formats():
+    """Formats available in this installation."""
+    return [fmt for fmt in EXPORT_CONTENT_TYPES if fmt != "parquet" or pa is not None]
+
+
+def iter_chunks(queryset, columns, key, chunk_size=EXPORT_CHUNK_ROWS):
+    """Yield lists of up to chunk_size row dicts, ascending on the unique key."""
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(**{f"{key}__gt": last})
+        rows = list(page.order_by(key).values(*columns)[:chunk_size])
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][key]
+
+
+def _csv_value(value, kind):
+    if value is None:
+        return ""
+    if kind == "json":
+        return json.dumps(value)
+    if kind == "datetime":
+        return value.isoformat()
+    return value
+
+
+def encode_csv(chunks, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows([_csv_value(row[name], kind) for name, kind in columns.items()] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # header of an empty export
+
+
+def _isoformat(value):
+    # Datetimes are the only column values json cannot encode; keep microseconds
+    return value.isoformat()
+
+
+def encode_ndjson(chunks, columns):
+    for rows in chunks:
+        yield "".join(json.dumps(row, default=_isoformat) + "\n" for row in rows)
+
+
+class _ChunkSink:
+    """Write-only file collecting what ParquetWriter writes until take()."""
+
+    def __init__(self):
+        self.parts, self.position, self.closed = [], 0, False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def encode_parquet(chunks, columns):
+    arrow_types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "str": pa.string(),
+        "bool": pa.bool_(),
+        "datetime": pa.timestamp("us", tz="UTC"),
+        "json": pa.string(),
+    }
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in columns.items()])
+    json_columns = [name for name, kind in columns.items() if kind == "json"]
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    for rows in chunks:
+        for row in rows:
+            for name in json_columns:
+                row[name] = json.dumps(row[name]) if row[name] is not None else None
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson, "parquet": encode_parquet}
+
+
+def export_stream(queryset, kind, fmt, chunk_size=EXPORT_CHUNK_ROWS):
+    """Iterator over the encoded export of queryset (an export kind's model)."""
+    columns = EXPORT_COLUMNS[kind]
+    chunks = iter_chunks(queryset, list(columns), EXPORT_KEYS[kind], chunk_size)
+    return ENCODERS[fmt](chunks, columns)
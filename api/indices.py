@@ -0,0 +1,132 @@
+"""
+Registry of the vegetation indices computed by IndexAccumulator.
+
+An index is declared once: a formula over named per-band terms, how its
+per-pixel values reduce to one number ("mean" of the values, or
+"percent" of pixels set in a mask) and the decimals it is reported with.
+Terms are computed at most once per band and shared between indices, so
+VARI and NGRDI both reuse G - R, ExG, GLI and TGI build on the same
+differences, and an index nobody asked for costs nothing.
+"""
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# Brown roughly: Hue 10-30, Saturation 50-255, Value 20-200 (OpenCV HSV)
+BROWN_HSV_LOWER = np.array([10, 50, 20], dtype=np.uint8)
+BROWN_HSV_UPPER = np.array([30, 255, 200], dtype=np.uint8)
+
+
+def ratio(num, den, clip=None):
+    """num / den in float32, 0 where den <= 0 (inputs are integers)."""
+    out = np.divide(num, den, out=np.zeros(num.shape, dtype=np.float32),
+                    where=den > 0, dtype=np.float32)
+    if clip is not None:
+        np.clip(out, -clip, clip, out=out)
+    return out
+
+
+def _brown_mask(terms):
+    """
+    0/255 stress mask; HSV and mask buffers are reused across bands.
+
+    A precomputed RGB lookup table was measured instead and is about four
+    times slower per megapixel (benchmarks/bench_stress.py).
+    """
+    band, buffers = terms.band, terms.buffers
+    rows = band.shape[0]
+    hsv = buffers.get("hsv")
+    if hsv is None or hsv.shape[0] < rows or hsv.shape[1] != band.shape[1]:
+        buffers["hsv"] = np.empty(band.shape, dtype=np.uint8)
+        buffers["brown"] = np.empty(band.shape[:2], dtype=np.uint8)
+    hsv = cv2.cvtColor(np.ascontiguousarray(band), cv2.COLOR_RGB2HSV, dst=buffers["hsv"][:rows])
+    return cv2.inRange(hsv, BROWN_HSV_LOWER, BROWN_HSV_UPPER, dst=buffers["brown"][:rows])
+
+
+def _sum_of(*parts):
+    """Term that adds (or, with a leading "-", subtracts) other terms in int16."""
+    def compute(terms):
+        first, second, *rest = parts
+        if second.startswith("-"):
+            out = np.subtract(terms[first], terms[second[1:]])
+        else:
+            out = np.add(terms[first], terms[second])
+        for part in rest:
+            if part.startswith("-"):
+                out -= terms[part[1:]]
+            else:
+                out += terms[part]
+        return out
+    return compute
+
+
+# Per-band terms. Channels are widened to int16, so every integer term is exact.
+TERMS = {
+    "R": lambda t: t.band[:, :, 0].astype(np.int16),
+    "G": lambda t: t.band[:, :, 1].astype(np.int16),
+    "B": lambda t: t.band[:, :, 2].astype(np.int16),
+    "G-R": lambda t: t["G"] - t["R"],
+    "R-B": lambda t: t["R"] - t["B"],
+    "G+R": lambda t: t["G"] + t["R"],
+    "G+R-B": _sum_of("G+R", "-B"),
+    "2G-R-B": _sum_of("G-R", "G", "-B"),
+    "2G+R+B": _sum_of("G+R-B", "G", "B", "B"),
+    "brown": _brown_mask,
+}
+
+
+class BandTerms:
+    """The terms of one band, each computed on first use."""
+
+    def __init__(self, band, buffers):
+        self.band = band
+        self.buffers = buffers
+        self._values = {}
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            self._values[name] = TERMS[name](self)
+        return self._values[name]
+
+
+VegetationIndex = namedtuple("VegetationIndex", "name formula reducer decimals mask_value")
+
+# Declaration order is the order of results and zonal statistics layers
+INDICES = {index.name: index for index in (
+    # VARI = (G - R) / (G + R - B), clipped to [-1, 1]
+    VegetationIndex("vari", lambda t: ratio(t["G-R"], t["G+R-B"], clip=1), "mean", 3, None),
+    # ExG = 2G - R - B
+    VegetationIndex("exg", lambda t: t["2G-R-B"], "mean", 3, None),
+    # GLI = (2G - R - B) / (2G + R + B)
+    VegetationIndex("gli", lambda t: ratio(t["2G-R-B"], t["2G+R+B"]), "mean", 3, None),
+    # Canopy: pixels where green dominates red
+    VegetationIndex("canopy_pct", lambda t: t["G-R"] > 0, "percent", 2, 1),
+    # Stress: brown pixels (see BROWN_HSV_LOWER/UPPER)
+    VegetationIndex("stress_pct", lambda t: t["brown"], "percent", 2, 255),
+    # NGRDI = (G - R) / (G + R)
+    VegetationIndex("ngrdi", lambda t: ratio(t["G-R"], t["G+R"]), "mean", 3, None),
+    # TGI = -0.5 * [190 (R - G) - 120 (R - B)] = 95 (G - R) + 60 (R - B), exact in int16
+    VegetationIndex("tgi", lambda t: 95 * t["G-R"] + 60 * t["R-B"], "mean", 2, None),
+)}
+
+# Computed when a request names no indices
+DEFAULT_INDICES = ("vari", "exg", "gli", "canopy_pct", "stress_pct")
+
+# Always computed: canopy marks an image as analyzed and feeds the yield estimate
+REQUIRED_INDICES = ("canopy_pct",)
+
+METRIC_DECIMALS = {name: index.decimals for name, index in INDICES.items()}
+
+
+def resolve_indices(names=None, extra=()):
+    """
+    Registry entries for the requested names plus REQUIRED_INDICES and
+    extra, in declaration order. Unknown names raise ValueError.
+    """
+    wanted = set(DEFAULT_INDICES if names is None else names)
+    wanted.update(REQUIRED_INDICES, extra)
+    unknown = wanted - INDICES.keys()
+    if unknown:
+        raise ValueError(f"Unknown indices: {', '.join(sorted(unknown))}")
+    return [index for name, index in INDICES.items() if name in wanted]
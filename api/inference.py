@@ -0,0 +1,300 @@
+"""
+Process-resident registry of the chatbot's language model.
+
+The model and tokenizer are loaded once per worker process and kept as
+plain module state, so requests share the same weights without ever
+pickling them (as a django.core.cache backend would on every get) and no
+request pays a reload when a cache entry expires. With
+CHATBOT_PRELOAD_MODEL set, the WSGI and ASGI entry points load the model
+in a background thread at startup (see preload_if_configured): server
+workers and runserver's serving child do, migrate, the analysis worker
+and runserver's autoreloader parent do not. is_ready() reports when it
+is usable.
+
+generate() does not run the model in the calling request thread: prompts
+go to one inference thread per process, which gathers whatever arrives
+within CHATBOT_BATCH_WINDOW_MS (up to CHATBOT_BATCH_MAX_SIZE prompts),
+pads them into one batch and runs a single model.generate for all of
+them. Concurrent chats then share a forward pass instead of competing
+for the same cores.
+
+The queue holds at most CHATBOT_QUEUE_MAX_SIZE prompts; beyond that
+generate() raises queue.Full at once, so callers fall back instead of
+waiting behind work they cannot outlast. A prompt given a timeout stops
+generating when its deadline passes, and one that expired while queued
+is never run: no CPU goes to an answer nobody is waiting for.
+
+stream() yields an answer while it is generated, through a
+TextIteratorStreamer. A streamed prompt runs as a batch of its own and
+stops when the caller closes the iterator.
+"""
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+from . import counters
+
+# Prompts are truncated to this many tokens
+PROMPT_MAX_TOKENS = 256
+
+# Greedy decoding; sampling and beam-search options would be ignored
+GENERATION_KWARGS = {
+    "max_new_tokens": 150,
+    "do_sample": False,
+    "repetition_penalty": 1.1,
+    "no_repeat_ngram_size": 2,
+}
+
+_models = {}
+_load_lock = threading.Lock()
+_ready = threading.Event()
+
+_requests = None
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def model_name():
+    """Configured model (CHATBOT_MODEL_NAME, default google/flan-t5-small)."""
+    return getattr(settings, "CHATBOT_MODEL_NAME", "google/flan-t5-small")
+
+
+def get_model(name=None):
+    """Return (model, tokenizer), loading them on first use in this process."""
+    name = name or model_name()
+    entry = _models.get(name)
+    if entry is not None:
+        return entry
+    with _load_lock:
+        if name not in _models:
+            from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+            print(f"Loading model {name}...")
+            tokenizer = AutoTokenizer.from_pretrained(name)
+            model = AutoModelForSeq2SeqLM.from_pretrained(name)
+            model.eval()
+            _models[name] = (model, tokenizer)
+            if name == model_name():
+                _ready.set()
+        return _models[name]
+
+
+def is_ready():
+    """Whether the configured model is loaded in this process."""
+    return _ready.is_set()
+
+
+def warm_up():
+    """Load the configured model and run one short generation."""
+    import torch
+
+    try:
+        model, tokenizer = get_model()
+        with torch.inference_mode():
+            model.generate(**tokenizer("Hello", return_tensors="pt"), max_new_tokens=1)
+    except Exception as e:
+        print(f"Model warm-up failed: {e}")
+
+
+def start_warm_up():
+    """Warm the model up in a background thread so startup is not blocked."""
+    threading.Thread(target=warm_up, name="model-warm-up", daemon=True).start()
+
+
+def preload_if_configured():
+    """start_warm_up() when CHATBOT_PRELOAD_MODEL is set; for the server entry points."""
+    if getattr(settings, "CHATBOT_PRELOAD_MODEL", False):
+        start_warm_up()
+
+
+def batch_limits():
+    """(CHATBOT_BATCH_MAX_SIZE, CHATBOT_BATCH_WINDOW_MS in seconds)."""
+    max_size = getattr(settings, "CHATBOT_BATCH_MAX_SIZE", 8)
+    window_ms = getattr(settings, "CHATBOT_BATCH_WINDOW_MS", 10)
+    return max(1, max_size), window_ms / 1000
+
+
+def queue_limit():
+    """Configured queue capacity (CHATBOT_QUEUE_MAX_SIZE)."""
+    return getattr(settings, "CHATBOT_QUEUE_MAX_SIZE", 32)
+
+
+class _Request:
+    """One prompt waiting for the inference thread."""
+
+    def __init__(self, prompt, deadline, streamer=None):
+        self.prompt = prompt
+        self.deadline = deadline
+        self.streamer = streamer
+        self.cancelled = False  # set when the caller stops listening
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def expired(self, now):
+        return self.cancelled or now >= self.deadline
+
+    def finish(self, result=None, error=None):
+        self.result, self.error = result, error
+        if error is not None and self.streamer is not None:
+            self.streamer.end()  # generate() ends it on success
+        self.done.set()
+
+
+class _DeadlineCriteria:
+    """Stopping criterion finishing each batch row once its request expires."""
+
+    def __init__(self, batch):
+        self.batch = batch
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        now = time.monotonic()
+        return torch.tensor([request.expired(now) for request in self.batch], device=input_ids.device)
+
+
+def _next_batch(requests, max_size, window):
+    """Block for one request, then take more until the window or batch is full."""
+    batch = [requests.get()]
+    deadline = time.monotonic() + window
+    while len(batch) < max_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(requests.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _generate(batch):
+    """One model.generate over batch; a streamed request always runs alone."""
+    import torch
+
+    counters.incr("chatbot.batches")
+    counters.incr("chatbot.batched_prompts", len(batch))
+    counters.gauge("chatbot.last_batch_size", len(batch))
+    try:
+        model, tokenizer = get_model()
+        inputs = tokenizer(
+            [request.prompt for request in batch],
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=PROMPT_MAX_TOKENS,
+        )
+        with torch.inference_mode():
+            outputs = model.generate(**inputs, **GENERATION_KWARGS,
+                                     stopping_criteria=[_DeadlineCriteria(batch)],
+                                     streamer=batch[0].streamer)
+        texts = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+    except Exception as e:
+        for request in batch:
+            request.finish(error=e)
+        return
+    for request, text in zip(batch, texts):
+        request.finish(result=text)
+
+
+def _run_batch(batch):
+    now = time.monotonic()
+    expired = [request for request in batch if request.expired(now)]
+    if expired:
+        counters.incr("chatbot.expired", len(expired))
+        for request in expired:
+            request.finish(error=TimeoutError("Deadline passed while queued"))
+    # Streamers take one sequence, so streamed requests are not batched
+    batched = []
+    for request in batch:
+        if request.expired(now):
+            continue
+        if request.streamer is not None:
+            _generate([request])
+        else:
+            batched.append(request)
+    if batched:
+        _generate(batched)
+
+
+def _serve(requests):
+    max_size, window = batch_limits()
+    while True:
+        batch = _next_batch(requests, max_size, window)
+        counters.gauge("chatbot.queue_depth", requests.qsize())
+        _run_batch(batch)
+
+
+def _ensure_worker():
+    global _requests, _worker
+    with _worker_lock:
+        if _requests is None:
+            _requests = queue.Queue(maxsize=queue_limit())
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_serve, args=(_requests,), name="chatbot-inference", daemon=True
+            )
+            _worker.start()
+
+
+def _submit(prompt, timeout, streamer=None):
+    _ensure_worker()
+    deadline = time.monotonic() + timeout if timeout is not None else float("inf")
+    request = _Request(prompt, deadline, streamer)
+    try:
+        _requests.put_nowait(request)
+    except queue.Full:
+        counters.incr("chatbot.rejected")
+        raise
+    counters.gauge("chatbot.queue_depth", _requests.qsize())
+    return request
+
+
+def generate(prompt, timeout=None):
+    """
+    Answer one prompt, batched with any concurrent ones. Raises queue.Full
+    when the queue is at capacity and TimeoutError when no answer is ready
+    within timeout seconds; model errors are re-raised.
+    """
+    request = _submit(prompt, timeout)
+    if not request.done.wait(timeout):
+        # Generation of this row stops at the deadline (see _DeadlineCriteria)
+        request.cancelled = True
+        counters.incr("chatbot.timeouts")
+        raise TimeoutError(f"No answer within {timeout}s")
+    if request.error is not None:
+        raise request.error
+    return request.result
+
+
+def stream(prompt, timeout=None):
+    """
+    Iterator over the answer to prompt as pieces of text, yielded while the
+    model generates them. Admission is checked at once (queue.Full, as in
+    generate()); generation stops at the deadline, which ends the
+    iterator, or as soon as the caller closes it.
+    """
+    from transformers import TextIteratorStreamer
+
+    _, tokenizer = get_model()
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+    return _stream_pieces(_submit(prompt, timeout, streamer))
+
+
+def _stream_pieces(request):
+    try:
+        for piece in request.streamer:
+            if piece:
+                yield piece
+    except queue.Empty:
+        counters.incr("chatbot.timeouts")
+        raise TimeoutError("No answer within the deadline") from None
+    finally:
+        # A closed iterator (client gone) stops the generation
+        request.cancelled = True
+    request.done.wait()
+    if request.error is not None:
+        raise request.error
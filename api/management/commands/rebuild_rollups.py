@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily/weekly metric rollups behind the trend endpoint from session history."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--owner", type=int,
+            help="Only rebuild this user's rollups (user id).",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000,
+            help="Sessions read and rows written per database round trip.",
+        )
+
+    def handle(self, *args, **options):
+        owner = None
+        if options["owner"] is not None:
+            try:
+                owner = get_user_model().objects.get(pk=options["owner"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user with id {options['owner']}")
+
+        written = rebuild_rollups(owner, chunk_size=options["chunk_size"])
+        self.stdout.write(f"Wrote {written} rollup row(s)")
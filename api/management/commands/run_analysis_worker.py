@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import AnalysisSession
+from api.services import claim_pending_session, expire_chunked_uploads, process_session
+
+
+class Command(BaseCommand):
+    help = "Process crop-analysis sessions queued with async=true (DB-backed queue, no broker)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll-interval", type=float, default=2.0,
+            help="Seconds to sleep when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Drain the queue and exit instead of polling forever.",
+        )
+        parser.add_argument(
+            "--requeue-stale", action="store_true",
+            help="Put sessions left in 'processing' by a dead worker back in the queue first.",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_stale"]:
+            requeued = AnalysisSession.objects.filter(
+                status=AnalysisSession.STATUS_PROCESSING
+            ).update(status=AnalysisSession.STATUS_PENDING)
+            self.stdout.write(f"Requeued {requeued} stale session(s)")
+
+        while True:
+            session = claim_pending_session()
+            if session is None:
+                # Idle: drop chunked uploads abandoned mid-transfer
+                expired = expire_chunked_uploads()
+                if expired:
+                    self.stdout.write(f"Dropped {expired} expired chunked upload(s)")
+                    continue  # their sessions may be ready to analyze
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write(f"Processing session {session.session_id} ({session.images_total} images)")
+            try:
+                process_session(session)
+            except Exception as e:
+                session.status = AnalysisSession.STATUS_FAILED
+                session.save(update_fields=["status"])
+                self.stderr.write(f"Session {session.session_id} failed: {e}")
+                continue
+            self.stdout.write(f"Session {session.session_id} {session.status}")
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_rename_avg_exg_analysissession_canopy_cover_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='droneimage',
+            name='analysis_mode',
+            field=models.CharField(choices=[('full', 'Full resolution'), ('tiled', 'Full resolution, tiled'), ('preview', 'Reduced-resolution preview')], default='full', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='decode_scale',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:06
+
+from django.db import migrations, models
+
+
+def mark_existing_complete(apps, schema_editor):
+    # Everything stored before async jobs existed was analyzed synchronously
+    AnalysisSession = apps.get_model('api', 'AnalysisSession')
+    DroneImage = apps.get_model('api', 'DroneImage')
+    DroneImage.objects.update(processed=True)
+    for session in AnalysisSession.objects.all():
+        count = session.images.count()
+        session.status = 'completed'
+        session.images_total = count
+        session.images_done = count
+        session.save(update_fields=['status', 'images_total', 'images_done'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_droneimage_analysis_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissession',
+            name='images_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='analysissession',
+            name='images_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='analysissession',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='processed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_existing_complete, migrations.RunPython.noop),
+    ]
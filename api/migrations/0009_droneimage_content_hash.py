@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_analysis_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='droneimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='reused',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_droneimage_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='droneimage',
+            name='raster_levels',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='raster_path',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_droneimage_index_rasters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='droneimage',
+            name='zonal_cols',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='zonal_rows',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='zonal_stats',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:21
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_droneimage_zonal_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysissession',
+            name='status',
+            field=models.CharField(choices=[('receiving', 'Receiving uploads'), ('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=12),
+        ),
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('storage_name', models.CharField(max_length=255)),
+                ('received', models.JSONField(default=list)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('analysis_mode', models.CharField(choices=[('full', 'Full resolution'), ('tiled', 'Full resolution, tiled'), ('preview', 'Reduced-resolution preview')], default='full', max_length=10)),
+                ('decode_scale', models.PositiveSmallIntegerField(default=1)),
+                ('rasters', models.BooleanField(default=False)),
+                ('zonal_rows', models.PositiveSmallIntegerField(default=0)),
+                ('zonal_cols', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to=settings.AUTH_USER_MODEL)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='api.analysissession')),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_chunked_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissession',
+            name='dedupe',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='analysis_weight',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='frame_signature',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='representative',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='api.droneimage'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_droneimage_near_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissession',
+            name='extra_indices',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='indices',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='extra_indices',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='indices',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_vegetation_index_registry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissession',
+            name='running_stats',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='analysissession',
+            name='weighting',
+            field=models.CharField(choices=[('images', 'Every image counts the same'), ('pixels', 'Images count by pixel count')], default='images', max_length=6),
+        ),
+        migrations.AddField(
+            model_name='droneimage',
+            name='pixel_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
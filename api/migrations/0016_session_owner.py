@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def owners_from_uploads(apps, schema_editor):
+    # Resumable batches already recorded who uploaded them
+    AnalysisSession = apps.get_model('api', 'AnalysisSession')
+    ChunkedUpload = apps.get_model('api', 'ChunkedUpload')
+    owners = dict(ChunkedUpload.objects.values_list('session_id', 'owner_id'))
+    for session_id, owner_id in owners.items():
+        AnalysisSession.objects.filter(pk=session_id).update(owner_id=owner_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_session_running_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissession',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='analysis_sessions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='analysissession',
+            index=models.Index(fields=['owner', '-created_at'], name='session_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='droneimage',
+            index=models.Index(fields=['session', '-timestamp'], name='image_session_timestamp_idx'),
+        ),
+        migrations.RunPython(owners_from_uploads, migrations.RunPython.noop),
+    ]
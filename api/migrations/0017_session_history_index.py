@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_session_owner'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysissession',
+            index=models.Index(fields=['owner', 'created_at', 'session_id', 'status', 'images_total', 'canopy_cover', 'stress_percentage', 'yield_estimate', 'vari', 'gli', 'exg'], name='session_owner_history_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='analysissession',
+            name='session_owner_created_idx',
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_session_history_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissession',
+            name='rolled_up',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.CreateModel(
+            name='MetricRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week (from Monday)')], max_length=4)),
+                ('period_start', models.DateField()),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('canopy_cover_count', models.FloatField(default=0)),
+                ('canopy_cover_sum', models.FloatField(default=0)),
+                ('stress_percentage_count', models.FloatField(default=0)),
+                ('stress_percentage_sum', models.FloatField(default=0)),
+                ('yield_estimate_count', models.FloatField(default=0)),
+                ('yield_estimate_sum', models.FloatField(default=0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metric_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('owner', 'period', 'period_start'), name='rollup_owner_period_unique')],
+            },
+        ),
+    ]
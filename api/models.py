@@ -1,9 +1,44 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
 
 
 class AnalysisSession(models.Model):
+    STATUS_RECEIVING = "receiving"
+    STATUS_PENDING = "pending"
+    STATUS_PROCESSING = "processing"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_RECEIVING, "Receiving uploads"),
+        (STATUS_PENDING, "Pending"),
+        (STATUS_PROCESSING, "Processing"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    WEIGHT_IMAGES = "images"
+    WEIGHT_PIXELS = "pixels"
+    WEIGHTING_CHOICES = [
+        (WEIGHT_IMAGES, "Every image counts the same"),
+        (WEIGHT_PIXELS, "Images count by pixel count"),
+    ]
+
     session_id = models.AutoField(primary_key=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # The uploading user; only they can see the session (null for sessions
+    # created before ownership was recorded)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True,
+        related_name="analysis_sessions",
+    )
+
+    # Job state; pending sessions are the queue read by run_analysis_worker.
+    # Receiving sessions still wait for chunked uploads (see ChunkedUpload).
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    images_total = models.PositiveIntegerField(default=0)
+    images_done = models.PositiveIntegerField(default=0)
 
     # Aggregated metrics (calculated after all images are processed)
     canopy_cover = models.FloatField(null=True, blank=True)
@@ -15,16 +50,95 @@ class AnalysisSession(models.Model):
     gli = models.FloatField(null=True, blank=True)
     exg = models.FloatField(null=True, blank=True)
 
+    # Averages of indices without a column of their own (e.g. NGRDI, TGI)
+    extra_indices = models.JSONField(default=dict, blank=True)
+
+    # How images are weighted in the averages (near-duplicate groups always count once)
+    weighting = models.CharField(max_length=6, choices=WEIGHTING_CHOICES, default=WEIGHT_IMAGES)
+    # Group near-duplicate frames and analyze one per group (opt-in); the
+    # worker signs and groups queued images before analyzing them
+    dedupe = models.BooleanField(default=False)
+    # Running aggregates per metric: {"n": images, "w": total weight, "mean", "m2"}
+    # (weighted Welford), so appended images update the averages in O(1) each
+    running_stats = models.JSONField(default=dict, blank=True)
+    # What the session last added to its MetricRollup rows: {metric: [count, sum]}
+    rolled_up = models.JSONField(default=dict, blank=True)
+
+    # Columns of the session history list (api.services.session_history)
+    HISTORY_FIELDS = (
+        "session_id", "created_at", "status", "images_total",
+        "canopy_cover", "stress_percentage", "yield_estimate", "vari", "gli", "exg",
+    )
+
+    class Meta:
+        indexes = [
+            # A user's latest session is one seek (owner = ? ORDER BY created_at DESC
+            # LIMIT 1), and the history list pages along it by (created_at, session_id)
+            # reading only the index, since it also holds every HISTORY_FIELDS column
+            models.Index(
+                fields=[
+                    "owner", "created_at", "session_id", "status", "images_total",
+                    "canopy_cover", "stress_percentage", "yield_estimate", "vari", "gli", "exg",
+                ],
+                name="session_owner_history_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"Session {self.id} - {self.created_at}"
 
 
 class DroneImage(models.Model):
+    MODE_FULL = "full"
+    MODE_TILED = "tiled"
+    MODE_PREVIEW = "preview"
+    ANALYSIS_MODE_CHOICES = [
+        (MODE_FULL, "Full resolution"),
+        (MODE_TILED, "Full resolution, tiled"),
+        (MODE_PREVIEW, "Reduced-resolution preview"),
+    ]
+
     session = models.ForeignKey(AnalysisSession, on_delete=models.CASCADE, related_name="images")
 
     image = models.ImageField(upload_to="drone_images/")
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    # False until the analysis worker has run (metrics stay null on failure)
+    processed = models.BooleanField(default=False)
+
+    # SHA-256 of the uploaded bytes; identical re-uploads reuse the metrics
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    reused = models.BooleanField(default=False)  # metrics copied from a hash hit
+
+    # Near-duplicate grouping, for sessions with dedupe (see
+    # services.group_near_duplicates): frames whose utils.frame_signature()
+    # matches an earlier one's point at that representative. Skipped frames
+    # copy its metrics with weight 0; analyzed members of a group share a
+    # weight of 1, so each group counts once in the session means.
+    frame_signature = models.TextField(blank=True)
+    representative = models.ForeignKey(
+        "self", null=True, blank=True, on_delete=models.SET_NULL, related_name="near_duplicates"
+    )
+    analysis_weight = models.FloatField(default=1.0)
+
+    # Per-pixel index tile pyramid (MEDIA_ROOT-relative dir), 0 levels = none
+    raster_path = models.CharField(max_length=255, blank=True)
+    raster_levels = models.PositiveSmallIntegerField(default=0)
+
+    # Registry indices (api.indices) computed for this image, comma-separated
+    # in registry order; requested ones until processed. Blank = DEFAULT_INDICES.
+    indices = models.CharField(max_length=255, blank=True)
+    # Values of computed indices without a column of their own (e.g. NGRDI, TGI)
+    extra_indices = models.JSONField(default=dict, blank=True)
+    # Full-resolution width * height (0 if unknown), for pixel-weighted sessions
+    pixel_count = models.PositiveBigIntegerField(default=0)
+
+    # Per-cell means on a zonal_rows x zonal_cols grid, packed float32 in
+    # index_names() order (see DroneImage.zonal_array)
+    zonal_rows = models.PositiveSmallIntegerField(default=0)
+    zonal_cols = models.PositiveSmallIntegerField(default=0)
+    zonal_stats = models.BinaryField(null=True, blank=True)
+
     # Phase 2 metrics
     vari = models.FloatField(null=True, blank=True)
     gli = models.FloatField(null=True, blank=True)
@@ -35,7 +149,111 @@ class DroneImage(models.Model):
     # Phase 3 metrics
     yield_estimate = models.FloatField(null=True, blank=True)
 
+    # How the metrics were produced (preview rows can be re-run at full resolution)
+    analysis_mode = models.CharField(max_length=10, choices=ANALYSIS_MODE_CHOICES, default=MODE_FULL)
+    decode_scale = models.PositiveSmallIntegerField(default=1)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Latest image of a session (get_latest_analysis)
+            models.Index(fields=["session", "-timestamp"], name="image_session_timestamp_idx"),
+        ]
+
+    def index_names(self):
+        """Names of the indices computed for this image, in registry order."""
+        from .indices import DEFAULT_INDICES
+        return self.indices.split(",") if self.indices else list(DEFAULT_INDICES)
+
+    def zonal_array(self):
+        """Unpack zonal_stats into a (rows, cols, metrics) numpy array, or None."""
+        if not self.zonal_stats:
+            return None
+        import numpy as np
+        return np.frombuffer(bytes(self.zonal_stats), dtype=np.float32).reshape(
+            self.zonal_rows, self.zonal_cols, -1
+        )
+
     def __str__(self):
         return f"Image {self.id} in session {self.session.id}"
+
+
+class ChunkedUpload(models.Model):
+    """
+    One file of a resumable upload batch, assembled in place in storage.
+
+    The file is created at its full size when the batch is opened and
+    chunks are written at their offsets; ``received`` holds the merged
+    [start, end) byte ranges written so far. Once they cover the file a
+    DroneImage is added to the session for the analysis worker.
+    """
+    upload_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    session = models.ForeignKey(AnalysisSession, on_delete=models.CASCADE, related_name="uploads")
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="chunked_uploads")
+
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    storage_name = models.CharField(max_length=255)  # MEDIA_ROOT-relative
+    received = models.JSONField(default=list)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    # Analysis requested for the batch (see CropAnalysisView)
+    analysis_mode = models.CharField(max_length=10, choices=DroneImage.ANALYSIS_MODE_CHOICES, default=DroneImage.MODE_FULL)
+    decode_scale = models.PositiveSmallIntegerField(default=1)
+    rasters = models.BooleanField(default=False)
+    indices = models.CharField(max_length=255, blank=True)
+    zonal_rows = models.PositiveSmallIntegerField(default=0)
+    zonal_cols = models.PositiveSmallIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last chunk written; uploads idle for CHUNKED_UPLOAD_EXPIRY are dropped
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def received_bytes(self):
+        return sum(end - start for start, end in self.received)
+
+    def __str__(self):
+        return f"Upload {self.upload_id} ({self.file_name}) in session {self.session_id}"
+
+
+class MetricRollup(models.Model):
+    """
+    Daily or weekly metric totals of one owner's completed sessions.
+
+    Each completed session adds, per metric, its analyzed image count and
+    that count times its mean, so a period's mean is sum / count whatever
+    the sessions' sizes. Maintained by api.services.update_rollups as
+    sessions complete; rebuilt with the rebuild_rollups command.
+    """
+    PERIOD_DAY = "day"
+    PERIOD_WEEK = "week"
+    PERIOD_CHOICES = [
+        (PERIOD_DAY, "Day"),
+        (PERIOD_WEEK, "Week (from Monday)"),
+    ]
+
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="metric_rollups")
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+
+    sessions = models.PositiveIntegerField(default=0)
+    canopy_cover_count = models.FloatField(default=0)
+    canopy_cover_sum = models.FloatField(default=0)
+    stress_percentage_count = models.FloatField(default=0)
+    stress_percentage_sum = models.FloatField(default=0)
+    yield_estimate_count = models.FloatField(default=0)
+    yield_estimate_sum = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index the trend endpoint reads along
+            models.UniqueConstraint(fields=["owner", "period", "period_start"], name="rollup_owner_period_unique"),
+        ]
+
+    def mean(self, field):
+        count = getattr(self, f"{field}_count")
+        return getattr(self, f"{field}_sum") / count if count else None
+
+    def __str__(self):
+        return f"{self.period} from {self.period_start} for user {self.owner_id}"
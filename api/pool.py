@@ -0,0 +1,140 @@
+"""
+Process pool used to analyze uploaded images in parallel.
+
+The pool is created lazily and shared by every request handled by this
+worker process, so the cost of starting interpreters and importing
+numpy/OpenCV is paid once rather than per upload. Each web worker process
+has its own pool: size it as cores / web workers.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+from django.conf import settings
+
+from .utils import analyze_drone_image, frame_signature
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    # One OpenCV thread per process; the pool already provides the parallelism
+    cv2.setNumThreads(1)
+
+
+# Workers per pool when ANALYSIS_POOL_WORKERS is None. Every web worker
+# process (gunicorn/uwsgi worker) owns a pool, so all cores per pool would
+# run cores x web workers analyses at once.
+DEFAULT_POOL_WORKERS = 2
+
+
+def pool_size():
+    """
+    Configured worker count (ANALYSIS_POOL_WORKERS, default
+    DEFAULT_POOL_WORKERS capped at the core count).
+    """
+    workers = getattr(settings, "ANALYSIS_POOL_WORKERS", None)
+    if workers is None:
+        workers = min(DEFAULT_POOL_WORKERS, os.cpu_count() or 1)
+    return workers
+
+
+def get_pool():
+    """Return the shared pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=pool_size(),
+                # spawn: never fork a process that holds DB connections,
+                # request threads or a loaded torch model
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def analyze_images(jobs):
+    """
+    Analyze many images and return their results in job order.
+
+    jobs is a list of (image, kwargs) pairs passed to analyze_drone_image;
+    image is a path or an in-memory buffer (pickled to the worker). A failing image yields None in its slot without
+    affecting the others; if a worker process dies (e.g. killed for memory)
+    the pool is rebuilt for the next request.
+    """
+    if pool_size() <= 0 or len(jobs) <= 1:
+        # Run inline: nothing to parallelize, or the pool is disabled
+        return [_analyze_inline(path, kwargs) for path, kwargs in jobs]
+
+    pool = get_pool()
+    futures = [pool.submit(analyze_drone_image, path, **kwargs) for path, kwargs in jobs]
+    return _gather([path for path, _ in jobs], futures, "Analysis", None)
+
+
+def sign_frames(images):
+    """
+    frame_signature() of many images (paths or buffers) on the pool, in
+    order; "" for an image that could not be read. Even a single image
+    is signed in a pool process: decoding is image math, which request
+    threads leave to the pool.
+    """
+    if pool_size() <= 0:
+        return [_sign_inline(image) for image in images]
+    pool = get_pool()
+    futures = [pool.submit(frame_signature, image) for image in images]
+    return _gather(images, futures, "Frame signature", "")
+
+
+def _gather(images, futures, what, failed):
+    """Results of futures in order, failed in the slot of each that raised."""
+    results = []
+    broken = False
+    for image, future in zip(images, futures):
+        try:
+            results.append(future.result())
+        except BrokenProcessPool as e:
+            broken = True
+            print(f"{what} failed for {_describe(image)}: {e}")
+            results.append(failed)
+        except Exception as e:
+            print(f"{what} failed for {_describe(image)}: {e}")
+            results.append(failed)
+
+    if broken:
+        _reset_pool()
+    return results
+
+
+def _describe(image):
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return f"<{len(image)} byte upload>"
+    return image
+
+
+def _analyze_inline(path, kwargs):
+    try:
+        return analyze_drone_image(path, **kwargs)
+    except Exception as e:
+        print(f"Analysis failed for {_describe(path)}: {e}")
+        return None
+
+
+def _sign_inline(image):
+    try:
+        return frame_signature(image)
+    except Exception as e:
+        print(f"Frame signature failed for {_describe(image)}: {e}")
+        return ""
@@ -1,7 +1,1163 @@
-from .models import DroneImage
+import base64
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
 
-def get_latest_analysis():
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+from PIL import Image
+
+from . import counters
+from .indices import DEFAULT_INDICES
+from .models import AnalysisSession, ChunkedUpload, DroneImage, MetricRollup
+from .pool import analyze_images, pool_size, sign_frames
+from .uploadhandlers import create_upload_file
+from .utils import (
+    can_read_windowed,
+    estimate_yield,
+    generate_recommendations,
+    image_pixel_count,
+    signature_distance,
+)
+
+
+def get_latest_session(owner, status=None):
+    """The owner's newest session (optionally with status), or None."""
+    # Seeks session_owner_created_idx instead of sorting every session
+    sessions = AnalysisSession.objects.filter(owner=owner)
+    if status is not None:
+        sessions = sessions.filter(status=status)
+    return sessions.order_by("-created_at").first()
+
+
+def get_latest_analysis(owner):
+    """The newest analyzed image of the owner's latest completed session, or None."""
+    session = get_latest_session(owner, AnalysisSession.STATUS_COMPLETED)
+    if session is None:
+        return None
+    # The chatbot needs canopy and stress; subsets may leave stress out
+    return session.images.filter(
+        canopy_cover__isnull=False, stress_percentage__isnull=False
+    ).order_by("-timestamp").first()
+
+
+def analysis_options(full_path, analysis_mode, decode_scale):
+    """
+    Pick how a stored (or buffered) image is analyzed.
+
+    Returns (analysis_mode, kwargs for analyze_drone_image). Previews keep
+    their scale; anything above ANALYSIS_TILED_PIXEL_THRESHOLD is read
+    window by window.
+    """
+    if analysis_mode == DroneImage.MODE_PREVIEW:
+        return DroneImage.MODE_PREVIEW, {"scale": decode_scale}
     try:
-        return DroneImage.objects.latest('timestamp')
-    except DroneImage.DoesNotExist:
+        pixels = image_pixel_count(full_path)
+    except Exception:
+        pixels = 0  # unreadable header; the analysis itself reports the failure
+    if pixels > settings.ANALYSIS_TILED_PIXEL_THRESHOLD:
+        return DroneImage.MODE_TILED, {"tiled": True}
+    return DroneImage.MODE_FULL, {}
+
+
+def oversized_image_error(image_path, name):
+    """
+    Why an image is too large to analyze, or None.
+
+    Images above ANALYSIS_TILED_PIXEL_THRESHOLD are only analyzed when
+    open_windowed() can read them (TIFF or .npy); any other format would
+    be decoded whole. Images Pillow refuses as decompression bombs are
+    too large as well. Unreadable headers are left to the analysis.
+    """
+    if can_read_windowed(image_path):
+        return None
+    try:
+        pixels = image_pixel_count(image_path)
+    except Image.DecompressionBombError:
+        pixels = None
+    except Exception:
+        return None
+    limit = settings.ANALYSIS_TILED_PIXEL_THRESHOLD
+    if pixels is None or pixels > limit:
+        return f"{name} has more than {limit} pixels; upload large orthomosaics as TIFF"
+    return None
+
+
+def oversized_upload_error(images):
+    """oversized_image_error() of the first oversized upload, or None."""
+    for image_file in images:
+        storage_name = getattr(image_file, "storage_name", None)
+        source = default_storage.path(storage_name) if storage_name else image_file
+        error = oversized_image_error(source, image_file.name)
+        if not storage_name:
+            image_file.seek(0)
+        if error:
+            return error
+    return None
+
+
+METRIC_FIELDS = ("vari", "gli", "exg", "canopy_cover", "stress_percentage", "yield_estimate")
+
+# DroneImage/AnalysisSession columns of registry indices; the others are
+# stored in their extra_indices JSON
+INDEX_FIELDS = {
+    "vari": "vari",
+    "exg": "exg",
+    "gli": "gli",
+    "canopy_pct": "canopy_cover",
+    "stress_pct": "stress_percentage",
+}
+
+# Averaged onto AnalysisSession by finalize_session
+SESSION_METRIC_FIELDS = ("canopy_cover", "stress_percentage", "yield_estimate", "vari", "gli", "exg")
+
+
+def find_cached_analysis(content_hash, analysis_mode, decode_scale, rasters=False, grid=None,
+                         indices=None):
+    """Return an analyzed DroneImage with the same bytes, or None (see find_cached_analyses)."""
+    return find_cached_analyses(
+        [content_hash], analysis_mode, decode_scale, rasters, grid, indices
+    ).get(content_hash)
+
+
+def find_cached_analyses(content_hashes, analysis_mode, decode_scale, rasters=False, grid=None,
+                         indices=None):
+    """
+    Map each content hash with an earlier analysis to its latest DroneImage.
+
+    Full-resolution requests only reuse full or tiled results; previews
+    also accept a preview taken at the same scale. Only analyses that
+    computed every requested index qualify, and when rasters or zonal
+    statistics are wanted, only analyses that produced them (on the same
+    grid). Costs two queries however many hashes are looked up.
+    """
+    content_hashes = {content_hash for content_hash in content_hashes if content_hash}
+    if not content_hashes:
+        return {}
+    candidates = DroneImage.objects.filter(
+        content_hash__in=content_hashes, processed=True, canopy_cover__isnull=False
+    ).exclude(analysis_weight=0, reused=False)  # skipped near-duplicates hold copied metrics
+    for name in indices or DEFAULT_INDICES:
+        if name in INDEX_FIELDS:
+            candidates = candidates.filter(**{f"{INDEX_FIELDS[name]}__isnull": False})
+        else:
+            candidates = candidates.filter(extra_indices__has_key=name)
+    if rasters:
+        candidates = candidates.filter(raster_levels__gt=0)
+    if grid:
+        candidates = candidates.filter(
+            zonal_rows=grid[0], zonal_cols=grid[1], zonal_stats__isnull=False
+        )
+    if analysis_mode == DroneImage.MODE_PREVIEW:
+        candidates = candidates.exclude(
+            Q(analysis_mode=DroneImage.MODE_PREVIEW) & ~Q(decode_scale=decode_scale)
+        )
+    else:
+        candidates = candidates.exclude(analysis_mode=DroneImage.MODE_PREVIEW)
+    latest = candidates.values("content_hash").annotate(latest=Max("id")).values("latest")
+    return {drone_image.content_hash: drone_image for drone_image in DroneImage.objects.filter(id__in=latest)}
+
+
+ZONAL_FIELDS = ("zonal_rows", "zonal_cols", "zonal_stats")
+
+# Which indices were computed, the values without a column and the image size
+EXTRA_RESULT_FIELDS = ("indices", "extra_indices", "pixel_count")
+
+
+def cached_metrics(drone_image):
+    """Copy the metric fields (and zonal statistics) of an earlier analysis."""
+    metrics = {
+        field: getattr(drone_image, field)
+        for field in METRIC_FIELDS + EXTRA_RESULT_FIELDS + ZONAL_FIELDS + ("frame_signature",)
+    }
+    if not metrics["pixel_count"]:
+        # Analyzed before pixel counts were stored; the header is enough
+        try:
+            metrics["pixel_count"] = image_pixel_count(drone_image.image.path)
+        except Exception as e:
+            print(f"Pixel count failed: {e}")
+    return metrics
+
+
+def discard_uploads(images):
+    """Delete uploads the ingest handler already wrote to storage."""
+    for image_file in images:
+        storage_name = getattr(image_file, "storage_name", None)
+        if storage_name:
+            image_file.close()
+            default_storage.delete(storage_name)
+
+
+def stage_uploads(images, analysis_mode, decode_scale, rasters=False, grid=None, dedupe=False,
+                  indices=None):
+    """
+    Store uploaded images and decide which of them need analyzing.
+
+    Returns one dict per upload with the stored file path, content hash,
+    analysis mode and raster location. Uploads whose bytes were analyzed
+    before carry the earlier metrics under "metrics" and are not kept in
+    storage; uploads to be analyzed carry "full_path", the "source" to
+    analyze and the analyze_drone_image "options". The source is the
+    in-memory upload when IngestUploadHandler buffered it (and the image
+    is not read window by window), otherwise the stored path. The same
+    bytes uploaded twice in one request share the first upload's entry
+    (and file). With dedupe set every entry also carries its
+    "frame_signature" for group_near_duplicates(), computed on the process
+    pool like the analyses; without, signatures are only those stored with
+    earlier analyses.
+    """
+    staged, first_by_hash = [], {}
+    cache = find_cached_analyses(
+        [getattr(image_file, "content_hash", "") for image_file in images],
+        analysis_mode, decode_scale, rasters, grid, indices,
+    )
+    for image_file in images:
+        content_hash = getattr(image_file, "content_hash", "")
+        # Already written to storage by IngestUploadHandler
+        file_path = getattr(image_file, "storage_name", None)
+        cached = cache.get(content_hash)
+        if cached is not None:
+            counters.incr("analysis_cache.hits")
+            if file_path:
+                discard_uploads([image_file])
+            metrics = cached_metrics(cached)
+            staged.append({
+                "file_path": cached.image.name,
+                "content_hash": content_hash,
+                "analysis_mode": cached.analysis_mode,
+                "decode_scale": cached.decode_scale,
+                "metrics": metrics,
+                "frame_signature": metrics["frame_signature"],
+                "raster_path": cached.raster_path,
+                "raster_levels": cached.raster_levels,
+                "reused": True,
+            })
+            continue
+
+        if content_hash in first_by_hash:
+            counters.incr("analysis_cache.hits")
+            if file_path:
+                discard_uploads([image_file])
+            staged.append(dict(first_by_hash[content_hash], reused=True))
+            continue
+
+        counters.incr("analysis_cache.misses")
+        if not file_path:
+            file_path = default_storage.save(f"drone_images/{image_file.name}", image_file)
+        full_path = default_storage.path(file_path)
+        buffer = getattr(image_file, "buffer", None)
+        # Preview, or window by window for very large orthomosaics
+        mode, options = analysis_options(
+            buffer if buffer is not None else full_path, analysis_mode, decode_scale
+        )
+        raster_path = ""
+        if rasters and mode != DroneImage.MODE_TILED:
+            raster_path = f"index_rasters/{content_hash or uuid.uuid4().hex}-{decode_scale}"
+            options["raster_dir"] = default_storage.path(raster_path)
+        if grid:
+            options["grid"] = grid
+        if indices:
+            options["indices"] = indices
+        entry = {
+            "file_path": file_path,
+            "full_path": full_path,
+            # Tiled analysis needs the stored file to read it by window
+            "source": buffer if buffer is not None and mode != DroneImage.MODE_TILED else full_path,
+            "content_hash": content_hash,
+            "analysis_mode": mode,
+            "decode_scale": decode_scale,
+            "options": options,
+            "raster_path": raster_path,
+            "raster_levels": 0,
+            "reused": False,
+            "frame_signature": "",
+        }
+        if content_hash:
+            first_by_hash[content_hash] = entry
+        staged.append(entry)
+
+    if dedupe:
+        # One signature per stored file (repeated bytes share the file)
+        unsigned = {}
+        for entry in staged:
+            if not entry["frame_signature"]:
+                unsigned.setdefault(entry["file_path"], entry.get("source") or default_storage.path(entry["file_path"]))
+        signatures = dict(zip(unsigned, sign_frames(list(unsigned.values()))))
+        for entry in staged:
+            if not entry["frame_signature"]:
+                entry["frame_signature"] = signatures[entry["file_path"]]
+    return staged
+
+
+def near_duplicate_distance(a, b):
+    """
+    Registration mismatch between two frame signatures when the frames
+    count as near duplicates: overlapping by ANALYSIS_DUPLICATE_MIN_OVERLAP
+    of the frame with a mismatch of at most ANALYSIS_DUPLICATE_MAX_MISMATCH,
+    and within ANALYSIS_DUPLICATE_MAX_COVER_DELTA points of canopy and
+    stress. None otherwise, or when either frame is unsigned.
+    """
+    max_mismatch = settings.ANALYSIS_DUPLICATE_MAX_MISMATCH
+    if max_mismatch is None or not a or not b:
         return None
+    distance = signature_distance(a, b, settings.ANALYSIS_DUPLICATE_MIN_OVERLAP)
+    if distance is None:
+        return None
+    mismatch, cover_delta = distance
+    if mismatch > max_mismatch or cover_delta > settings.ANALYSIS_DUPLICATE_MAX_COVER_DELTA:
+        return None
+    return mismatch
+
+
+def group_near_duplicates(staged):
+    """
+    Group near-identical frames among staged uploads, in upload order.
+
+    A frame that is a near duplicate (near_duplicate_distance) of an
+    earlier representative joins its group (the closest one), otherwise
+    it starts a group; unsigned frames are never grouped. Sets each
+    entry's "representative" (index of the group's first entry, None for
+    that entry) and "analysis_weight": the first
+    ANALYSIS_DUPLICATE_SAMPLE frames of a group share a weight of 1 and
+    are analyzed, the rest get 0 and copy the representative's metrics.
+    """
+    representatives, groups = [], {}
+    for index, entry in enumerate(staged):
+        entry["representative"], entry["analysis_weight"] = None, 1.0
+        if not entry.get("frame_signature"):
+            continue
+        distances = []
+        for rep in representatives:
+            distance = near_duplicate_distance(entry["frame_signature"], staged[rep]["frame_signature"])
+            if distance is not None:
+                distances.append((distance, rep))
+        distance, rep = min(distances, default=(None, None))
+        if rep is not None:
+            entry["representative"] = rep
+            groups[rep].append(index)
+        else:
+            representatives.append(index)
+            groups[index] = [index]
+
+    for members in groups.values():
+        analyzed = members[:settings.ANALYSIS_DUPLICATE_SAMPLE]
+        for index in members:
+            staged[index]["analysis_weight"] = 1 / len(analyzed) if index in analyzed else 0.0
+    return staged
+
+
+def duplicate_metrics(representative):
+    """Metric fields a skipped near-duplicate copies from its representative."""
+    return {field: getattr(representative, field) for field in METRIC_FIELDS + EXTRA_RESULT_FIELDS}
+
+
+def image_metrics(results):
+    """Map analyze_drone_image output onto DroneImage fields."""
+    fields = {field: results.get(name) for name, field in INDEX_FIELDS.items()}
+    fields["extra_indices"] = {
+        name: results[name] for name in results["indices"] if name not in INDEX_FIELDS
+    }
+    fields["indices"] = ",".join(results["indices"])
+    fields["pixel_count"] = results["pixels"]
+    # The yield model needs both canopy and stress
+    fields["yield_estimate"] = estimate_yield(
+        results["canopy_pct"], results["stress_pct"]
+    )["yield_estimate"] if "stress_pct" in results else None
+    if "zonal_stats" in results:
+        fields["zonal_rows"], fields["zonal_cols"] = results["zonal_grid"]
+        fields["zonal_stats"] = results["zonal_stats"]
+    return fields
+
+
+# DroneImage columns written when an image is analyzed or copies metrics
+RESULT_FIELDS = METRIC_FIELDS + EXTRA_RESULT_FIELDS + ZONAL_FIELDS + (
+    "frame_signature", "analysis_mode", "raster_path", "raster_levels", "reused", "processed",
+)
+
+
+def bulk_create_images(session, drone_images):
+    """
+    Insert DroneImage rows of a session with one INSERT per batch.
+
+    Near-duplicates reference representatives from the same list, so rows
+    without a representative go first. Backends that do not return primary
+    keys from bulk inserts (MySQL) get them back with one query: the
+    session is new or locked, so its newest rows are the ones just inserted.
+    """
+    representatives = [image for image in drone_images if image.representative is None]
+    duplicates = [image for image in drone_images if image.representative is not None]
+    DroneImage.objects.bulk_create(representatives)
+    if duplicates and representatives[0].pk is None:
+        ids = session.images.order_by("-id").values_list("id", flat=True)[:len(representatives)]
+        for drone_image, pk in zip(representatives, list(ids)[::-1]):
+            drone_image.pk = pk
+    DroneImage.objects.bulk_create(duplicates)
+
+
+def image_weight(session, drone_image):
+    """Weight of an image in its session's averages."""
+    if session.weighting == AnalysisSession.WEIGHT_PIXELS:
+        return drone_image.analysis_weight * drone_image.pixel_count
+    return drone_image.analysis_weight
+
+
+def add_to_stats(stats, value, weight):
+    """Fold one weighted value into running stats (weighted Welford update)."""
+    stats["n"] = stats.get("n", 0) + 1
+    stats["w"] = stats.get("w", 0.0) + weight
+    mean = stats.get("mean", 0.0)
+    delta = value - mean
+    stats["mean"] = mean + delta * weight / stats["w"]
+    stats["m2"] = stats.get("m2", 0.0) + weight * delta * (value - stats["mean"])
+
+
+def fold_image(stats, session, drone_image):
+    """Fold an analyzed image's metrics into a session's running stats."""
+    weight = image_weight(session, drone_image)
+    if weight <= 0 or drone_image.canopy_cover is None:
+        return
+    values = {field: getattr(drone_image, field) for field in SESSION_METRIC_FIELDS}
+    values.update(drone_image.extra_indices)
+    for name, value in values.items():
+        if value is not None:
+            add_to_stats(stats.setdefault(name, {}), value, weight)
+
+
+def session_stats(session):
+    """
+    Running stats of a session's analyzed images, computed from scratch.
+
+    Images are folded in id order with the same Welford updates as
+    append_to_session() applies, so rebuilding and appending agree (a
+    sums-of-squares query loses m2 to cancellation when values barely vary).
+    """
+    stats = {}
+    analyzed = session.images.filter(
+        processed=True, canopy_cover__isnull=False, analysis_weight__gt=0
+    ).only(  # session too: the related manager reads it back on every row
+        "session", *SESSION_METRIC_FIELDS, "extra_indices", "analysis_weight", "pixel_count"
+    )
+    for drone_image in analyzed.order_by("id").iterator():
+        fold_image(stats, session, drone_image)
+    return stats
+
+
+def apply_running_stats(session):
+    """Set the session's averages and status from its running stats."""
+    stats = session.running_stats
+    for field in SESSION_METRIC_FIELDS:
+        setattr(session, field, stats[field]["mean"] if field in stats else None)
+    session.extra_indices = {
+        name: entry["mean"] for name, entry in stats.items() if name not in SESSION_METRIC_FIELDS
+    }
+    session.status = (
+        AnalysisSession.STATUS_COMPLETED if session.canopy_cover is not None
+        else AnalysisSession.STATUS_FAILED
+    )
+
+
+def finalize_session(session):
+    """
+    Average the analyzed images' metrics onto the session and complete it.
+
+    Means are weighted by analysis_weight, so a group of near-duplicate
+    frames counts as one image and skipped frames not at all, and by
+    pixel count for sessions weighted by pixels. Each metric is averaged
+    over the images that computed it.
+    """
+    session.running_stats = session_stats(session)
+    apply_running_stats(session)
+    update_rollups(session)
+    session.save()
+
+
+def append_to_session(session_id, drone_images, num_uploads):
+    """
+    Add analyzed DroneImage rows (of num_uploads uploads) to a completed session.
+
+    The rows are inserted in bulk and folded into the session's running
+    stats, so the averages update without reloading earlier images.
+    Returns the updated session, or None when it is not completed or
+    failed (still queued, processing or receiving uploads).
+    """
+    with transaction.atomic():
+        session = AnalysisSession.objects.select_for_update().get(pk=session_id)
+        if session.status not in (AnalysisSession.STATUS_COMPLETED, AnalysisSession.STATUS_FAILED):
+            return None
+        if not session.running_stats and session.canopy_cover is not None:
+            # Finalized before running stats were kept
+            session.running_stats = session_stats(session)
+
+        for drone_image in drone_images:
+            drone_image.session = session
+        bulk_create_images(session, drone_images)
+
+        for drone_image in drone_images:
+            fold_image(session.running_stats, session, drone_image)
+
+        apply_running_stats(session)
+        update_rollups(session)
+        session.images_total += num_uploads
+        session.images_done += num_uploads
+        session.save()
+    return session
+
+
+# Metrics kept in MetricRollup
+ROLLUP_FIELDS = ("canopy_cover", "stress_percentage", "yield_estimate")
+
+
+def rollup_contribution(session):
+    """
+    {metric: [count, sum]} a session adds to its owner's rollups: its
+    analyzed image count and that count times its mean. Empty unless the
+    session is completed and owned.
+    """
+    if session.status != AnalysisSession.STATUS_COMPLETED or session.owner_id is None:
+        return {}
+    contribution = {}
+    for field in ROLLUP_FIELDS:
+        stats = session.running_stats.get(field)
+        if stats:
+            contribution[field] = [stats["n"], stats["mean"] * stats["n"]]
+        elif getattr(session, field) is not None:
+            # Finalized before running stats were kept
+            count = session.images_done or 1
+            contribution[field] = [count, getattr(session, field) * count]
+    return contribution
+
+
+def period_starts(moment):
+    """First day of each MetricRollup period containing moment (in TIME_ZONE)."""
+    day = timezone.localdate(moment)
+    return {
+        MetricRollup.PERIOD_DAY: day,
+        MetricRollup.PERIOD_WEEK: day - timedelta(days=day.weekday()),
+    }
+
+
+def update_rollups(session):
+    """
+    Move the session's rollup contribution to its current one.
+
+    Only the difference from session.rolled_up is applied, as F()
+    increments, so sessions that are appended to later are not counted
+    twice. Call inside the transaction that saves the session.
+    """
+    new, old = rollup_contribution(session), session.rolled_up or {}
+    if new == old:
+        return
+    changes = {"sessions": F("sessions") + (bool(new) - bool(old))}
+    for field in ROLLUP_FIELDS:
+        count, total = new.get(field, (0, 0.0))
+        old_count, old_total = old.get(field, (0, 0.0))
+        changes[f"{field}_count"] = F(f"{field}_count") + (count - old_count)
+        changes[f"{field}_sum"] = F(f"{field}_sum") + (total - old_total)
+    for period, start in period_starts(session.created_at).items():
+        rollup, _ = MetricRollup.objects.get_or_create(
+            owner_id=session.owner_id, period=period, period_start=start
+        )
+        MetricRollup.objects.filter(pk=rollup.pk).update(**changes)
+    session.rolled_up = new
+
+
+def rebuild_rollups(owner=None, chunk_size=2000):
+    """
+    Recompute MetricRollup (of one owner, or everyone) from the sessions.
+
+    Sessions are streamed in chunks and totals kept per period, so memory
+    grows with the number of periods, not sessions. Returns the number of
+    rollup rows written.
+    """
+    sessions = AnalysisSession.objects.filter(owner__isnull=False)
+    rollups = MetricRollup.objects.all()
+    if owner is not None:
+        sessions, rollups = sessions.filter(owner=owner), rollups.filter(owner=owner)
+
+    totals, changed = {}, []
+    with transaction.atomic():
+        rollups.delete()
+        for session in sessions.only(
+            "session_id", "owner", "created_at", "status", "images_done", "running_stats",
+            "rolled_up", *ROLLUP_FIELDS,
+        ).iterator(chunk_size=chunk_size):
+            contribution = rollup_contribution(session)
+            if contribution != session.rolled_up:
+                session.rolled_up = contribution
+                changed.append(session)
+                if len(changed) >= chunk_size:
+                    AnalysisSession.objects.bulk_update(changed, ["rolled_up"])
+                    changed = []
+            if not contribution:
+                continue
+            for period, start in period_starts(session.created_at).items():
+                rollup = totals.setdefault(
+                    (session.owner_id, period, start),
+                    MetricRollup(owner_id=session.owner_id, period=period, period_start=start),
+                )
+                rollup.sessions += 1
+                for field, (count, total) in contribution.items():
+                    setattr(rollup, f"{field}_count", getattr(rollup, f"{field}_count") + count)
+                    setattr(rollup, f"{field}_sum", getattr(rollup, f"{field}_sum") + total)
+        AnalysisSession.objects.bulk_update(changed, ["rolled_up"])
+        MetricRollup.objects.bulk_create(totals.values(), batch_size=chunk_size)
+    return len(totals)
+
+
+def metric_trends(owner, period, start=None, end=None):
+    """
+    Per-period means of the owner's completed sessions, oldest first.
+
+    Reads MetricRollup only, so the cost depends on the number of periods
+    in [start, end], not on how many sessions or images there are.
+    """
+    rollups = MetricRollup.objects.filter(owner=owner, period=period)
+    if start is not None:
+        rollups = rollups.filter(period_start__gte=start)
+    if end is not None:
+        rollups = rollups.filter(period_start__lte=end)
+    return [
+        {
+            "period_start": rollup.period_start,
+            "sessions": rollup.sessions,
+            "images": round(rollup.canopy_cover_count),
+            **{field: round_or_none(rollup.mean(field), 2) for field in ROLLUP_FIELDS},
+        }
+        for rollup in rollups.order_by("period_start")
+    ]
+
+
+def round_or_none(value, digits):
+    return round(value, digits) if value is not None else None
+
+
+def session_summary(session, num_images):
+    """Build the crop-analysis response body for a completed session."""
+    # Build dictionary for recommendation system
+    analysis_summary = {
+        "canopy_cover": session.canopy_cover,
+        "stress_percentage": session.stress_percentage,
+        "yield_estimate": session.yield_estimate,
+        "vari": session.vari,
+        "gli": session.gli,
+        "exg": session.exg,
+    }
+    # Generate recommendations (they weigh every metric, so only for full sets)
+    recommendations = (
+        generate_recommendations(analysis_summary)
+        if None not in analysis_summary.values() else []
+    )
+
+    response = {
+        "session_id": session.session_id,
+        "num_images_processed": num_images,
+        "canopy_cover": round_or_none(session.canopy_cover, 2),
+        "stress_percentage": round_or_none(session.stress_percentage, 2),
+        "yield_estimate": round_or_none(session.yield_estimate, 2),
+        # NDVI-like indices
+        "vari": session.vari,
+        "gli": session.gli,
+        "exg": session.exg,
+        "recommendations": recommendations
+    }
+    if session.extra_indices:
+        response["extra_indices"] = session.extra_indices
+    if session.running_stats:
+        # Spread between images (weighted standard deviation)
+        response["std_dev"] = {
+            name: round((stats["m2"] / stats["w"]) ** 0.5, 3)
+            for name, stats in session.running_stats.items()
+        }
+    return response
+
+
+def claim_pending_session():
+    """
+    Take the oldest pending session off the queue and mark it processing.
+
+    Rows are locked with SKIP LOCKED so several workers can poll the same
+    table without claiming the same session twice.
+    """
+    with transaction.atomic():
+        session = (
+            AnalysisSession.objects.select_for_update(skip_locked=True)
+            .filter(status=AnalysisSession.STATUS_PENDING)
+            .order_by("created_at")
+            .first()
+        )
+        if session is not None:
+            session.status = AnalysisSession.STATUS_PROCESSING
+            session.save(update_fields=["status"])
+        return session
+
+
+def process_session(session):
+    """
+    Analyze every unprocessed image of a session, then finalize it.
+
+    Images go to the process pool in batches so images_done advances while
+    the job runs and the status endpoint can report progress. A session
+    still receiving chunked uploads is put back to "receiving" once its
+    completed files are done instead of being finalized; the next
+    completed upload queues it again.
+    """
+    batch_size = max(1, pool_size()) * 2
+
+    while True:
+        pending = list(
+            session.images.filter(processed=False, analysis_weight__gt=0).order_by("id")[:batch_size]
+        )
+        if session.dedupe and pending:
+            pending = assign_duplicate_groups(session, pending)
+            if not pending:
+                continue  # the whole batch copies earlier frames' metrics
+        if not pending:
+            copy_duplicate_metrics(session)
+            with transaction.atomic():
+                locked = AnalysisSession.objects.select_for_update().get(pk=session.pk)
+                if locked.images.filter(processed=False).exists():
+                    continue  # an upload completed since the last batch
+                if locked.images.count() < locked.images_total:
+                    locked.status = AnalysisSession.STATUS_RECEIVING
+                    locked.save(update_fields=["status"])
+                else:
+                    finalize_session(locked)
+            session.status = locked.status
+            return
+
+        to_analyze, jobs = [], []
+        for drone_image in pending:
+            # The grid requested at upload time is stored before analysis
+            grid = (drone_image.zonal_rows, drone_image.zonal_cols) if drone_image.zonal_rows else None
+            indices = drone_image.index_names()
+            # An identical upload may have been analyzed since this one was queued
+            cached = find_cached_analysis(
+                drone_image.content_hash, drone_image.analysis_mode,
+                drone_image.decode_scale, rasters=bool(drone_image.raster_path), grid=grid,
+                indices=indices,
+            )
+            if cached is not None:
+                counters.incr("analysis_cache.hits")
+                for field, value in cached_metrics(cached).items():
+                    setattr(drone_image, field, value)
+                drone_image.raster_path = cached.raster_path
+                drone_image.raster_levels = cached.raster_levels
+                drone_image.reused = True
+                drone_image.processed = True
+                continue
+
+            counters.incr("analysis_cache.misses")
+            analysis_mode, options = analysis_options(
+                drone_image.image.path, drone_image.analysis_mode, drone_image.decode_scale
+            )
+            drone_image.analysis_mode = analysis_mode
+            if drone_image.raster_path and analysis_mode != DroneImage.MODE_TILED:
+                options["raster_dir"] = default_storage.path(drone_image.raster_path)
+            if grid:
+                options["grid"] = grid
+            options["indices"] = indices
+            to_analyze.append(drone_image)
+            jobs.append((drone_image.image.path, options))
+
+        for drone_image, results in zip(to_analyze, analyze_images(jobs)):
+            if results is not None:
+                for field, value in image_metrics(results).items():
+                    setattr(drone_image, field, value)
+                drone_image.raster_levels = results.get("raster_levels", 0)
+            drone_image.processed = True  # failed images keep null metrics
+
+        # One transaction per batch rather than one commit per image
+        with transaction.atomic():
+            DroneImage.objects.bulk_update(pending, RESULT_FIELDS)
+            session.images_done += len(pending)
+            session.save(update_fields=["images_done"])
+
+
+def assign_duplicate_groups(session, pending):
+    """
+    Sign a batch of queued images on the pool and group each (in id order)
+    with the session's stored images; returns the ones still to analyze.
+
+    Images signed already were grouped by an earlier run. A frame that
+    could not be signed stays ungrouped and is analyzed.
+    """
+    unsigned = [drone_image for drone_image in pending if not drone_image.frame_signature]
+    if not unsigned:
+        return pending
+    signatures = sign_frames([drone_image.image.path for drone_image in unsigned])
+    with transaction.atomic():
+        locked = AnalysisSession.objects.select_for_update().get(pk=session.pk)
+        for drone_image, signature in zip(unsigned, signatures):
+            representative, weight = join_duplicate_group(locked, signature)
+            drone_image.frame_signature = signature
+            drone_image.representative = representative
+            drone_image.analysis_weight = weight
+            drone_image.save(update_fields=["frame_signature", "representative", "analysis_weight"])
+    return [drone_image for drone_image in pending if drone_image.analysis_weight > 0]
+
+
+def copy_duplicate_metrics(session):
+    """Give skipped near-duplicates of analyzed representatives their metrics."""
+    skipped = session.images.filter(
+        processed=False, analysis_weight=0, representative__processed=True
+    ).select_related("representative")
+    done = []
+    for drone_image in skipped:
+        for field, value in duplicate_metrics(drone_image.representative).items():
+            setattr(drone_image, field, value)
+        drone_image.processed = True
+        done.append(drone_image)
+    if done:
+        with transaction.atomic():
+            DroneImage.objects.bulk_update(
+                done, METRIC_FIELDS + EXTRA_RESULT_FIELDS + ("processed",)
+            )
+            session.images_done += len(done)
+            session.save(update_fields=["images_done"])
+
+
+def upload_quota_error(owner, declared):
+    """
+    Why owner may not open a batch of the declared files, or None.
+
+    Unfinished uploads count against CHUNKED_UPLOAD_MAX_ACTIVE and their
+    declared sizes against CHUNKED_UPLOAD_MAX_ACTIVE_BYTES, since each
+    holds a sparse file of its full size. Call with the owner row locked.
+    """
+    active = owner.chunked_uploads.filter(completed_at__isnull=True).aggregate(
+        count=Count("pk"), size=Sum("size")
+    )
+    if active["count"] + len(declared) > settings.CHUNKED_UPLOAD_MAX_ACTIVE:
+        return f"at most {settings.CHUNKED_UPLOAD_MAX_ACTIVE} unfinished uploads are allowed"
+    if (active["size"] or 0) + sum(f["size"] for f in declared) > settings.CHUNKED_UPLOAD_MAX_ACTIVE_BYTES:
+        return f"unfinished uploads may declare at most {settings.CHUNKED_UPLOAD_MAX_ACTIVE_BYTES} bytes"
+    return None
+
+
+def create_upload_batch(owner, files, analysis_mode, decode_scale, rasters=False, grid=None, dedupe=False,
+                        indices=None, weighting=AnalysisSession.WEIGHT_IMAGES):
+    """
+    Open a resumable upload batch: a receiving session plus one
+    ChunkedUpload per declared {"name", "size"} file.
+
+    Each file is created in storage at its full (sparse) size, so chunks
+    can be written at any offset and in any order.
+    """
+    with transaction.atomic():
+        session = AnalysisSession.objects.create(
+            status=AnalysisSession.STATUS_RECEIVING, images_total=len(files), weighting=weighting,
+            owner=owner, dedupe=dedupe,
+        )
+        uploads = []
+        for declared in files:
+            storage_name, f = create_upload_file(os.path.basename(declared["name"]))
+            with f:
+                f.truncate(declared["size"])
+            uploads.append(ChunkedUpload.objects.create(
+                session=session,
+                owner=owner,
+                file_name=declared["name"],
+                size=declared["size"],
+                storage_name=storage_name,
+                analysis_mode=analysis_mode,
+                decode_scale=decode_scale,
+                rasters=rasters,
+                indices=",".join(indices or ()),
+                zonal_rows=grid[0] if grid else 0,
+                zonal_cols=grid[1] if grid else 0,
+            ))
+    return session, uploads
+
+
+def merge_range(ranges, start, end):
+    """Add [start, end) to sorted disjoint [start, end) ranges, merging neighbours."""
+    merged = []
+    for lo, hi in sorted(ranges + [[start, end]]):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+
+UPLOAD_CHUNK_READ = 1 << 20
+
+
+def write_chunk(upload, start, stream, length):
+    """
+    Copy up to length bytes from stream into the upload's file at start.
+
+    The body is copied in UPLOAD_CHUNK_READ pieces and never held whole
+    in memory. Whatever arrived before a dropped connection is still
+    recorded, so the client only resends the remainder. Returns the
+    refreshed upload, or None when it expired meanwhile.
+    """
+    written = 0
+    try:
+        f = open(default_storage.path(upload.storage_name), "r+b")
+    except FileNotFoundError:
+        return None  # dropped by expire_chunked_uploads
+    with f:
+        f.seek(start)
+        while written < length:
+            data = stream.read(min(UPLOAD_CHUNK_READ, length - written))
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().filter(pk=upload.pk).first()
+        if upload is None:
+            return None
+        if written:
+            upload.received = merge_range(upload.received, start, start + written)
+            upload.save(update_fields=["received", "updated_at"])
+    if upload.completed_at is None and upload.received == [[0, upload.size]]:
+        complete_upload(upload)
+        upload.refresh_from_db()
+    return upload
+
+
+def complete_upload(upload):
+    """Hash a fully received file and queue it for analysis in its session."""
+    hasher = hashlib.sha256()
+    with open(default_storage.path(upload.storage_name), "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_READ), b""):
+            hasher.update(block)
+    content_hash = hasher.hexdigest()
+
+    with transaction.atomic():
+        # Session before upload, the order discard_incomplete_uploads locks in
+        session = AnalysisSession.objects.select_for_update().get(pk=upload.session_id)
+        # Two requests may finish the same file; only the first adds the image
+        upload = ChunkedUpload.objects.select_for_update().filter(pk=upload.pk).first()
+        if upload is None or upload.completed_at is not None:
+            return
+        upload.completed_at = timezone.now()
+        upload.save(update_fields=["completed_at"])
+
+        # Too large to read by window: recorded as failed, never decoded
+        error = oversized_image_error(default_storage.path(upload.storage_name), upload.file_name)
+        if error:
+            print(f"Skipping chunked upload: {error}")
+            session.images_done += 1
+            session.save(update_fields=["images_done"])
+
+        # Near-duplicate grouping (session.dedupe) is left to the worker
+        DroneImage.objects.create(
+            session=session,
+            processed=error is not None,
+            image=upload.storage_name,
+            analysis_mode=upload.analysis_mode,
+            decode_scale=upload.decode_scale,
+            content_hash=content_hash,
+            indices=upload.indices,
+            raster_path=f"index_rasters/{content_hash}-{upload.decode_scale}" if upload.rasters else "",
+            zonal_rows=upload.zonal_rows,
+            zonal_cols=upload.zonal_cols,
+        )
+        # Start analyzing completed files while the rest are still arriving
+        if session.status == AnalysisSession.STATUS_RECEIVING:
+            session.status = AnalysisSession.STATUS_PENDING
+            session.save(update_fields=["status"])
+
+
+def join_duplicate_group(session, signature):
+    """
+    group_near_duplicates() for a frame joining a session's stored images
+    (queued and chunked uploads, see assign_duplicate_groups).
+
+    Call with the session row locked. Returns (representative, weight) for
+    the new DroneImage and re-weights the group's analyzed members when
+    the frame is sampled into it.
+    """
+    if not signature:
+        return None, 1.0
+    representatives = session.images.filter(representative__isnull=True).exclude(frame_signature="")
+    distances = []
+    for rep in representatives:
+        distance = near_duplicate_distance(signature, rep.frame_signature)
+        if distance is not None:
+            distances.append((distance, rep))
+    distance, representative = min(distances, key=lambda pair: pair[0], default=(None, None))
+    if representative is None:
+        return None, 1.0
+
+    analyzed = DroneImage.objects.filter(
+        Q(pk=representative.pk) | Q(representative=representative), analysis_weight__gt=0
+    )
+    sampled = analyzed.count()
+    if sampled >= settings.ANALYSIS_DUPLICATE_SAMPLE:
+        return representative, 0.0
+    analyzed.update(analysis_weight=1 / (sampled + 1))
+    return representative, 1 / (sampled + 1)
+
+
+def discard_incomplete_uploads(session):
+    """
+    Drop a session's unfinished chunked uploads and shrink images_total.
+
+    Call with the session row locked. A session left without any images
+    fails; one whose images are all analyzed is finalized.
+    """
+    incomplete = list(session.uploads.filter(completed_at__isnull=True))
+    for upload in incomplete:
+        default_storage.delete(upload.storage_name)
+        upload.delete()
+    session.images_total -= len(incomplete)
+    session.save(update_fields=["images_total"])
+    if session.status == AnalysisSession.STATUS_RECEIVING:
+        if session.images.filter(processed=False).exists():
+            session.status = AnalysisSession.STATUS_PENDING
+            session.save(update_fields=["status"])
+        else:
+            finalize_session(session)
+    return len(incomplete)
+
+
+def expire_chunked_uploads():
+    """
+    Drop unfinished chunked uploads no chunk reached for CHUNKED_UPLOAD_EXPIRY.
+
+    Their sessions go on without them (see discard_incomplete_uploads), as
+    after a finalize with discard_incomplete. Returns the number dropped.
+    """
+    cutoff = timezone.now() - settings.CHUNKED_UPLOAD_EXPIRY
+    stale = AnalysisSession.objects.filter(uploads__completed_at__isnull=True).annotate(
+        last_chunk=Max("uploads__updated_at")
+    ).filter(last_chunk__lt=cutoff).values_list("pk", flat=True)
+    dropped = 0
+    for pk in list(stale):
+        with transaction.atomic():
+            session = AnalysisSession.objects.select_for_update().get(pk=pk)
+            # A chunk may have arrived since the query
+            if not session.uploads.filter(completed_at__isnull=True, updated_at__gte=cutoff).exists():
+                dropped += discard_incomplete_uploads(session)
+    return dropped
+
+
+def session_progress(session):
+    """Build the status-endpoint body of a session."""
+    response = {
+        "session_id": session.session_id,
+        "status": session.status,
+        "images_total": session.images_total,
+        "images_done": session.images_done,
+        "progress": round(session.images_done / session.images_total * 100, 1)
+        if session.images_total else 0.0,
+    }
+    if session.status == AnalysisSession.STATUS_COMPLETED:
+        num_images = session.images.filter(canopy_cover__isnull=False).count()
+        response.update(session_summary(session, num_images))
+    return response
+
+
+# Columns of the per-session image list
+IMAGE_HISTORY_FIELDS = (
+    "id", "image", "timestamp", "processed", "reused", "analysis_mode", "decode_scale",
+    "representative_id", "analysis_weight",
+) + METRIC_FIELDS + ("extra_indices",)
+
+
+def encode_cursor(*values):
+    """Opaque page cursor holding the keyset values of a page's last row."""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Keyset values of encode_cursor(); ValueError if the cursor is malformed."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_page(queryset, limit, cursor_of):
+    """Fetch limit rows plus one to tell whether a next page exists: (rows, next cursor)."""
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], cursor_of(rows[limit - 1])
+
+
+def session_history(owner, limit, cursor=None, created_after=None, created_before=None,
+                    status=None, thresholds=None):
+    """
+    One page of the owner's sessions, newest first, as HISTORY_FIELDS dicts.
+
+    Pages are keyset-paginated on (created_at, session_id) instead of
+    OFFSET: a page starts right after the cursor's row, so it is one range
+    scan of session_owner_history_idx however deep it is, and rows added
+    meanwhile never shift pages. thresholds maps metric fields to (min,
+    max) bounds, either of which may be None. Returns (rows, next_cursor);
+    a malformed cursor raises ValueError.
+    """
+    sessions = AnalysisSession.objects.filter(owner=owner)
+    if created_after is not None:
+        sessions = sessions.filter(created_at__gte=created_after)
+    if created_before is not None:
+        sessions = sessions.filter(created_at__lt=created_before)
+    if status is not None:
+        sessions = sessions.filter(status=status)
+    for field, (low, high) in (thresholds or {}).items():
+        if low is not None:
+            sessions = sessions.filter(**{f"{field}__gte": low})
+        if high is not None:
+            sessions = sessions.filter(**{f"{field}__lte": high})
+    if cursor:
+        try:
+            created_at, session_id = decode_cursor(cursor)
+            created_at, session_id = datetime.fromisoformat(created_at), int(session_id)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cursor") from e
+        sessions = sessions.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, session_id__lt=session_id)
+        )
+    return keyset_page(
+        sessions.order_by("-created_at", "-session_id").values(*AnalysisSession.HISTORY_FIELDS),
+        limit,
+        lambda row: encode_cursor(row["created_at"].isoformat(), row["session_id"]),
+    )
+
+
+def session_image_history(session, limit, cursor=None):
+    """
+    One page of a session's images in id order, as IMAGE_HISTORY_FIELDS
+    dicts, keyset-paginated on id. Returns (rows, next_cursor).
+    """
+    images = session.images.all()
+    if cursor:
+        try:
+            (last_id,) = decode_cursor(cursor)
+            images = images.filter(id__gt=int(last_id))
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cursor") from e
+    return keyset_page(
+        images.order_by("id").values(*IMAGE_HISTORY_FIELDS),
+        limit,
+        lambda row: encode_cursor(row["id"]),
+    )
+
+
+def export_queryset(owner, kind, created_after=None, created_before=None, session_id=None):
+    """
+    The owner's sessions or images (kind "sessions" / "images") to export,
+    optionally limited to a creation range or, for images, one session.
+    """
+    if kind == "sessions":
+        rows, created = AnalysisSession.objects.filter(owner=owner), "created_at"
+    else:
+        rows, created = DroneImage.objects.filter(session__owner=owner), "timestamp"
+        if session_id is not None:
+            rows = rows.filter(session_id=session_id)
+    if created_after is not None:
+        rows = rows.filter(**{f"{created}__gte": created_after})
+    if created_before is not None:
+        rows = rows.filter(**{f"{created}__lt": created_before})
+    return rows
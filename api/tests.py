@@ -1,3 +1,1184 @@
-from django.test import TestCase
+import csv
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+from . import chatcache, counters, inference
+from .exports import EXPORT_COLUMNS, EXPORT_CONTENT_TYPES, export_stream, pq
+from .models import AnalysisSession, ChunkedUpload, DroneImage, MetricRollup
+from .pool import analyze_images
+from .services import (
+    SESSION_METRIC_FIELDS,
+    append_to_session,
+    bulk_create_images,
+    claim_pending_session,
+    finalize_session,
+    group_near_duplicates,
+    metric_trends,
+    rebuild_rollups,
+    session_history,
+)
+from .indices import METRIC_DECIMALS
+from .utils import (
+    accumulate,
+    analyze_drone_image,
+    frame_signature,
+    halve,
+    load_rgb,
+    open_windowed,
+)
+from .views import ChatbotStreamView, ChatbotView
+
+
+def baseline_indices(arr):
+    """The original full-frame float64 formulas, unrounded."""
+    R, G, B = (arr[:, :, i].astype(float) for i in range(3))
+    denominator = G + R - B
+    valid = denominator > 1e-6
+    vari = np.zeros_like(denominator)
+    vari[valid] = (G[valid] - R[valid]) / denominator[valid]
+    hsv = cv2.cvtColor(arr, cv2.COLOR_RGB2HSV)
+    h, s, v = hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
+    brown = (h >= 10) & (h <= 30) & (s >= 50) & (v >= 20) & (v <= 200)
+    return {
+        "vari": np.clip(vari, -1, 1).mean(),
+        "exg": (2 * G - R - B).mean(),
+        "gli": ((2 * G - R - B) / (2 * G + R + B + 1e-6)).mean(),
+        "canopy_pct": np.mean(G > R) * 100,
+        "stress_pct": np.mean(brown) * 100,
+    }
+
+
+def random_field(height, width, seed=0):
+    arr = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    arr[:5, :5] = 0  # G + R - B == 0 and 2G + R + B == 0
+    return arr
+
+
+class IndexKernelTests(SimpleTestCase):
+    def test_matches_float64_baseline(self):
+        # Taller than one band, so the banded sums are exercised too
+        for height, width in ((300, 400), (1000, 1500), (7, 3)):
+            arr = random_field(height, width)
+            expected = baseline_indices(arr)
+            means = accumulate(arr).means()
+            for key, value in expected.items():
+                self.assertAlmostEqual(means[key], value, delta=1e-6, msg=f"{key} at {height}x{width}")
+
+    def test_analyze_drone_image_rounds_baseline(self):
+        arr = random_field(300, 400, seed=1)
+        buffer = io.BytesIO()
+        Image.fromarray(arr).save(buffer, "PNG")
+        results = analyze_drone_image(buffer.getvalue())
+
+        expected = baseline_indices(arr)
+        for key, decimals in (("vari", 3), ("exg", 3), ("gli", 3), ("canopy_pct", 2), ("stress_pct", 2)):
+            self.assertEqual(results[key], round(expected[key], decimals), key)
+        self.assertEqual(results["pixels"], 300 * 400)
+
+
+def analyzed_images(count, seed=0):
+    """Unsaved processed DroneImage rows with varied metrics and pixel counts."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        canopy, stress = rng.uniform(20, 90), rng.uniform(0, 40)
+        images.append(DroneImage(
+            image=f"drone_images/frame{i}.jpg",
+            processed=True,
+            canopy_cover=canopy,
+            stress_percentage=stress,
+            yield_estimate=canopy / 20,
+            vari=rng.uniform(-0.2, 0.4),
+            gli=rng.uniform(-0.1, 0.3),
+            exg=rng.uniform(-10, 60),
+            extra_indices={"ngrdi": rng.uniform(-0.2, 0.3)},
+            pixel_count=int(rng.integers(1_000_000, 20_000_000)),
+        ))
+    return images
+
+
+def finalized_session(drone_images, created_at=None, **fields):
+    session = AnalysisSession.objects.create(
+        images_total=len(drone_images), images_done=len(drone_images), **fields
+    )
+    if created_at is not None:
+        # auto_now_add ignores a value passed to create()
+        AnalysisSession.objects.filter(pk=session.pk).update(created_at=created_at)
+        session.refresh_from_db()
+    for drone_image in drone_images:
+        drone_image.session = session
+    bulk_create_images(session, drone_images)
+    finalize_session(session)
+    return session
+
+
+class AppendToSessionTests(TestCase):
+    def assert_same_stats(self, session, expected):
+        self.assertEqual(set(session.running_stats), set(expected.running_stats))
+        for name, stats in expected.running_stats.items():
+            self.assertEqual(session.running_stats[name]["n"], stats["n"], name)
+            for key in ("w", "mean", "m2"):
+                self.assertAlmostEqual(
+                    session.running_stats[name][key], stats[key],
+                    delta=1e-9 * max(1.0, abs(stats[key])), msg=f"{name} {key}",
+                )
+        for field in SESSION_METRIC_FIELDS:
+            self.assertAlmostEqual(getattr(session, field), getattr(expected, field), places=9)
+        self.assertAlmostEqual(session.extra_indices["ngrdi"], expected.extra_indices["ngrdi"], places=9)
+
+    def test_append_equals_one_session(self):
+        for weighting in (AnalysisSession.WEIGHT_IMAGES, AnalysisSession.WEIGHT_PIXELS):
+            with self.subTest(weighting=weighting):
+                images = analyzed_images(7)
+                session = finalized_session(images[:3], weighting=weighting)
+                append_to_session(session.pk, images[3:5], 2)
+                session = append_to_session(session.pk, images[5:], 2)
+
+                expected = finalized_session(analyzed_images(7), weighting=weighting)
+                self.assertEqual(session.status, AnalysisSession.STATUS_COMPLETED)
+                self.assertEqual((session.images_total, session.images_done), (7, 7))
+                self.assert_same_stats(session, expected)
+
+    def test_near_constant_metric_keeps_its_spread(self):
+        images = analyzed_images(8)
+        canopy = 61.25 + 1e-6 * np.arange(8)  # sums of squares would cancel this spread
+        for drone_image, value in zip(images, canopy):
+            drone_image.canopy_cover = value
+        weights = np.array([drone_image.pixel_count for drone_image in images], dtype=float)
+        mean = np.average(canopy, weights=weights)
+        expected_m2 = np.sum(weights * (canopy - mean) ** 2)
+
+        rebuilt = finalized_session(images, weighting=AnalysisSession.WEIGHT_PIXELS)
+        for drone_image in images:
+            drone_image.pk = None
+        appended = finalized_session(images[:3], weighting=AnalysisSession.WEIGHT_PIXELS)
+        appended = append_to_session(appended.pk, images[3:], 5)
+        for session in (rebuilt, appended):
+            stats = session.running_stats["canopy_cover"]
+            self.assertAlmostEqual(stats["m2"], expected_m2, delta=1e-6 * expected_m2)
+            self.assertAlmostEqual(stats["mean"], mean, places=9)
+
+    def test_append_to_pending_session_is_refused(self):
+        session = AnalysisSession.objects.create(images_total=1)
+        self.assertIsNone(append_to_session(session.pk, analyzed_images(1), 1))
+        self.assertFalse(session.images.exists())
+
+
+def create_farmer(email="farmer@example.com"):
+    return get_user_model().objects.create_user(
+        email=email, first_name="F", last_name="A", role="farmer", password="x"
+    )
+
+
+class SessionHistoryTests(TestCase):
+    def setUp(self):
+        self.owner = create_farmer()
+        # Ties on created_at: the cursor must fall back to session_id
+        now = timezone.now()
+        for created_at in [now] * 4 + [now - timedelta(hours=1)] * 3 + [now - timedelta(days=1)]:
+            session = AnalysisSession.objects.create(owner=self.owner)
+            AnalysisSession.objects.filter(pk=session.pk).update(created_at=created_at)
+        self.expected = list(
+            AnalysisSession.objects.order_by("-created_at", "-session_id").values_list("session_id", flat=True)
+        )
+
+    def all_pages(self, limit):
+        ids, cursor = [], None
+        while True:
+            rows, cursor = session_history(self.owner, limit, cursor)
+            ids.extend(row["session_id"] for row in rows)
+            if cursor is None:
+                return ids
+
+    def test_pages_with_tied_created_at_neither_overlap_nor_skip(self):
+        for limit in (1, 2, 3, 4, 8, 9):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.all_pages(limit), self.expected)
+
+    def test_new_sessions_do_not_shift_later_pages(self):
+        rows, cursor = session_history(self.owner, 3)
+        AnalysisSession.objects.create(owner=self.owner)
+        rest, _ = session_history(self.owner, 10, cursor)
+        self.assertEqual([row["session_id"] for row in rows + rest], self.expected)
+
+    def test_malformed_cursor(self):
+        with self.assertRaises(ValueError):
+            session_history(self.owner, 2, "not-a-cursor")
+
+
+class MetricRollupTests(TestCase):
+    def rollup_rows(self):
+        return {
+            (rollup.owner_id, rollup.period, rollup.period_start): (
+                rollup.sessions,
+                *(getattr(rollup, f"{field}_{key}")
+                  for field in ("canopy_cover", "stress_percentage", "yield_estimate")
+                  for key in ("count", "sum")),
+            )
+            for rollup in MetricRollup.objects.all()
+        }
+
+    def test_incremental_rollups_equal_rebuild(self):
+        farmer, other = create_farmer(), create_farmer("other@example.com")
+        now = timezone.now()
+        seed = 0
+        sessions = []
+        # Several sessions per day and per week, for two owners
+        for owner in (farmer, other):
+            for days_ago in (0, 0, 1, 6, 9, 9, 30):
+                seed += 1
+                sessions.append(finalized_session(
+                    analyzed_images(3, seed), owner=owner, created_at=now - timedelta(days=days_ago),
+                ))
+        # Appending moves a session's contribution instead of adding it again
+        append_to_session(sessions[0].pk, analyzed_images(2, 100), 2)
+        append_to_session(sessions[3].pk, analyzed_images(4, 101), 4)
+        # Failed, still pending and ownerless sessions are never rolled up
+        failed = analyzed_images(1, 102)
+        failed[0].canopy_cover = None
+        finalized_session(failed, owner=farmer)
+        AnalysisSession.objects.create(owner=farmer, images_total=2)
+        finalized_session(analyzed_images(2, 103))
+
+        incremental = self.rollup_rows()
+        trends = metric_trends(farmer, MetricRollup.PERIOD_WEEK)
+        rolled_up = dict(AnalysisSession.objects.values_list("session_id", "rolled_up"))
+        rebuild_rollups()
+
+        rebuilt = self.rollup_rows()
+        self.assertEqual(set(incremental), set(rebuilt))
+        for key, row in rebuilt.items():
+            self.assertEqual(incremental[key][0], row[0], key)
+            for value, expected in zip(incremental[key][1:], row[1:]):
+                self.assertAlmostEqual(value, expected, places=6, msg=key)
+        self.assertEqual(metric_trends(farmer, MetricRollup.PERIOD_WEEK), trends)
+        self.assertEqual(dict(AnalysisSession.objects.values_list("session_id", "rolled_up")), rolled_up)
+
+
+@override_settings(ANALYSIS_POOL_WORKERS=0)
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(create_farmer())
+        buffer = io.BytesIO()
+        Image.fromarray(random_field(120, 160, seed=2)).save(buffer, "PNG")
+        self.data = buffer.getvalue()
+
+    def put(self, upload_id, start, end):
+        return self.client.put(
+            reverse("chunked-upload", args=[upload_id]),
+            self.data[start:end],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.data)}",
+        )
+
+    def test_out_of_order_chunks_complete_the_upload_and_queue_the_session(self):
+        response = self.client.post(
+            reverse("chunked-upload-batch"),
+            {"files": [{"name": "field.png", "size": len(self.data)}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        session_id, upload_id = response.data["session_id"], response.data["uploads"][0]["upload_id"]
+        size, third = len(self.data), len(self.data) // 3
+
+        # Last third, then the adjacent middle one, then an overlapping start
+        response = self.put(upload_id, 2 * third, size)
+        self.assertEqual(response.data["received"], [[2 * third, size]])
+        self.assertFalse(response.data["complete"])
+        response = self.put(upload_id, third, 2 * third)
+        self.assertEqual(response.data["received"], [[third, size]])
+        session = AnalysisSession.objects.get(pk=session_id)
+        self.assertEqual(session.status, AnalysisSession.STATUS_RECEIVING)
+        self.assertFalse(session.images.exists())
+
+        response = self.put(upload_id, 0, third + 10)
+        self.assertEqual(response.data["received"], [[0, size]])
+        self.assertTrue(response.data["complete"])
+        session.refresh_from_db()
+        self.assertEqual(session.status, AnalysisSession.STATUS_PENDING)
+        drone_image = session.images.get()
+        self.assertEqual(drone_image.content_hash, hashlib.sha256(self.data).hexdigest())
+        with drone_image.image.open("rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+        call_command("run_analysis_worker", "--once")
+        session.refresh_from_db()
+        drone_image.refresh_from_db()
+        self.assertEqual(session.status, AnalysisSession.STATUS_COMPLETED)
+        self.assertEqual(session.images_done, 1)
+        self.assertEqual(drone_image.canopy_cover, analyze_drone_image(self.data)["canopy_pct"])
+        self.assertIsNotNone(ChunkedUpload.objects.get(upload_id=upload_id).completed_at)
+
+    def open_batch(self, *names):
+        return self.client.post(
+            reverse("chunked-upload-batch"),
+            {"files": [{"name": name, "size": len(self.data)} for name in names]},
+            format="json",
+        )
+
+    def test_unfinished_uploads_are_capped_per_user(self):
+        with override_settings(CHUNKED_UPLOAD_MAX_ACTIVE=3):
+            self.assertEqual(self.open_batch("a.png", "b.png").status_code, 201)
+            self.assertEqual(self.open_batch("c.png", "d.png").status_code, 429)
+        with override_settings(CHUNKED_UPLOAD_MAX_ACTIVE_BYTES=3 * len(self.data)):
+            response = self.open_batch("c.png", "d.png")
+            self.assertEqual(response.status_code, 429)
+            self.assertIn("bytes", response.data["error"])
+
+            # Finished uploads no longer count
+            upload_id = ChunkedUpload.objects.order_by("created_at").first().upload_id
+            self.put(upload_id, 0, len(self.data))
+            self.assertEqual(self.open_batch("c.png", "d.png").status_code, 201)
+        self.assertEqual(AnalysisSession.objects.count(), 2)
+
+    def test_abandoned_uploads_expire(self):
+        response = self.open_batch("done.png", "abandoned.png")
+        session_id = response.data["session_id"]
+        done, abandoned = (upload["upload_id"] for upload in response.data["uploads"])
+        self.put(done, 0, len(self.data))
+        self.put(abandoned, 0, 10)
+        storage_name = ChunkedUpload.objects.get(upload_id=abandoned).storage_name
+
+        call_command("run_analysis_worker", "--once")  # analyzes the finished file
+        session = AnalysisSession.objects.get(pk=session_id)
+        self.assertEqual(session.status, AnalysisSession.STATUS_RECEIVING)
+
+        ChunkedUpload.objects.filter(upload_id=abandoned).update(
+            updated_at=timezone.now() - settings.CHUNKED_UPLOAD_EXPIRY - timedelta(minutes=1)
+        )
+        call_command("run_analysis_worker", "--once")
+        session.refresh_from_db()
+        self.assertEqual(session.status, AnalysisSession.STATUS_COMPLETED)
+        self.assertEqual((session.images_total, session.images_done), (1, 1))
+        self.assertFalse(ChunkedUpload.objects.filter(upload_id=abandoned).exists())
+        self.assertFalse(default_storage.exists(storage_name))
+        self.assertEqual(self.put(abandoned, 10, 20).status_code, 404)
+
+
+def survey_field(height, width, seed=0):
+    """
+    Synthetic field: crop rows whose density drifts gently across the
+    field, under uneven light, so overlapping frames share visible
+    structure while their canopy cover stays close.
+    """
+    rng = np.random.default_rng(seed)
+
+    def smooth(cell):
+        noise = rng.random((height // cell + 2, width // cell + 2))
+        return cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+
+    plants = (rng.random((height, width)) < 0.5 + 0.1 * smooth(120)) & (np.arange(width) % 6 < 4)
+    shade = 0.6 + 0.6 * smooth(30)
+    arr = np.where(plants[..., None], [50, 130, 45], [150, 110, 70]) * shade[..., None]
+    return np.clip(arr + rng.normal(0, 6, arr.shape), 0, 255).astype(np.uint8)
+
+
+def encode_jpeg(arr):
+    buffer = io.BytesIO()
+    Image.fromarray(arr).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class NearDuplicateTests(TestCase):
+    def setUp(self):
+        field = survey_field(720, 960)
+        # Frames of 240x320 pixels, as a survey with 75% forward overlap shoots them
+        self.frames = {
+            "first": encode_jpeg(field[100:340, 100:420]),
+            "next": encode_jpeg(field[160:400, 100:420]),
+            "far": encode_jpeg(field[480:720, 600:920]),
+            "other field": encode_jpeg(survey_field(240, 320, seed=1)),
+        }
+
+    def test_overlapping_frames_group_and_distinct_frames_stay_apart(self):
+        staged = group_near_duplicates([
+            {"frame_signature": frame_signature(data)} for data in self.frames.values()
+        ])
+        groups = [(entry["representative"], entry["analysis_weight"]) for entry in staged]
+        self.assertEqual(groups, [(None, 1.0), (0, 0.0), (None, 1.0), (None, 1.0)])
+
+    def test_stress_patch_keeps_overlapping_frame_apart(self):
+        field = survey_field(720, 960)
+        field[340:400, 100:420] = [140, 100, 55]  # brown where only the next frame looks
+        staged = group_near_duplicates([
+            {"frame_signature": frame_signature(encode_jpeg(field[100:340, 100:420]))},
+            {"frame_signature": frame_signature(encode_jpeg(field[160:400, 100:420]))},
+        ])
+        self.assertIsNone(staged[1]["representative"])
+
+    @override_settings(ANALYSIS_POOL_WORKERS=0)
+    def test_dedupe_request_analyzes_one_frame_per_group(self):
+        client = APIClient()
+        client.force_authenticate(create_farmer())
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            response = client.post(reverse("crop-analysis"), {
+                "images": [
+                    SimpleUploadedFile(f"{name}.jpg", data, content_type="image/jpeg")
+                    for name, data in self.frames.items()
+                ],
+                "dedupe": "true",
+            }, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["cache_misses"], 3)
+        self.assertEqual(response.data["duplicates_skipped"], 1)
+
+        duplicate = DroneImage.objects.get(representative__isnull=False)
+        first = duplicate.representative
+        self.assertEqual(first.image.name.rsplit("/", 1)[-1][:5], "first")
+        self.assertEqual(duplicate.analysis_weight, 0.0)
+        self.assertEqual(duplicate.canopy_cover, first.canopy_cover)
+
+
+class PreviewTests(SimpleTestCase):
+    def test_preview_reports_coarse_to_fine_difference(self):
+        data = encode_jpeg(survey_field(480, 640, seed=3))
+        full = analyze_drone_image(data)
+        preview = analyze_drone_image(data, scale=2)
+
+        self.assertEqual(preview["pixels"], full["pixels"])
+        # ExG is linear in the channels, so averaging pixels barely moves it
+        self.assertAlmostEqual(preview["exg"], full["exg"], delta=1.0)
+        self.assertNotIn("coarse_fine_delta", full)
+
+        fine = load_rgb(data, scale=2)
+        fine_means, coarse_means = accumulate(fine).means(), accumulate(halve(fine)).means()
+        self.assertEqual(set(preview["coarse_fine_delta"]), set(fine_means))
+        for key, delta in preview["coarse_fine_delta"].items():
+            self.assertEqual(delta, round(abs(fine_means[key] - coarse_means[key]), METRIC_DECIMALS[key]), key)
+            self.assertAlmostEqual(preview[key], fine_means[key], places=METRIC_DECIMALS[key])
+
+
+def encode_png(arr):
+    buffer = io.BytesIO()
+    Image.fromarray(arr).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@skipUnless(tifffile, "tifffile is not installed")
+class TiledAnalysisTests(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir, ignore_errors=True)
+        self.field = survey_field(300, 500, seed=4)
+
+    def write_tiff(self, name, arr, **options):
+        path = os.path.join(self.tempdir, name)
+        tifffile.imwrite(path, arr, compression="zlib", **options)
+        return path
+
+    def test_tiled_and_full_modes_agree(self):
+        planes = np.moveaxis(self.field, -1, 0)
+        for name, arr, options in (
+            ("tiles.tif", self.field, {"tile": (64, 96)}),  # edge tiles are padded
+            ("strips.tif", self.field, {"rowsperstrip": 45}),
+            ("planar.tif", planes, {"rowsperstrip": 40, "planarconfig": "separate", "photometric": "rgb"}),
+        ):
+            with self.subTest(layout=name):
+                path = self.write_tiff(name, arr, **options)
+                windowed = open_windowed(path)
+                self.assertNotIsInstance(windowed, np.ndarray)  # compressed: decoded by segment
+                self.assertTrue(np.array_equal(windowed[:], self.field))
+                self.assertTrue(np.array_equal(windowed[7:290:3, 5:480:7], self.field[7:290:3, 5:480:7]))
+
+                tiled = analyze_drone_image(path, tiled=True)
+                full = analyze_drone_image(encode_png(self.field))
+                self.assertEqual(tiled, full)
+
+    @override_settings(ANALYSIS_POOL_WORKERS=0, ANALYSIS_TILED_PIXEL_THRESHOLD=100_000)
+    def test_large_uploads_must_be_tiff(self):
+        client = APIClient()
+        client.force_authenticate(create_farmer())
+        with open(self.write_tiff("field.tif", self.field, tile=(64, 64)), "rb") as f:
+            tiff = f.read()
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            response = client.post(reverse("crop-analysis"), {
+                "images": [SimpleUploadedFile("field.png", encode_png(self.field), content_type="image/png")],
+            }, format="multipart")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("TIFF", response.data["error"])
+            self.assertEqual(os.listdir(os.path.join(media_root, "drone_images")), [])
+
+            response = client.post(reverse("crop-analysis"), {
+                "images": [SimpleUploadedFile("field.tif", tiff, content_type="image/tiff")],
+            }, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        drone_image = DroneImage.objects.get()
+        self.assertEqual(drone_image.analysis_mode, DroneImage.MODE_TILED)
+        self.assertEqual(drone_image.canopy_cover, analyze_drone_image(encode_png(self.field))["canopy_pct"])
+
+
+def sse_events(response):
+    """(event name, data) of each Server-Sent Event in a streamed response."""
+    events = []
+    for block in b"".join(response.streaming_content).decode().strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+class ChatbotStreamTests(TestCase):
+    message = "When should I irrigate?"
+
+    def setUp(self):
+        chatcache.clear()
+        self.addCleanup(chatcache.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(create_farmer())
+
+    def stream(self, *pieces, stall=False):
+        """Events streamed for the model yielding pieces (then stalling past the deadline)."""
+        def generate(prompt, timeout=None):
+            yield from pieces
+            if stall:
+                raise TimeoutError("No answer within the deadline")
+
+        with mock.patch.object(inference, "stream", generate):
+            response = self.client.post(reverse("chatbot-stream"), {"message": self.message}, format="json")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return sse_events(response)
+
+    def test_tokens_then_done_and_the_answer_is_cached(self):
+        pieces = ["Irrigate early ", "in the morning, ", "when the top ", "five centimetres ", "of soil are dry."]
+        events = self.stream(*pieces)
+
+        self.assertEqual(events[:-1], [("message", {"token": piece}) for piece in pieces])
+        name, done = events[-1]
+        self.assertEqual(name, "done")
+        self.assertEqual(done["response"], "".join(pieces))
+        self.assertFalse(done["truncated"])
+        self.assertEqual(chatcache.get(self.message, ChatbotStreamView().prepare_context(None, "farmer")),
+                         done["response"])
+
+    def test_deadline_after_tokens_keeps_the_partial_answer(self):
+        events = self.stream("Irrigate early ", "in the", stall=True)
+
+        self.assertEqual([data for _, data in events[:2]], [{"token": "Irrigate early "}, {"token": "in the"}])
+        name, done = events[-1]
+        partial = ChatbotStreamView().clean_response("Irrigate early in the", self.message)
+        self.assertEqual((name, done["response"], done["truncated"]), ("done", partial, True))
+        self.assertIsNone(chatcache.get(self.message, ChatbotStreamView().prepare_context(None, "farmer")))
+
+    def test_deadline_before_any_token_sends_the_busy_text(self):
+        events = self.stream(stall=True)
+
+        busy = ChatbotStreamView().busy_response(self.message)
+        self.assertEqual(events, [
+            ("message", {"token": busy}),
+            ("done", {**events[-1][1], "response": busy, "truncated": True}),
+        ])
+
+
+class ChatbotCacheTests(TestCase):
+    message = "How often should I water?"
+    answer = "Water deeply about once a week, early in the morning, so less is lost to evaporation."
+
+    def setUp(self):
+        chatcache.clear()
+        self.addCleanup(chatcache.clear)
+        generate = mock.patch.object(inference, "generate", return_value=self.answer)
+        self.generate = generate.start()
+        self.addCleanup(generate.stop)
+
+    def ask(self, farmer):
+        client = APIClient()
+        client.force_authenticate(farmer)
+        response = client.post(reverse("chatbot"), {"message": self.message}, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.data["response"]
+
+    def test_repeated_question_is_answered_from_cache_until_the_data_changes(self):
+        farmer, neighbour = create_farmer(), create_farmer("neighbour@example.com")
+        finalized_session(analyzed_images(3), owner=farmer)
+        finalized_session(analyzed_images(3, seed=1), owner=neighbour)
+
+        first = self.ask(farmer)
+        self.assertEqual(self.ask(farmer), first)
+        self.ask(neighbour)
+        self.assertEqual(self.generate.call_count, 2)
+
+        # A new session for the farmer misses; the neighbour's answer stays cached
+        with self.captureOnCommitCallbacks(execute=True):
+            finalized_session(analyzed_images(3, seed=2), owner=farmer)
+        self.ask(farmer)
+        self.ask(neighbour)
+        self.assertEqual(self.generate.call_count, 3)
+
+    def test_full_queue_gets_quick_advice_at_once(self):
+        self.generate.side_effect = queue.Full
+        answer = self.ask(create_farmer())
+        self.assertEqual(answer, ChatbotView().busy_response(self.message))
+        self.assertIsNone(chatcache.get(self.message, ChatbotView().prepare_context(None, "farmer")))
+
+    @override_settings(CHATBOT_CACHE_TTL=60)
+    def test_answers_expire_after_the_ttl(self):
+        context = ChatbotView().prepare_context(None, "farmer")
+        chatcache.put(self.message, context, self.answer)
+        now = time.monotonic()
+        with mock.patch("time.monotonic", return_value=now + 59):
+            self.assertEqual(chatcache.get(self.message.upper() + "?", context), self.answer)
+        with mock.patch("time.monotonic", return_value=now + 61):
+            self.assertIsNone(chatcache.get(self.message, context))
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        # A fresh registry, restored afterwards
+        for patch in (mock.patch.dict(inference._models, clear=True),
+                      mock.patch.object(inference, "_ready", threading.Event())):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    @mock.patch("transformers.AutoTokenizer.from_pretrained")
+    @mock.patch("transformers.AutoModelForSeq2SeqLM.from_pretrained")
+    def test_model_loads_once_per_process(self, load_model, load_tokenizer):
+        self.assertFalse(inference.is_ready())
+        model, tokenizer = inference.get_model()
+        self.assertTrue(inference.is_ready())
+        load_model.assert_called_once_with(inference.model_name())
+        model.eval.assert_called_once_with()
+
+        # Later calls get the very same objects, never a copy
+        again = inference.get_model()
+        self.assertIs(again[0], model)
+        self.assertIs(again[1], tokenizer)
+        self.assertEqual((load_model.call_count, load_tokenizer.call_count), (1, 1))
+
+    def test_preload_runs_from_the_server_entry_point_only(self):
+        with mock.patch.object(inference, "start_warm_up") as start_warm_up:
+            with override_settings(CHATBOT_PRELOAD_MODEL=True):
+                apps.get_app_config("api").ready()  # as in migrate or the analysis worker
+                start_warm_up.assert_not_called()
+                inference.preload_if_configured()
+            start_warm_up.assert_called_once_with()
+            with override_settings(CHATBOT_PRELOAD_MODEL=False):
+                inference.preload_if_configured()
+            start_warm_up.assert_called_once_with()
+
+
+def use_temp_media(testcase):
+    """Point MEDIA_ROOT at a fresh directory for the rest of the test."""
+    media_root = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    media = override_settings(MEDIA_ROOT=media_root)
+    media.enable()
+    testcase.addCleanup(media.disable)
+    return media_root
+
+
+@override_settings(ANALYSIS_POOL_WORKERS=0)
+class AnalysisCacheTests(TestCase):
+    def setUp(self):
+        self.media_root = use_temp_media(self)
+        self.client = APIClient()
+        self.client.force_authenticate(create_farmer())
+        self.data = encode_png(survey_field(240, 320, seed=5))
+
+    def analyze(self, *names, **data):
+        response = self.client.post(reverse("crop-analysis"), {
+            "images": [SimpleUploadedFile(name, self.data, content_type="image/png") for name in names],
+            **data,
+        }, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_reuploaded_bytes_reuse_the_earlier_analysis(self):
+        first = self.analyze("monday.png")
+        self.assertEqual((first["cache_hits"], first["cache_misses"]), (0, 1))
+
+        again = self.analyze("tuesday.png", "tuesday-copy.png")
+        self.assertEqual((again["cache_hits"], again["cache_misses"]), (2, 0))
+        self.assertEqual(again["canopy_cover"], first["canopy_cover"])
+        original, *reused = DroneImage.objects.order_by("id")
+        self.assertFalse(original.reused)
+        for drone_image in reused:
+            self.assertTrue(drone_image.reused)
+            self.assertEqual(drone_image.image.name, original.image.name)
+            self.assertEqual(drone_image.content_hash, hashlib.sha256(self.data).hexdigest())
+        # The copies were not kept in storage
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, "drone_images"))), 1)
+
+        # An analysis lacking what is asked for (zonal statistics) is not reused
+        zonal = self.analyze("wednesday.png", grid="4x4")
+        self.assertEqual((zonal["cache_hits"], zonal["cache_misses"]), (0, 1))
+
+
+def half_stressed_field(height, width):
+    """Brown (stressed) left half, green right half."""
+    arr = np.empty((height, width, 3), dtype=np.uint8)
+    arr[:, :width // 2] = [140, 100, 55]
+    arr[:, width // 2:] = [50, 130, 45]
+    return arr
+
+
+@override_settings(ANALYSIS_POOL_WORKERS=0)
+class IndexTileTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.farmer = create_farmer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.farmer)
+        response = self.client.post(reverse("crop-analysis"), {
+            "images": [SimpleUploadedFile("field.png", encode_png(half_stressed_field(300, 500)))],
+            "rasters": "true",
+        }, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        self.drone_image = DroneImage.objects.get()
+
+    def tile(self, index, z, x, y, fmt="png"):
+        return self.client.get(reverse("index-tile", args=[self.drone_image.id, index, z, x, y, fmt]))
+
+    def test_pyramid_describes_every_level(self):
+        response = self.client.get(reverse("index-tile-pyramid", args=[self.drone_image.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["tile_size"], 256)
+        # Halved until one tile holds the whole image
+        self.assertEqual(response.data["levels"], [[250, 150], [500, 300]])
+        self.assertEqual(response.data["indices"], ["vari", "exg", "stress"])
+        self.assertEqual(self.drone_image.raster_levels, 2)
+
+    def test_tiles_are_rendered_from_the_rasters_and_cached(self):
+        response = self.tile("stress", 1, 0, 0)
+        self.assertEqual((response.status_code, response["Content-Type"]), (200, "image/png"))
+        self.assertIn("immutable", response["Cache-Control"])
+        data = b"".join(response.streaming_content)
+        response.close()
+        alpha = np.asarray(Image.open(io.BytesIO(data)))[:, :, 3]
+        self.assertEqual(alpha.shape, (256, 256))
+        self.assertTrue((alpha[:, :250] == 255).all())  # the brown half
+        self.assertFalse(alpha[:, 250:].any())
+
+        raster_key = os.path.basename(self.drone_image.raster_path)
+        self.assertTrue(default_storage.exists(f"tile_cache/{raster_key}/stress/1/0_0.png"))
+        cached = self.tile("stress", 1, 0, 0)
+        self.assertEqual(b"".join(cached.streaming_content), data)
+        cached.close()
+
+        # Edge tile: 244 x 44 pixels of green, padded with transparency
+        response = self.tile("vari", 1, 1, 1, "webp")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        rgba = np.asarray(Image.open(io.BytesIO(b"".join(response.streaming_content))).convert("RGBA"))
+        response.close()
+        red, green, _, alpha = rgba[20, 100].astype(int)
+        self.assertGreater(green, red)
+        self.assertFalse(rgba[44:, :, 3].any())
+        self.assertFalse(rgba[:, 244:, 3].any())
+
+    def test_missing_tiles_and_other_farmers_get_404(self):
+        self.assertEqual(self.tile("vari", 2, 0, 0).status_code, 404)
+        self.assertEqual(self.tile("vari", 1, 2, 0).status_code, 404)
+        self.assertEqual(self.tile("ndvi", 0, 0, 0).status_code, 404)
+        self.client.force_authenticate(create_farmer("neighbour@example.com"))
+        self.assertEqual(self.tile("vari", 0, 0, 0).status_code, 404)
+
+
+class ZonalStatsTests(TestCase):
+    def test_cell_means_match_each_cell_analyzed_alone(self):
+        arr = random_field(300, 500, seed=6)
+        results = analyze_drone_image(encode_png(arr), grid=(3, 4))
+        self.assertEqual(results["zonal_grid"], (3, 4))
+        cells = np.frombuffer(results["zonal_stats"], dtype=np.float32).reshape(3, 4, -1)
+        for row, (top, bottom) in enumerate(((0, 100), (100, 200), (200, 300))):
+            for col, (left, right) in enumerate(((0, 125), (125, 250), (250, 375), (375, 500))):
+                means = accumulate(arr[top:bottom, left:right]).means()
+                for k, name in enumerate(results["indices"]):
+                    self.assertAlmostEqual(cells[row, col, k], means[name], places=3, msg=f"{name} {row},{col}")
+
+        # The grid never has more cells than the image has pixels
+        self.assertEqual(analyze_drone_image(encode_png(random_field(7, 3)), grid=(64, 64))["zonal_grid"], (7, 3))
+
+    @override_settings(ANALYSIS_POOL_WORKERS=0)
+    def test_endpoint_returns_one_matrix_per_index(self):
+        use_temp_media(self)
+        client = APIClient()
+        client.force_authenticate(create_farmer())
+        upload = SimpleUploadedFile("field.png", encode_png(half_stressed_field(300, 500)))
+        self.assertEqual(client.post(reverse("crop-analysis"), {"images": [upload], "grid": "0x4"},
+                                     format="multipart").status_code, 400)
+        upload.seek(0)
+        response = client.post(reverse("crop-analysis"), {"images": [upload], "grid": "2x4"}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+
+        response = client.get(reverse("zonal-stats", args=[DroneImage.objects.get().id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["rows"], response.data["cols"]), (2, 4))
+        metrics = response.data["metrics"]
+        self.assertEqual(list(metrics), ["vari", "exg", "gli", "canopy_pct", "stress_pct"])
+        # Brown left half, green right half
+        self.assertEqual(metrics["stress_pct"], [[100.0, 100.0, 0.0, 0.0]] * 2)
+        self.assertEqual(metrics["canopy_pct"], [[0.0, 0.0, 100.0, 100.0]] * 2)
+
+
+@override_settings(ANALYSIS_POOL_WORKERS=0)
+class IngestUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = use_temp_media(self)
+        self.client = APIClient()
+        self.client.force_authenticate(create_farmer())
+        self.small = encode_png(survey_field(120, 160, seed=7))
+        self.large = encode_png(survey_field(240, 320, seed=8))
+
+    def analyze(self, **data):
+        with mock.patch("api.views.analyze_images", wraps=analyze_images) as analyze:
+            response = self.client.post(reverse("crop-analysis"), {
+                "images": [SimpleUploadedFile("small.png", self.small), SimpleUploadedFile("large.png", self.large)],
+                **data,
+            }, format="multipart")
+        return response, [source for source, _ in analyze.call_args[0][0]] if analyze.called else None
+
+    def test_uploads_within_the_budget_are_analyzed_from_memory(self):
+        with override_settings(ANALYSIS_INGEST_BUFFER_BYTES=len(self.small) + 1000):
+            response, sources = self.analyze()
+        self.assertEqual(response.status_code, 200)
+        # The first upload fits the request's budget, the second is read back from storage
+        self.assertEqual(sources[0], self.small)
+        small, large = DroneImage.objects.order_by("id")
+        self.assertEqual(sources[1], large.image.path)
+
+        for drone_image, data in ((small, self.small), (large, self.large)):
+            self.assertEqual(drone_image.content_hash, hashlib.sha256(data).hexdigest())
+            with drone_image.image.open("rb") as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual(drone_image.canopy_cover, analyze_drone_image(data)["canopy_pct"])
+
+    def test_rejected_request_leaves_nothing_in_storage(self):
+        response, sources = self.analyze(weighting="by-guess")
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(sources)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "drone_images")), [])
+
+
+@override_settings(ANALYSIS_POOL_WORKERS=0)
+class AnalysisQueueTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.client = APIClient()
+        self.client.force_authenticate(create_farmer())
+
+    def enqueue(self, *seeds):
+        response = self.client.post(reverse("crop-analysis"), {
+            "images": [SimpleUploadedFile(f"field{seed}.png", encode_png(survey_field(120, 160, seed=seed)))
+                       for seed in seeds],
+            "async": "true",
+        }, format="multipart")
+        self.assertEqual(response.status_code, 202)
+        return AnalysisSession.objects.get(session_id=response.data["session_id"])
+
+    def status(self, session):
+        return self.client.get(reverse("crop-analysis-status", args=[session.session_id])).data
+
+    def test_sessions_are_claimed_oldest_first_and_once(self):
+        first, second = self.enqueue(10, 11), self.enqueue(12)
+        self.assertEqual(self.status(first)["status"], AnalysisSession.STATUS_PENDING)
+        self.assertEqual(self.status(first)["images_done"], 0)
+
+        self.assertEqual(claim_pending_session().pk, first.pk)
+        self.assertEqual(claim_pending_session().pk, second.pk)
+        self.assertIsNone(claim_pending_session())
+        self.assertEqual(self.status(first)["status"], AnalysisSession.STATUS_PROCESSING)
+
+    def test_worker_completes_queued_and_stale_sessions(self):
+        queued, stale = self.enqueue(10, 11), self.enqueue(12)
+        # A worker died holding this one
+        AnalysisSession.objects.filter(pk=stale.pk).update(status=AnalysisSession.STATUS_PROCESSING)
+
+        call_command("run_analysis_worker", "--once")
+        self.assertEqual(self.status(queued)["status"], AnalysisSession.STATUS_COMPLETED)
+        self.assertEqual(self.status(stale)["status"], AnalysisSession.STATUS_PROCESSING)
+
+        call_command("run_analysis_worker", "--once", "--requeue-stale")
+        body = self.status(stale)
+        self.assertEqual((body["status"], body["images_done"], body["progress"]),
+                         (AnalysisSession.STATUS_COMPLETED, 1, 100.0))
+        drone_image = stale.images.get()
+        with drone_image.image.open("rb") as f:
+            self.assertEqual(drone_image.canopy_cover, analyze_drone_image(f.read())["canopy_pct"])
+
+    def test_session_that_raises_is_marked_failed(self):
+        session = self.enqueue(10)
+        with mock.patch("api.management.commands.run_analysis_worker.process_session",
+                        side_effect=RuntimeError("disk full")):
+            call_command("run_analysis_worker", "--once", stderr=io.StringIO())
+        self.assertEqual(self.status(session)["status"], AnalysisSession.STATUS_FAILED)
+
+
+class BulkPersistenceTests(TestCase):
+    def with_duplicate(self, count):
+        """analyzed_images(count) whose last row copies the first (a near-duplicate)."""
+        images = analyzed_images(count)
+        images[-1].representative, images[-1].analysis_weight = images[0], 0.0
+        return images
+
+    def test_rows_are_inserted_in_bulk_and_duplicates_point_at_their_representative(self):
+        session = AnalysisSession.objects.create(images_total=12)
+        images = self.with_duplicate(12)
+        for drone_image in images:
+            drone_image.session = session
+        with self.assertNumQueries(2):
+            bulk_create_images(session, images)
+        self.assertEqual(DroneImage.objects.get(pk=images[-1].pk).representative_id, images[0].pk)
+
+    def test_primary_keys_are_recovered_where_bulk_inserts_return_none(self):
+        session = AnalysisSession.objects.create(images_total=12)
+        images = self.with_duplicate(12)
+        for drone_image in images:
+            drone_image.session = session
+        # As on MySQL
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert",
+                               new_callable=mock.PropertyMock, return_value=False):
+            bulk_create_images(session, images)
+        self.assertEqual(
+            [drone_image.pk for drone_image in images[:-1]],
+            list(session.images.filter(representative__isnull=True).order_by("id").values_list("id", flat=True)),
+        )
+        self.assertEqual(session.images.get(representative__isnull=False).representative_id, images[0].pk)
+
+    def test_session_averages_skip_failed_and_missing_metrics(self):
+        images = analyzed_images(6)
+        images[1].canopy_cover = None  # failed analysis
+        images[2].stress_percentage = None  # stress not computed
+        session = finalized_session(images, weighting=AnalysisSession.WEIGHT_PIXELS)
+
+        for field in ("canopy_cover", "stress_percentage", "vari"):
+            rows = [drone_image for drone_image in images
+                    if drone_image.canopy_cover is not None and getattr(drone_image, field) is not None]
+            expected = np.average([getattr(drone_image, field) for drone_image in rows],
+                                  weights=[drone_image.pixel_count for drone_image in rows])
+            self.assertAlmostEqual(getattr(session, field), expected, places=9, msg=field)
+
+    @override_settings(ANALYSIS_POOL_WORKERS=0)
+    def test_request_queries_do_not_grow_with_the_number_of_images(self):
+        use_temp_media(self)
+        client = APIClient()
+        client.force_authenticate(create_farmer())
+        counts = []
+        # The first request also creates the owner's rollup rows
+        for seeds in ((19,), (20, 21), (22, 23, 24, 25)):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(reverse("crop-analysis"), {
+                    "images": [SimpleUploadedFile(f"field{seed}.png", encode_png(random_field(60, 80, seed)))
+                               for seed in seeds],
+                }, format="multipart")
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[1], counts[2])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.farmer = create_farmer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.farmer)
+        self.sessions = [
+            finalized_session(analyzed_images(count, seed=count), owner=self.farmer) for count in (2, 3, 2)
+        ]
+        finalized_session(analyzed_images(4), owner=create_farmer("neighbour@example.com"))
+
+    def export(self, kind, fmt, **params):
+        response = self.client.get(reverse("export", args=[kind, fmt]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], EXPORT_CONTENT_TYPES[fmt])
+        return b"".join(response.streaming_content)
+
+    def test_csv_lists_the_owners_sessions(self):
+        rows = list(csv.DictReader(io.StringIO(self.export("sessions", "csv").decode())))
+        self.assertEqual([int(row["session_id"]) for row in rows], [session.pk for session in self.sessions])
+        for row, session in zip(rows, self.sessions):
+            self.assertAlmostEqual(float(row["canopy_cover"]), session.canopy_cover, places=9)
+            self.assertEqual(json.loads(row["extra_indices"]), session.extra_indices)
+
+        # Nothing in range: just the header
+        empty = self.export("sessions", "csv", created_after=(timezone.now() + timedelta(days=1)).date())
+        self.assertEqual(empty.decode().strip(), ",".join(EXPORT_COLUMNS["sessions"]))
+
+    def test_ndjson_images_stream_in_chunks(self):
+        images = DroneImage.objects.filter(session__owner=self.farmer).order_by("id")
+        body = self.export("images", "ndjson")
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [drone_image.id for drone_image in images])
+        self.assertEqual(list(rows[0]), list(EXPORT_COLUMNS["images"]))
+        self.assertEqual(rows[0]["extra_indices"], images[0].extra_indices)
+
+        # One piece per chunk of rows, together the same export
+        pieces = list(export_stream(images, "images", "ndjson", chunk_size=3))
+        self.assertEqual([piece.count("\n") for piece in pieces], [3, 3, 1])
+        self.assertEqual("".join(pieces).encode(), body)
+
+        session = self.sessions[1]
+        rows = self.export("images", "ndjson", session=session.session_id).decode().splitlines()
+        self.assertEqual(len(rows), 3)
+
+    @skipUnless(pq, "pyarrow is not installed")
+    def test_parquet_has_one_row_group_per_chunk(self):
+        images = DroneImage.objects.filter(session__owner=self.farmer)
+        data = b"".join(export_stream(images, "images", "parquet", chunk_size=3))
+        parquet = pq.ParquetFile(io.BytesIO(data))
+        self.assertEqual(parquet.metadata.num_rows, 7)
+        self.assertEqual(parquet.num_row_groups, 3)
+        self.assertEqual(parquet.schema_arrow.names, list(EXPORT_COLUMNS["images"]))
+
+    def test_unknown_format_is_refused(self):
+        response = self.client.get(reverse("export", args=["sessions", "xml"]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse("export", args=["farms", "csv"])).status_code, 404)
+
+
+class FakeSeq2Seq:
+    """
+    Stand-in (model, tokenizer) for the inference thread: prompt "p<n>" is
+    answered "answer <n>", each generate call records its batch of prompt
+    numbers, and generate waits for self.release while it is cleared.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.busy = threading.Event()  # set while generate runs
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, prompts, **kwargs):
+        import torch
+        return {"input_ids": torch.tensor([[int(prompt[1:])] for prompt in prompts])}
+
+    def generate(self, input_ids, stopping_criteria, **kwargs):
+        self.batches.append(input_ids[:, 0].tolist())
+        self.busy.set()
+        self.release.wait(5)
+        self.busy.clear()
+        return input_ids
+
+    def batch_decode(self, outputs, skip_special_tokens):
+        return [f"answer {row[0]}" for row in outputs.tolist()]
+
+
+@skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+class InferenceBatchingTests(SimpleTestCase):
+    def setUp(self):
+        self.model = FakeSeq2Seq()
+        # A fresh queue and inference thread for each test
+        for patch in (mock.patch.object(inference, "get_model", return_value=(self.model, self.model)),
+                      mock.patch.object(inference, "_requests", None),
+                      mock.patch.object(inference, "_worker", None)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def ask_in_background(self, *numbers, timeout=5):
+        """Start generate() for each prompt number; returns {number: answer or exception}."""
+        answers = {}
+
+        def ask(n):
+            try:
+                answers[n] = inference.generate(f"p{n}", timeout=timeout)
+            except Exception as e:
+                answers[n] = e
+
+        threads = [threading.Thread(target=ask, args=(n,)) for n in numbers]
+        for thread in threads:
+            thread.start()
+        self.addCleanup(lambda: [thread.join() for thread in threads])
+        self.addCleanup(self.model.release.set)  # runs before the joins
+        return answers, threads
+
+    def wait_for_queue(self, depth):
+        for _ in range(500):
+            if inference._requests is not None and inference._requests.qsize() == depth:
+                return
+            time.sleep(0.01)
+        self.fail(f"queue never reached {depth}")
+
+    @override_settings(CHATBOT_BATCH_MAX_SIZE=3, CHATBOT_BATCH_WINDOW_MS=50)
+    def test_concurrent_prompts_share_generate_calls(self):
+        self.model.release.clear()
+        answers, first = self.ask_in_background(0)
+        self.assertTrue(self.model.busy.wait(5))
+        # Four more arrive while the model is busy with the first
+        more, threads = self.ask_in_background(1, 2, 3, 4)
+        self.wait_for_queue(4)
+        self.model.release.set()
+        for thread in first + threads:
+            thread.join(5)
+
+        answers.update(more)
+        self.assertEqual(answers, {n: f"answer {n}" for n in range(5)})
+        self.assertEqual(self.model.batches[0], [0])
+        self.assertEqual(sorted(map(len, self.model.batches[1:])), [1, 3])  # capped at 3
+        self.assertEqual(sorted(n for batch in self.model.batches for n in batch), list(range(5)))
+        self.assertEqual(counters.snapshot()["chatbot.last_batch_size"], len(self.model.batches[-1]))
+
+    def test_prompt_expired_while_queued_is_never_run(self):
+        expired_before = counters.snapshot().get("chatbot.expired", 0)
+        self.model.release.clear()
+        answers, first = self.ask_in_background(0)
+        self.assertTrue(self.model.busy.wait(5))
+        late, threads = self.ask_in_background(1, timeout=0.05)
+        threads[0].join(5)
+        self.assertIsInstance(late[1], TimeoutError)
+
+        self.model.release.set()
+        first[0].join(5)
+        for _ in range(500):
+            if counters.snapshot().get("chatbot.expired", 0) > expired_before:
+                break
+            time.sleep(0.01)
+        self.assertEqual(answers, {0: "answer 0"})
+        self.assertEqual(self.model.batches, [[0]])
+
+    def test_rows_stop_generating_at_their_deadline(self):
+        import torch
+
+        now = time.monotonic()
+        live, late, cancelled = (inference._Request("p", now + 60), inference._Request("p", now - 1),
+                                 inference._Request("p", now + 60))
+        cancelled.cancelled = True
+        stop = inference._DeadlineCriteria([live, late, cancelled])(torch.zeros((3, 1)), None)
+        self.assertEqual(stop.tolist(), [False, True, True])
+
+    @override_settings(CHATBOT_QUEUE_MAX_SIZE=1)
+    def test_full_queue_is_refused_at_once(self):
+        self.model.release.clear()
+        self.ask_in_background(0)
+        self.assertTrue(self.model.busy.wait(5))
+        self.ask_in_background(1)
+        self.wait_for_queue(1)
+
+        started = time.monotonic()
+        with self.assertRaises(queue.Full):
+            inference.generate("p2", timeout=5)
+        self.assertLess(time.monotonic() - started, 1)
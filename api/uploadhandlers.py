@@ -0,0 +1,98 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+def create_upload_file(file_name, mode="xb"):
+    """
+    Create a new file for an upload under drone_images/ in default_storage.
+
+    Returns (storage name, open file). The name is made unique the way
+    Storage.save() does, and the file is created exclusively so two
+    concurrent uploads of the same name never share a file.
+    """
+    name = default_storage.generate_filename(f"drone_images/{file_name}")
+    os.makedirs(os.path.dirname(default_storage.path(name)), exist_ok=True)
+    while True:
+        storage_name = default_storage.get_available_name(name)
+        try:
+            return storage_name, open(default_storage.path(storage_name), mode)
+        except FileExistsError:
+            continue  # taken by a concurrent upload since the check
+
+
+class IngestedUploadedFile(UploadedFile):
+    """
+    An upload already written to default_storage by IngestUploadHandler.
+
+    ``storage_name`` is its name in storage, ``content_hash`` the SHA-256
+    hex digest of its bytes and ``buffer`` the bytes themselves, or None
+    when the request's in-memory budget was exceeded.
+    """
+
+    def __init__(self, storage_name, content_hash, buffer, name, content_type, size,
+                 charset, content_type_extra=None):
+        file = open(default_storage.path(storage_name), "rb")
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.storage_name = storage_name
+        self.content_hash = content_hash
+        self.buffer = buffer
+
+
+class IngestUploadHandler(FileUploadHandler):
+    """
+    Write uploads straight into default_storage, hashing them on the way.
+
+    Each chunk is written once to its final location under drone_images/
+    and fed to SHA-256, so nothing is spooled to a temporary file and
+    copied again. Up to ANALYSIS_INGEST_BUFFER_BYTES per request is also
+    kept in memory, which lets the analysis decode those images without
+    reading them back from disk. Needs a storage backend with local paths.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.budget = settings.ANALYSIS_INGEST_BUFFER_BYTES
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.storage_name, self.file = create_upload_file(self.file_name)
+        self.hasher = hashlib.sha256()
+        self.chunks = []
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        self.hasher.update(raw_data)
+        if self.chunks is not None:
+            if len(raw_data) <= self.budget:
+                self.budget -= len(raw_data)
+                self.chunks.append(raw_data)
+            else:
+                # Over budget: this image will be read back from storage
+                self.budget += sum(len(chunk) for chunk in self.chunks)
+                self.chunks = None
+        return None
+
+    def file_complete(self, file_size):
+        self.file.close()
+        uploaded = IngestedUploadedFile(
+            storage_name=self.storage_name,
+            content_hash=self.hasher.hexdigest(),
+            buffer=b"".join(self.chunks) if self.chunks is not None else None,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        self.chunks = None
+        return uploaded
+
+    def upload_interrupted(self):
+        if getattr(self, "file", None) is not None and not self.file.closed:
+            self.file.close()
+            default_storage.delete(self.storage_name)
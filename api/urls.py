@@ -1,10 +1,44 @@
 from django.urls import path
 from .views import (
+    ChatbotReadyView,
+    ChatbotStreamView,
     ChatbotView,
+    ChunkedUploadBatchView,
+    ChunkedUploadView,
+    CropAnalysisAppendView,
+    CropAnalysisFinalizeView,
+    CropAnalysisStatusView,
     CropAnalysisView,
+    ExportView,
+    IndexTilePyramidView,
+    IndexTileView,
+    MetricsView,
+    SessionHistoryView,
+    SessionImageHistoryView,
+    TrendView,
+    ZonalStatsView,
 )
 
 urlpatterns = [
     path("crop-analysis/", CropAnalysisView.as_view(), name="crop-analysis"),
+    path("crop-analysis/<int:session_id>/", CropAnalysisStatusView.as_view(), name="crop-analysis-status"),
+    path("crop-analysis/<int:session_id>/images/", CropAnalysisAppendView.as_view(), name="crop-analysis-append"),
+    path("crop-analysis/<int:session_id>/finalize/", CropAnalysisFinalizeView.as_view(), name="crop-analysis-finalize"),
+    path("sessions/", SessionHistoryView.as_view(), name="session-history"),
+    path("sessions/<int:session_id>/images/", SessionImageHistoryView.as_view(), name="session-image-history"),
+    path("trends/", TrendView.as_view(), name="metric-trends"),
+    path("export/<str:kind>.<str:fmt>", ExportView.as_view(), name="export"),
+    path("uploads/", ChunkedUploadBatchView.as_view(), name="chunked-upload-batch"),
+    path("uploads/<uuid:upload_id>/", ChunkedUploadView.as_view(), name="chunked-upload"),
+    path("images/<int:image_id>/tiles/", IndexTilePyramidView.as_view(), name="index-tile-pyramid"),
+    path(
+        "images/<int:image_id>/tiles/<str:index>/<int:z>/<int:x>/<int:y>.<str:fmt>",
+        IndexTileView.as_view(),
+        name="index-tile",
+    ),
+    path("images/<int:image_id>/zones/", ZonalStatsView.as_view(), name="zonal-stats"),
     path("chatbot/", ChatbotView.as_view(), name="chatbot"),
+    path("chatbot/ready/", ChatbotReadyView.as_view(), name="chatbot-ready"),
+    path("chatbot/stream/", ChatbotStreamView.as_view(), name="chatbot-stream"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
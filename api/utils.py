@@ -1,65 +1,594 @@
+import base64
+import io
+import json
+import os
+
 from PIL import Image
 import numpy as np
-import cv2  # make sure you have opencv-python installed
 
-def analyze_drone_image(image_path):
-    # Open image and convert to RGB
-    img = Image.open(image_path).convert('RGB')
-    arr = np.array(img)
+from .indices import (  # noqa: F401  (BROWN_HSV_* re-exported for benchmarks)
+    BROWN_HSV_LOWER,
+    BROWN_HSV_UPPER,
+    METRIC_DECIMALS,
+    BandTerms,
+    resolve_indices,
+)
 
-    # Split channels
-    R = arr[:, :, 0].astype(float)
-    G = arr[:, :, 1].astype(float)
-    B = arr[:, :, 2].astype(float)
+try:
+    import tifffile  # optional, needed for windowed reads of large TIFFs
+except ImportError:
+    tifffile = None
 
-    eps = 1e-6  # avoid division by zero
-    # Calculate VARI with clipping to handle edge cases
-    denominator = G + R - B
-    
-    # Add safety check: if denominator is <= 0, set VARI to 0 or clip
-    valid_mask = denominator > eps
-    VARI = np.zeros_like(denominator)
-    
-    # Only calculate where denominator is valid
-    VARI[valid_mask] = (G[valid_mask] - R[valid_mask]) / denominator[valid_mask]
-    
-    # For invalid pixels, set to 0 (neutral)
-    VARI[~valid_mask] = 0
-    
-    # Clip to valid range [-1, 1]
-    VARI = np.clip(VARI, -1, 1)
-    
-    # Take mean
-    VARI_mean = np.mean(VARI)
+# Pixels processed per pass of the index kernel. Bands are as many whole
+# rows as fit in this budget, and every temporary is sized to one band.
+BAND_PIXELS = 1 << 20
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
 
+# Decode scales supported by preview mode (JPEG DCT scaling factors)
+PREVIEW_SCALES = (2, 4, 8)
 
-    EXG = np.mean(2 * G - R - B)
-    GLI = np.mean((2 * G - R - B) / (2 * G + R + B + eps))
+# Index rasters: side of one stored/served map tile, and the channel each
+# quantized index occupies in the stored RGB tiles
+TILE_SIZE = 256
+RASTER_CHANNELS = {"vari": 0, "exg": 1, "stress": 2}
 
-    # Canopy cover (% green pixels)
-    green_pixels = np.sum(G > R)
-    total_pixels = arr.shape[0] * arr.shape[1]
-    canopy_pct = (green_pixels / total_pixels) * 100
+# Where each raster index comes from and how its values map to 0-255
+RASTER_SOURCES = {
+    "vari": ("vari", lambda v: (v + 1) * 127.5 + 0.5),  # [-1, 1]
+    "exg": ("exg", lambda v: (v + 510) >> 2),           # [-510, 510], steps of 4
+    "stress": ("stress_pct", lambda v: v),              # 0/255 mask
+}
 
-    # --- Stress detection using HSV ---
-    hsv = cv2.cvtColor(arr.astype(np.uint8), cv2.COLOR_RGB2HSV)
-    h, s, v = hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
 
-    # Brown roughly: Hue 10-30, Saturation 50-255, Value 20-200
-    brown_pixels = np.sum(
-        (h >= 10) & (h <= 30) & 
-        (s >= 50) & (s <= 255) & 
-        (v >= 20) & (v <= 200)
+class IndexAccumulator:
+    """
+    Running sums of vegetation indices over row bands of an RGB image.
+
+    indices names the registry entries (api.indices) to compute, default
+    DEFAULT_INDICES; canopy is always included. Each band is read once and
+    every term an index needs is computed once (see BandTerms). Integer
+    indices are summed exactly in int64, the float32 ratios in float64.
+
+    Tolerance against the original float64 implementation: per-pixel
+    float32 ratios carry a relative error below 1e-7, so the means agree
+    to better than 1e-6. ExG, TGI, canopy and stress are exact. The rounded
+    values returned by result() therefore only differ when the float64
+    mean sits within 1e-6 of a rounding boundary.
+
+    If a (height, width, 3) uint8 raster is given, each band also writes its
+    per-pixel VARI, ExG and stress into it (see RASTER_CHANNELS and
+    RASTER_SOURCES); those indices are then always computed.
+
+    If grid=(rows, cols) and the image shape are given, the same pass also
+    sums every index per cell of a rows x cols grid; zonal() returns the
+    per-cell means in self.names order.
+    """
+
+    def __init__(self, raster=None, grid=None, shape=None, indices=None):
+        self.raster = raster
+        extra = [source for source, _ in RASTER_SOURCES.values()] if raster is not None else ()
+        self.indices = resolve_indices(indices, extra)
+        self.names = [index.name for index in self.indices]
+        self.row = 0
+        self.pixels = 0
+        self.sums = dict.fromkeys(self.names, 0)
+        self.raster_writers = {
+            source: (RASTER_CHANNELS[channel], encode)
+            for channel, (source, encode) in RASTER_SOURCES.items()
+        } if raster is not None else {}
+        # Buffers reused across bands (e.g. the HSV image behind the stress mask)
+        self.buffers = {}
+
+        self.cell_sums = None
+        if grid is not None:
+            height, width = shape
+            rows, cols = min(grid[0], height), min(grid[1], width)
+            self.row_edges = np.linspace(0, height, rows + 1).astype(np.int64)
+            self.col_edges = np.linspace(0, width, cols + 1).astype(np.int64)
+            self.cell_sums = np.zeros((rows, cols, len(self.indices)), dtype=np.float64)
+
+    def _add_cells(self, k, values, segments):
+        """Add the per-cell sums of the k-th index's values for the current band."""
+        for cell_row, start, stop in segments:
+            column_sums = values[start:stop].sum(axis=0, dtype=np.float64)
+            self.cell_sums[cell_row, :, k] += np.add.reduceat(column_sums, self.col_edges[:-1])
+
+    def add(self, band):
+        """Accumulate a (rows, width, 3) uint8 RGB band."""
+        # Band-local row ranges falling in each grid row
+        segments = []
+        if self.cell_sums is not None:
+            top, bottom = self.row, self.row + band.shape[0]
+            for cell_row in range(len(self.row_edges) - 1):
+                start = max(self.row_edges[cell_row], top)
+                stop = min(self.row_edges[cell_row + 1], bottom)
+                if start < stop:
+                    segments.append((cell_row, start - top, stop - top))
+
+        terms = BandTerms(band, self.buffers)
+        for k, index in enumerate(self.indices):
+            values = index.formula(terms)
+            if index.reducer == "percent":
+                self.sums[index.name] += int(np.count_nonzero(values))
+            elif values.dtype.kind == "f":
+                self.sums[index.name] += float(np.sum(values, dtype=np.float64))
+            else:
+                self.sums[index.name] += int(np.sum(values, dtype=np.int64))
+            if segments:
+                self._add_cells(k, values, segments)
+            if index.name in self.raster_writers:
+                channel, encode = self.raster_writers[index.name]
+                self.raster[self.row:self.row + band.shape[0], :, channel] = encode(values)
+
+        self.pixels += band.shape[0] * band.shape[1]
+        self.row += band.shape[0]
+
+    def means(self):
+        """Return the unrounded metrics, or None if no pixels were added."""
+        if not self.pixels:
+            return None
+        return {
+            index.name: self.sums[index.name] / self.pixels * (100 if index.reducer == "percent" else 1)
+            for index in self.indices
+        }
+
+    def zonal(self):
+        """Per-cell means as a (rows, cols, len(self.names)) float32 array."""
+        areas = np.outer(np.diff(self.row_edges), np.diff(self.col_edges))[:, :, None]
+        cells = self.cell_sums / areas
+        for k, index in enumerate(self.indices):
+            if index.reducer == "percent":
+                cells[:, :, k] *= 100 / index.mask_value
+        return cells.astype(np.float32)
+
+    def result(self):
+        """Return the analysis dict, or None if no pixels were added."""
+        means = self.means()
+        if means is None:
+            return None
+        return {key: round(value, METRIC_DECIMALS[key]) for key, value in means.items()}
+
+
+def image_source(image):
+    """
+    Normalize an image argument for PIL and the readers below.
+
+    Paths and file-like objects are returned unchanged (file-like objects
+    are read from their current position); bytes-like buffers are wrapped
+    in a BytesIO.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return io.BytesIO(image)
+    return image
+
+
+def is_path(image):
+    return isinstance(image, (str, os.PathLike))
+
+
+def load_rgb(image_path, scale=1):
+    """
+    Decode an image into a (height, width, 3) uint8 array.
+
+    image_path may also be a file-like object or a bytes buffer.
+
+    With scale > 1 the image is decoded at 1/scale resolution. JPEGs use
+    draft mode, so libjpeg does the reduction inside the DCT and never
+    produces the full-resolution pixels; other formats are decoded fully
+    and then box-reduced.
+    """
+    with Image.open(image_source(image_path)) as img:
+        if scale > 1:
+            target = (max(1, img.width // scale), max(1, img.height // scale))
+            img.draft('RGB', target)
+            remaining = img.width // target[0]
+            if remaining > 1:
+                img = img.reduce(remaining)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        return np.asarray(img)
+
+
+def can_read_windowed(image_path):
+    """Whether open_windowed() can read image_path (a .npy or TIFF path)."""
+    if not is_path(image_path):
+        return False
+    ext = os.path.splitext(str(image_path))[1].lower()
+    return ext == ".npy" or (ext in TIFF_EXTENSIONS and tifffile is not None)
+
+
+def open_windowed(image_path):
+    """
+    Open an image as a lazily-read (height, width, channels) array.
+
+    .npy files and uncompressed TIFFs are memory-mapped. Compressed TIFFs
+    are read through WindowedTiff, which decodes only the strips or tiles
+    a slice touches, so resident memory stays independent of the image
+    size. Anything else cannot be read by window (see can_read_windowed)
+    and raises ValueError.
+    """
+    if not can_read_windowed(image_path):
+        raise ValueError(f"{image_path!r} cannot be read by window; use a TIFF or .npy file")
+    if os.path.splitext(str(image_path))[1].lower() == ".npy":
+        return np.load(image_path, mmap_mode="r")
+    with tifffile.TiffFile(image_path) as tif:
+        if not tif.pages[0].is_memmappable:
+            return WindowedTiff(image_path)
+    arr = tifffile.memmap(image_path, page=0, mode="r")
+    if arr.ndim == 3 and arr.shape[0] in (3, 4) and arr.shape[2] not in (3, 4):
+        arr = np.moveaxis(arr, 0, -1)  # planar -> interleaved view
+    return arr
+
+
+class WindowedTiff:
+    """
+    The first page of a compressed TIFF as a read-only array-like.
+
+    It has the (height, width[, samples]) shape of the page, and indexing
+    it with a row slice (optionally with a column slice, steps allowed)
+    decodes only the row of strips or tiles each requested row falls in.
+    The last decoded segment row is kept, so reading bands in order
+    decodes every segment once and holds at most one segment row (strip
+    or tile height x image width) at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with tifffile.TiffFile(path) as tif:
+            page = tif.pages[0]
+            self.dtype = page.dtype
+            self.samples = page.samplesperpixel
+            self.planar = self.samples > 1 and page.planarconfig == 2
+            height, width = page.imagelength, page.imagewidth
+            if page.is_tiled:
+                self.segment_height, self.segment_width = page.tilelength, page.tilewidth
+            else:
+                self.segment_height, self.segment_width = min(page.rowsperstrip or height, height), width
+        self.shape = (height, width, self.samples) if self.samples > 1 else (height, width)
+        self.ndim = len(self.shape)
+        self.across = -(-width // self.segment_width)
+        self.down = -(-height // self.segment_height)
+        self._cached = (None, None)
+
+    def _segment_row(self, r):
+        """Decoded rows of the r-th row of segments, (rows, width, samples)."""
+        if self._cached[0] == r:
+            return self._cached[1]
+        self._cached = (None, None)  # free the previous row before decoding
+        height, width = self.shape[:2]
+        top = r * self.segment_height
+        rows = min(self.segment_height, height - top)
+        out = np.zeros((rows, width, self.samples), dtype=self.dtype)
+        planes = self.samples if self.planar else 1
+        indices = [
+            plane * self.down * self.across + r * self.across + j
+            for plane in range(planes) for j in range(self.across)
+        ]
+        with tifffile.TiffFile(self.path) as tif:
+            page = tif.pages[0]
+            for data, index in tif.filehandle.read_segments(
+                [page.dataoffsets[i] for i in indices], [page.databytecounts[i] for i in indices],
+                indices=indices,
+            ):
+                segment = page.decode(data, index, jpegtables=page.jpegtables,
+                                      jpegheader=page.jpegheader)[0]
+                if segment is None:
+                    continue  # sparse segment: left as zeros
+                # (1, rows, cols, samples per segment), tiles padded past the edge
+                segment = segment.reshape(segment.shape[-3:])[:rows]
+                left = (index % self.across) * self.segment_width
+                cols = min(self.segment_width, width - left)
+                if self.planar:
+                    plane = index // (self.down * self.across)
+                    out[:, left:left + cols, plane] = segment[:, :cols, 0]
+                else:
+                    out[:, left:left + cols] = segment[:, :cols]
+        self._cached = (r, out)
+        return out
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        if not isinstance(rows, slice) or not isinstance(cols, slice):
+            raise TypeError("WindowedTiff supports slices only")
+        rows = np.arange(*rows.indices(self.shape[0]))
+        width = len(range(*cols.indices(self.shape[1])))
+        out = np.empty((len(rows), width, self.samples), dtype=self.dtype)
+        segment_rows = rows // self.segment_height
+        for r in np.unique(segment_rows):
+            selected = segment_rows == r
+            block = self._segment_row(int(r))
+            out[selected] = block[rows[selected] - r * self.segment_height, cols]
+        return out if self.samples > 1 else out[:, :, 0]
+
+
+def image_pixel_count(image_path):
+    """Return width * height without decoding pixel data."""
+    if not is_path(image_path):
+        with Image.open(image_source(image_path)) as img:
+            return img.width * img.height
+    ext = os.path.splitext(str(image_path))[1].lower()
+    if ext == ".npy":
+        shape = np.load(image_path, mmap_mode="r").shape
+        return shape[0] * shape[1]
+    if ext in TIFF_EXTENSIONS and tifffile is not None:
+        with tifffile.TiffFile(image_path) as tif:
+            page = tif.pages[0]
+            return page.imagewidth * page.imagelength
+    with Image.open(image_path) as img:
+        return img.width * img.height
+
+
+def iter_bands(arr, band_pixels=BAND_PIXELS):
+    """
+    Yield consecutive row bands of an image array as uint8 RGB.
+
+    Bands of in-memory arrays are views. Bands of memmapped arrays are
+    read (and converted) one at a time: extra channels such as alpha are
+    dropped and 16-bit data is scaled down to 8 bits.
+    """
+    band_rows = max(1, band_pixels // max(1, arr.shape[1]))
+    for top in range(0, arr.shape[0], band_rows):
+        band = arr[top:top + band_rows]
+        if band.ndim == 2:
+            band = np.repeat(band[:, :, None], 3, axis=2)
+        elif band.shape[2] != 3:
+            band = band[:, :, :3]
+        if band.dtype == np.uint16:
+            band = (band >> 8).astype(np.uint8)
+        elif band.dtype != np.uint8:
+            band = np.clip(band, 0, 255).astype(np.uint8)
+        yield band
+
+
+# Frame signatures: frames are decoded to about SIGNATURE_DECODE_SIDE
+# pixels on their short side and registered as SIGNATURE_SIZE x
+# SIGNATURE_SIZE grey thumbnails
+SIGNATURE_DECODE_SIDE = 256
+SIGNATURE_SIZE = 32
+
+
+def frame_signature(image_path):
+    """
+    Signature of what a frame shows, for grouping near-duplicate frames.
+
+    "<thumbnail>:<canopy>:<stress>": a base64 SIGNATURE_SIZE-square grey
+    thumbnail, which signature_distance() registers against other frames
+    to find overlapping ones, then the canopy and stress percentages of
+    the frame, which catch what grey levels cannot see (a brown patch as
+    bright as the crop around it).
+
+    Everything comes from a reduced decode: JPEGs in draft mode (libjpeg
+    scales inside the DCT), TIFF and .npy by strided windows, so signing
+    costs a small fraction of an analysis. The percentages are those of
+    the reduced pixels; they are only compared between signatures.
+    """
+    if can_read_windowed(image_path):
+        arr = open_windowed(image_path)
+        stride = max(1, min(arr.shape[:2]) // SIGNATURE_DECODE_SIDE)
+        arr = np.ascontiguousarray(arr[::stride, ::stride])
+        arr = next(iter_bands(arr, arr.size))
+    else:
+        with Image.open(image_source(image_path)) as img:
+            scale = max(1, min(img.size) // SIGNATURE_DECODE_SIDE)
+            img.draft("RGB", (img.width // scale, img.height // scale))
+            remaining = min(img.size) // SIGNATURE_DECODE_SIDE
+            if remaining > 1:
+                img = img.reduce(remaining)
+            arr = np.asarray(img.convert("RGB"))
+    thumb = Image.fromarray(arr).convert("L").resize((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.BOX)
+    acc = IndexAccumulator(indices=["canopy_pct", "stress_pct"])
+    for band in iter_bands(arr):
+        acc.add(band)
+    cover = acc.means()
+    return "{}:{:.2f}:{:.2f}".format(
+        base64.b64encode(thumb.tobytes()).decode(), cover["canopy_pct"], cover["stress_pct"]
     )
-    stress_pct = (brown_pixels / total_pixels) * 100
 
-    return {
-        "vari": round(VARI_mean, 3),
-        "exg": round(EXG, 3),
-        "gli": round(GLI, 3),
-        "canopy_pct": round(canopy_pct, 2),
-        "stress_pct": round(stress_pct, 2)
-    }
+
+def overlap_correlation(a, b, min_overlap):
+    """
+    Best Pearson correlation between two equal-size grey images over every
+    shift of b against a whose overlap covers at least min_overlap of the
+    frame. Sums over each overlap come from FFT cross-correlations, so all
+    shifts cost a few transforms. Returns -1 when no overlap has texture.
+    """
+    h, w = a.shape
+    shape = (2 * h, 2 * w)
+    ones = np.ones_like(a)
+
+    def corr(x, y):
+        # sum_p x[p] * y[p + shift] for every shift, wrapped into shape
+        return np.fft.irfft2(np.conj(np.fft.rfft2(x, shape)) * np.fft.rfft2(y, shape), shape)
+
+    n = corr(ones, ones)
+    sum_a, sum_b = corr(a, ones), corr(ones, b)
+    cov = corr(a, b) - sum_a * sum_b / np.maximum(n, 1)
+    var_a = corr(a * a, ones) - sum_a ** 2 / np.maximum(n, 1)
+    var_b = corr(ones, b * b) - sum_b ** 2 / np.maximum(n, 1)
+    # Flat overlaps (< 1 grey level of spread) have nothing to register
+    valid = (np.rint(n) >= min_overlap * h * w) & (var_a > n) & (var_b > n)
+    if not valid.any():
+        return -1.0
+    return float((cov[valid] / np.sqrt(var_a[valid] * var_b[valid])).max())
+
+
+def signature_distance(a, b, min_overlap=0.5):
+    """
+    (1 - overlap_correlation() of the thumbnails, largest canopy/stress
+    difference in percentage points) between two frame_signature() values;
+    None when either is empty or from an older signature format.
+    """
+    a, b = a.split(":"), b.split(":")
+    if len(a) != 3 or len(b) != 3:
+        return None
+    thumbs = []
+    for encoded in (a[0], b[0]):
+        try:
+            raw = base64.b64decode(encoded, validate=True)
+        except ValueError:
+            return None
+        if len(raw) != SIGNATURE_SIZE * SIGNATURE_SIZE:
+            return None
+        thumbs.append(np.frombuffer(raw, dtype=np.uint8).reshape(SIGNATURE_SIZE, SIGNATURE_SIZE).astype(np.float64))
+    mismatch = 1 - overlap_correlation(*thumbs, min_overlap)
+    return mismatch, max(abs(float(x) - float(y)) for x, y in zip(a[1:], b[1:]))
+
+
+def halve(arr):
+    """2x2 box-average a uint8 RGB array (odd edge rows/columns dropped)."""
+    h, w = arr.shape[0] // 2, arr.shape[1] // 2
+    blocks = arr[:h * 2, :w * 2].reshape(h, 2, w, 2, 3).astype(np.uint16)
+    return ((blocks.sum(axis=(1, 3)) + 2) // 4).astype(np.uint8)
+
+
+def accumulate(arr, raster=None, grid=None, indices=None):
+    """Run IndexAccumulator over every band of an image array."""
+    acc = IndexAccumulator(raster, grid, arr.shape[:2], indices)
+    for band in iter_bands(arr):
+        acc.add(band)
+    return acc
+
+
+def write_index_pyramid(raster, out_dir, tile_size=TILE_SIZE):
+    """
+    Cut an index raster into a tile pyramid under out_dir.
+
+    Level 0 is the coarsest (one tile); each following level doubles the
+    resolution up to the raster itself. Tiles are stored losslessly as
+    out_dir/<z>/<x>_<y>.png with the RASTER_CHANNELS layout, and
+    pyramid.json records the tile size and every level's dimensions.
+    Returns the number of levels.
+    """
+    levels = [raster]
+    while max(levels[-1].shape[:2]) > tile_size:
+        level = levels[-1]
+        # Replicate the last row/column so odd edges are not dropped
+        level = np.pad(level, ((0, level.shape[0] % 2), (0, level.shape[1] % 2), (0, 0)), mode="edge")
+        levels.append(halve(level))
+    levels.reverse()
+
+    for z, level in enumerate(levels):
+        os.makedirs(os.path.join(out_dir, str(z)), exist_ok=True)
+        for y in range(0, level.shape[0], tile_size):
+            for x in range(0, level.shape[1], tile_size):
+                tile = level[y:y + tile_size, x:x + tile_size]
+                Image.fromarray(tile).save(
+                    os.path.join(out_dir, str(z), f"{x // tile_size}_{y // tile_size}.png")
+                )
+
+    with open(os.path.join(out_dir, "pyramid.json"), "w") as f:
+        json.dump({
+            "tile_size": tile_size,
+            "levels": [[level.shape[1], level.shape[0]] for level in levels],
+        }, f)
+    return len(levels)
+
+
+def _ramp(stops):
+    """256-entry RGBA colour ramp through evenly spaced (r, g, b, a) stops."""
+    stops = np.array(stops, dtype=np.float64)
+    positions = np.linspace(0, 255, len(stops))
+    return np.stack(
+        [np.interp(np.arange(256), positions, stops[:, c]) for c in range(4)], axis=1
+    ).round().astype(np.uint8)
+
+
+# Red -> yellow -> green for the vegetation indices; transparent -> brown for stress
+INDEX_COLORMAPS = {
+    "vari": _ramp([(215, 48, 39, 255), (255, 255, 191, 255), (26, 152, 80, 255)]),
+    "exg": _ramp([(215, 48, 39, 255), (255, 255, 191, 255), (26, 152, 80, 255)]),
+    "stress": _ramp([(140, 81, 10, 0), (140, 81, 10, 255)]),
+}
+
+
+def render_index_tile(raster_tile_path, index, tile_size=TILE_SIZE):
+    """
+    Colour one stored raster tile for display as an RGBA map tile.
+
+    Edge tiles are padded to tile_size with transparent pixels so every
+    served tile has the same dimensions.
+    """
+    with Image.open(raster_tile_path) as tile:
+        values = np.asarray(tile)[:, :, RASTER_CHANNELS[index]]
+    rgba = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+    rgba[:values.shape[0], :values.shape[1]] = INDEX_COLORMAPS[index][values]
+    return Image.fromarray(rgba, "RGBA")
+
+
+def analyze_drone_image(image_path, tiled=False, scale=1, raster_dir=None, grid=None, indices=None):
+    """
+    Compute vegetation indices for one drone image.
+
+    indices names the api.indices registry entries to compute (default
+    VARI, ExG, GLI, canopy % and stress %; canopy is always included).
+    The result holds one value per computed index plus "indices", their
+    names in registry order.
+
+    image_path is a filesystem path, a file-like object or a bytes buffer
+    holding the encoded image, so an upload can be analyzed straight from
+    memory without being reopened from storage.
+
+    By default the image is decoded once and processed in bands by
+    IndexAccumulator, so no full-size float copies are made. With
+    tiled=True the pixels are read window by window through
+    open_windowed(), so peak memory no longer depends on the image size;
+    use it for stitched orthomosaics that do not fit in RAM. It only reads
+    TIFF and .npy paths (see can_read_windowed).
+
+    With scale in PREVIEW_SCALES the image is decoded at 1/scale resolution
+    (see load_rgb) and the result gains a "coarse_fine_delta" dict: per
+    metric, the absolute difference between this result and the same
+    pixels 2x2 box-averaged once more (1/(2*scale)). It shows how much a
+    metric still moves with resolution; it is not an error bound against
+    full resolution (pixels that only cross a threshold at full detail
+    move neither preview).
+
+    With raster_dir set, per-pixel VARI/ExG/stress rasters are also written
+    there as a tile pyramid (see write_index_pyramid) at the resolution
+    that was analyzed, and the result gains "raster_levels". Tiled mode
+    never writes rasters, since a full-size raster would defeat its memory
+    bound.
+
+    With grid=(rows, cols) the same pass also produces per-cell means: the
+    result gains "zonal_grid" (the grid actually used, capped at the image
+    size) and "zonal_stats", a packed float32 (rows, cols, indices) array
+    as bytes.
+
+    "pixels" is the full-resolution pixel count (scaled up from the
+    decoded size for previews), used to weight images by area.
+    """
+    if scale > 1:
+        arr = load_rgb(image_path, scale=scale)
+    elif tiled:
+        arr = open_windowed(image_path)
+        raster_dir = None
+    else:
+        arr = load_rgb(image_path)
+
+    raster = np.empty(arr.shape, dtype=np.uint8) if raster_dir else None
+    acc = accumulate(arr, raster, grid, indices)
+    results = acc.result()
+    if results is None:
+        return None
+    results["indices"] = acc.names
+    results["pixels"] = acc.pixels * scale * scale
+
+    if raster is not None:
+        results["raster_levels"] = write_index_pyramid(raster, raster_dir)
+    if grid is not None:
+        results["zonal_grid"] = acc.cell_sums.shape[:2]
+        results["zonal_stats"] = acc.zonal().tobytes()
+
+    if scale > 1:
+        coarse = accumulate(halve(arr), indices=acc.names).means() if min(arr.shape[:2]) >= 2 else None
+        fine_means = acc.means()
+        results["coarse_fine_delta"] = {
+            key: round(abs(fine_means[key] - coarse[key]) if coarse else 0.0,
+                       METRIC_DECIMALS[key])
+            for key in fine_means
+        }
+    return results
 
 
 def estimate_yield(canopy, stress):
@@ -1,15 +1,212 @@
+import io
+import json
+import os
+import queue
+import re
+import uuid
+from datetime import datetime, time, timedelta
+from time import monotonic
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.files.storage import default_storage
-from .utils import analyze_drone_image, estimate_yield, generate_recommendations
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
-from .models import AnalysisSession, DroneImage
-from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from . import chatcache, counters, inference
+from .exports import EXPORT_COLUMNS, EXPORT_CONTENT_TYPES, export_formats, export_stream
+from .indices import METRIC_DECIMALS, resolve_indices
+from .pool import analyze_images
+from .services import (
+    append_to_session,
+    bulk_create_images,
+    create_upload_batch,
+    discard_incomplete_uploads,
+    discard_uploads,
+    duplicate_metrics,
+    export_queryset,
+    finalize_session,
+    get_latest_session,
+    group_near_duplicates,
+    image_metrics,
+    metric_trends,
+    oversized_upload_error,
+    session_history,
+    session_image_history,
+    session_progress,
+    session_summary,
+    stage_uploads,
+    upload_quota_error,
+    write_chunk,
+)
+from .uploadhandlers import IngestUploadHandler
+from .utils import (
+    PREVIEW_SCALES,
+    RASTER_CHANNELS,
+    render_index_tile,
+)
+from .models import AnalysisSession, ChunkedUpload, DroneImage, MetricRollup
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.core.cache import cache
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
+
+
+# Largest zonal grid side a client may request
+MAX_ZONAL_GRID = 64
+
+# Rows per page of the history lists (default and largest a client may request)
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+# Session metrics the history list can be filtered on with min_<field> / max_<field>
+HISTORY_THRESHOLD_FIELDS = ("canopy_cover", "stress_percentage", "yield_estimate", "vari", "gli", "exg")
+
+
+def analysis_params(data):
+    """
+    Parse the analysis options shared by the upload endpoints.
+
+    Returns (params, error): params holds analysis_mode, decode_scale,
+    rasters, grid, dedupe and indices; error is a message for a 400
+    response, or None.
+    """
+    # Optional fast preview: decode at 1/2, 1/4 or 1/8 resolution
+    preview_scale = data.get("preview")
+    if preview_scale:
+        try:
+            preview_scale = int(preview_scale)
+        except (TypeError, ValueError):
+            preview_scale = None
+        if preview_scale not in PREVIEW_SCALES:
+            return None, f"preview must be one of {', '.join(map(str, PREVIEW_SCALES))}"
+    else:
+        preview_scale = 1
+
+    # Zonal statistics grid, "<rows>x<cols>" (defaults to ANALYSIS_ZONAL_GRID)
+    grid = data.get("grid")
+    if grid:
+        try:
+            grid = tuple(int(n) for n in str(grid).lower().split("x"))
+        except ValueError:
+            grid = None
+        if not grid or len(grid) != 2 or not all(1 <= n <= MAX_ZONAL_GRID for n in grid):
+            return None, f"grid must look like 8x8, at most {MAX_ZONAL_GRID} per side"
+    else:
+        grid = settings.ANALYSIS_ZONAL_GRID
+
+    # Comma-separated api.indices names to compute (default DEFAULT_INDICES)
+    indices = data.get("indices")
+    if indices:
+        try:
+            indices = [index.name for index in resolve_indices(
+                [name.strip().lower() for name in str(indices).split(",") if name.strip()]
+            )]
+        except ValueError as e:
+            return None, str(e)
+    else:
+        indices = None
+
+    return {
+        "analysis_mode": DroneImage.MODE_PREVIEW if preview_scale > 1 else DroneImage.MODE_FULL,
+        "decode_scale": preview_scale,
+        # Optionally keep per-pixel index rasters for the map tile endpoint
+        "rasters": str(data.get("rasters", "")).lower() in ("1", "true", "yes"),
+        "grid": grid,
+        # Optionally group near-identical frames and analyze one per group
+        "dedupe": str(data.get("dedupe", "")).lower() in ("1", "true", "yes"),
+        "indices": indices,
+    }, None
+
+
+def session_weighting(data):
+    """Parse the "weighting" option of a new session: (weighting, error)."""
+    weighting = str(data.get("weighting") or AnalysisSession.WEIGHT_IMAGES).lower()
+    choices = [choice for choice, _ in AnalysisSession.WEIGHTING_CHOICES]
+    if weighting not in choices:
+        return None, f"weighting must be one of {', '.join(choices)}"
+    return weighting, None
+
+
+def analyze_uploads(images, params):
+    """
+    Store, deduplicate and analyze uploads for the synchronous endpoints.
+
+    Returns (staged, drone_images, num_jobs, coarse_fine_deltas): the staged
+    entries, one unsaved processed DroneImage per upload that produced
+    metrics (failed ones are left out), the number of images analyzed and
+    the coarse-to-fine preview differences of those.
+    """
+    coarse_fine_deltas = []
+
+    # Save every upload, then analyze the new ones in parallel on the
+    # shared pool; bytes analyzed before reuse their stored metrics
+    staged = stage_uploads(images, **params)
+    group_near_duplicates(staged)
+    jobs, job_index = [], {}
+    for entry in staged:
+        if "options" in entry and entry["analysis_weight"] > 0 and entry["full_path"] not in job_index:
+            job_index[entry["full_path"]] = len(jobs)
+            jobs.append((entry["source"], entry["options"]))
+    job_results = analyze_images(jobs)
+
+    # Collect the rows; callers write them and the session in one transaction
+    created = {}
+    for index, entry in enumerate(staged):
+        raster_levels = entry["raster_levels"]
+        representative = created.get(entry["representative"])
+        if "metrics" in entry:
+            metrics = entry["metrics"]
+        elif entry["analysis_weight"] == 0:
+            if representative is None or representative.canopy_cover is None:
+                continue  # the group's analyzed frame failed
+            metrics = duplicate_metrics(representative)
+            raster_levels = 0
+        else:
+            results = job_results[job_index[entry["full_path"]]]
+            if results is None:
+                continue  # skip failed images
+            if "coarse_fine_delta" in results and not entry["reused"]:
+                coarse_fine_deltas.append(results["coarse_fine_delta"])
+            # Includes the yield estimate when stress was computed
+            metrics = image_metrics(results)
+            raster_levels = results.get("raster_levels", 0)
+
+        # Individual image analysis
+        created[index] = DroneImage(
+            image=entry["file_path"],
+            processed=True,
+            analysis_mode=entry["analysis_mode"],
+            decode_scale=entry["decode_scale"],
+            content_hash=entry["content_hash"],
+            reused=entry["reused"],
+            raster_path=entry["raster_path"] if raster_levels else "",
+            raster_levels=raster_levels,
+            **dict(metrics, frame_signature=entry["frame_signature"]),
+            representative=representative,
+            analysis_weight=entry["analysis_weight"],
+        )
+    return staged, list(created.values()), len(jobs), coarse_fine_deltas
+
+
+def analysis_response(session, num_images, staged, num_jobs, coarse_fine_deltas, preview_scale):
+    """Response body of a synchronous analysis request."""
+    response = session_summary(session, num_images)
+    response["cache_hits"] = sum(entry["reused"] for entry in staged)
+    response["cache_misses"] = num_jobs
+    response["duplicates_skipped"] = sum(entry["analysis_weight"] == 0 for entry in staged)
+    if preview_scale > 1:
+        # Mean of the per-image coarse-to-fine differences (not an error bound)
+        response["analysis_mode"] = DroneImage.MODE_PREVIEW
+        response["decode_scale"] = preview_scale
+        response["coarse_fine_delta"] = {
+            key: round(sum(delta[key] for delta in coarse_fine_deltas) / len(coarse_fine_deltas), 3)
+            for key in coarse_fine_deltas[0]
+        } if coarse_fine_deltas else None
+    return response
 
 
 class CropAnalysisView(APIView):
@@ -17,94 +214,566 @@ class CropAnalysisView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
+        # Store and hash uploads while they stream in (must be set before FILES is read)
+        request._request.upload_handlers = [IngestUploadHandler(request._request)]
         images = request.FILES.getlist("images")  # accept multiple images
         if not images:
             return Response({"error": "No images uploaded"}, status=400)
 
-        # Create a new session
-        session = AnalysisSession.objects.create()
+        params, error = analysis_params(request.data)
+        weighting, weighting_error = session_weighting(request.data)
+        # Large orthomosaics must be readable by window (TIFF)
+        error = error or weighting_error or oversized_upload_error(images)
+        if error:
+            discard_uploads(images)
+            return Response({"error": error}, status=400)
 
-        # To store aggregated values
-        canopy_list, stress_list, yield_list = [], [], []
-        vari_list, gli_list, exg_list = [], [], []
+        if str(request.data.get("async", "")).lower() in ("1", "true", "yes"):
+            return self.enqueue(images, params, weighting, request.user)
 
-        for image_file in images:
-            # Save temporarily
-            file_path = default_storage.save(f"drone_images/{image_file.name}", image_file)
-            full_path = default_storage.path(file_path)
+        staged, drone_images, num_jobs, coarse_fine_deltas = analyze_uploads(images, params)
 
-            # Analyze image
-            results = analyze_drone_image(full_path)
-            if results is None:
-                continue  # skip failed images
-            
-            
+        with transaction.atomic():
+            session = AnalysisSession.objects.create(
+                status=AnalysisSession.STATUS_PROCESSING, weighting=weighting, owner=request.user,
+                images_total=len(images), images_done=len(images), dedupe=params["dedupe"],
+            )
+            for drone_image in drone_images:
+                drone_image.session = session
+            bulk_create_images(session, drone_images)
+            # Aggregate session metrics (weighted, so near-duplicate groups count once)
+            finalize_session(session)
+
+        response = analysis_response(
+            session, len(drone_images), staged, num_jobs, coarse_fine_deltas, params["decode_scale"]
+        )
+        return Response(response, status=200)
 
-            # Estimate yield
-            estimate = estimate_yield(results["canopy_pct"], results["stress_pct"])
-            yield_estimate = estimate["yield_estimate"]
-
-            # Save individual image analysis
-            drone_image = DroneImage.objects.create(
-                session=session,
-                image=file_path,
-                vari=results.get("vari"),
-                gli=results.get("gli"),
-                exg=results.get("exg"),
-                canopy_cover=results.get("canopy_pct"),
-                stress_percentage=results.get("stress_pct"),
-                yield_estimate=yield_estimate,
+    def enqueue(self, images, params, weighting, owner):
+        """
+        Store the uploads as a pending session for run_analysis_worker,
+        which also signs and groups near-duplicates (dedupe).
+        """
+        grid, indices = params["grid"], params["indices"]
+        with transaction.atomic():
+            session = AnalysisSession.objects.create(
+                images_total=len(images), weighting=weighting, owner=owner, dedupe=params["dedupe"],
             )
+            drone_images = []
+            for entry in stage_uploads(images, **dict(params, dedupe=False)):
+                # With dedupe, cache hits are left unsigned to the worker as
+                # well (it reuses their metrics) so they are grouped with the rest
+                signature = "" if params["dedupe"] else entry["frame_signature"]
+                fields = entry.get("metrics") if not params["dedupe"] else None
+                if fields is None:
+                    # Tells the worker which grid and indices to compute
+                    fields = {"indices": ",".join(indices or ())}
+                    if grid:
+                        fields.update(zonal_rows=grid[0], zonal_cols=grid[1])
+                drone_images.append(DroneImage(
+                    session=session,
+                    image=entry["file_path"],
+                    analysis_mode=entry["analysis_mode"],
+                    decode_scale=entry["decode_scale"],
+                    content_hash=entry["content_hash"],
+                    reused=entry["reused"],
+                    raster_path=entry["raster_path"],
+                    raster_levels=entry["raster_levels"],
+                    processed="indices" not in fields,
+                    **dict(fields, frame_signature=signature),
+                ))
+                if "indices" not in fields:
+                    session.images_done += 1
+            bulk_create_images(session, drone_images)
+
+            if session.images_done == session.images_total:
+                finalize_session(session)  # every image was a cache hit
+            else:
+                session.save(update_fields=["images_done"])
 
-            # Add metrics to lists for aggregation
-            canopy_list.append(results.get("canopy_pct", 0))
-            stress_list.append(results.get("stress_pct", 0))
-            yield_list.append(yield_estimate)
-            vari_list.append(results.get("vari", 0))
-            gli_list.append(results.get("gli", 0))
-            exg_list.append(results.get("exg", 0))
-
-        # Aggregate session metrics
-        if canopy_list:
-            session.canopy_cover = sum(canopy_list) / len(canopy_list)
-            session.stress_percentage = sum(stress_list) / len(stress_list)
-            session.yield_estimate = sum(yield_list) / len(yield_list)
-            session.vari = sum(vari_list) / len(vari_list)
-            session.gli = sum(gli_list) / len(gli_list)
-            session.exg = sum(exg_list) / len(exg_list)
-            session.save()
-        
-        # Build dictionary for recommendation system
-        analysis_summary = {
-            "canopy_cover": session.canopy_cover,
-            "stress_percentage": session.stress_percentage,
-            "yield_estimate": session.yield_estimate,
-            "vari": session.vari,
-            "gli": session.gli,
-            "exg": session.exg,
-        }
-        # Generate recommendations
-        recommendations = generate_recommendations(analysis_summary)
-        
         return Response({
             "session_id": session.session_id,
-            "num_images_processed": len(canopy_list),
-            "canopy_cover": round(session.canopy_cover, 2),
-            "stress_percentage": round(session.stress_percentage, 2),
-            "yield_estimate": round(session.yield_estimate, 2),
-            # NDVI-like indices
-            "vari": session.vari,
-            "gli": session.gli,
-            "exg": session.exg,
-            "recommendations": recommendations
-        }, status=200)
+            "status": session.status,
+            "images_total": session.images_total,
+            "images_done": session.images_done,
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class CropAnalysisStatusView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        session = get_object_or_404(AnalysisSession, session_id=session_id, owner=request.user)
+        return Response(session_progress(session))
+
+
+class CropAnalysisAppendView(APIView):
+    """
+    Add images to a completed session, e.g. a field flown in several passes.
+
+    Takes the same upload and analysis options as CropAnalysisView (analysis
+    is synchronous); the session keeps its weighting. Near-duplicates are
+    grouped within the appended batch.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, session_id):
+        request._request.upload_handlers = [IngestUploadHandler(request._request)]
+        images = request.FILES.getlist("images")
+        if not images:
+            return Response({"error": "No images uploaded"}, status=400)
+
+        params, error = analysis_params(request.data)
+        error = error or oversized_upload_error(images)
+        if error:
+            discard_uploads(images)
+            return Response({"error": error}, status=400)
+        conflict = Response(
+            {"error": "Only completed sessions can be appended to"}, status=status.HTTP_409_CONFLICT
+        )
+        session = AnalysisSession.objects.filter(session_id=session_id, owner=request.user).first()
+        if session is None or session.status not in (
+            AnalysisSession.STATUS_COMPLETED, AnalysisSession.STATUS_FAILED
+        ):
+            discard_uploads(images)
+            if session is None:
+                raise Http404
+            return conflict
+
+        staged, drone_images, num_jobs, coarse_fine_deltas = analyze_uploads(images, params)
+        # Checked again under the session lock
+        session = append_to_session(session_id, drone_images, len(images))
+        if session is None:
+            discard_uploads(images)
+            return conflict
+
+        num_images = session.images.filter(canopy_cover__isnull=False).count()
+        response = analysis_response(
+            session, num_images, staged, num_jobs, coarse_fine_deltas, params["decode_scale"]
+        )
+        response["images_appended"] = len(drone_images)
+        return Response(response, status=200)
+
+
+class CropAnalysisFinalizeView(APIView):
+    """
+    Close a resumable upload batch.
+
+    Every upload must be complete, unless discard_incomplete is set, in
+    which case unfinished files are dropped and the session is analyzed
+    without them. Completed files are analyzed as they arrive either way.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, session_id):
+        with transaction.atomic():
+            session = get_object_or_404(
+                AnalysisSession.objects.select_for_update(), session_id=session_id, owner=request.user
+            )
+            incomplete = session.uploads.filter(completed_at__isnull=True)
+            if incomplete.exists():
+                if str(request.data.get("discard_incomplete", "")).lower() not in ("1", "true", "yes"):
+                    return Response({
+                        "error": "Some uploads are incomplete",
+                        "incomplete": [
+                            {"upload_id": upload.upload_id, "received": upload.received, "size": upload.size}
+                            for upload in incomplete
+                        ],
+                    }, status=status.HTTP_409_CONFLICT)
+                discard_incomplete_uploads(session)
+        return Response(session_progress(session))
+
+
+# "Content-Range: bytes <first>-<last>/<size>" of a chunk PUT
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+class ChunkedUploadBatchView(APIView):
+    """
+    Open a resumable upload batch.
+
+    POST {"files": [{"name": ..., "size": ...}], "preview", "rasters",
+    "grid"} creates a session in "receiving" state and one upload per
+    file; PUT each file's bytes to uploads/<upload_id>/ in any number of
+    chunks, then POST crop-analysis/<session_id>/finalize/. A user's
+    unfinished uploads are capped in number and declared bytes (429 past
+    either), and uploads that go CHUNKED_UPLOAD_EXPIRY without a chunk are
+    dropped by run_analysis_worker.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        files = request.data.get("files")
+        if not isinstance(files, list) or not files:
+            return Response({"error": "files must be a non-empty list of {name, size}"}, status=400)
+        declared = []
+        for f in files:
+            try:
+                name, size = os.path.basename(str(f["name"])), int(f["size"])
+            except (TypeError, KeyError, ValueError):
+                return Response({"error": "every file needs a name and a size"}, status=400)
+            if not name or not 0 < size <= settings.CHUNKED_UPLOAD_MAX_BYTES:
+                return Response(
+                    {"error": f"file sizes must be between 1 and {settings.CHUNKED_UPLOAD_MAX_BYTES} bytes"},
+                    status=400,
+                )
+            declared.append({"name": name, "size": size})
+
+        params, error = analysis_params(request.data)
+        weighting, weighting_error = session_weighting(request.data)
+        if error or weighting_error:
+            return Response({"error": error or weighting_error}, status=400)
+
+        with transaction.atomic():
+            # Locked so concurrent batches cannot both slip under the quota
+            owner = get_user_model().objects.select_for_update().get(pk=request.user.pk)
+            quota_error = upload_quota_error(owner, declared)
+            if quota_error:
+                return Response({"error": quota_error}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            session, uploads = create_upload_batch(owner, declared, weighting=weighting, **params)
+        return Response({
+            "session_id": session.session_id,
+            "status": session.status,
+            "uploads": [upload_state(upload) for upload in uploads],
+        }, status=status.HTTP_201_CREATED)
+
+
+def upload_state(upload):
+    return {
+        "upload_id": upload.upload_id,
+        "name": upload.file_name,
+        "size": upload.size,
+        "received": upload.received,
+        "complete": upload.completed_at is not None,
+    }
+
+
+class ChunkedUploadView(APIView):
+    """
+    GET the received byte ranges of one upload, or PUT a chunk of it.
+
+    A chunk is the raw request body, placed by a
+    "Content-Range: bytes <first>-<last>/<size>" header (or an ?offset=
+    query parameter). Bytes that arrive before a connection drops are
+    kept, so a client resumes by GETting the ranges and sending the gaps.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        upload = get_object_or_404(ChunkedUpload, upload_id=upload_id, owner=request.user)
+        return Response(upload_state(upload))
+
+    def put(self, request, upload_id):
+        upload = get_object_or_404(ChunkedUpload, upload_id=upload_id, owner=request.user)
+        if upload.completed_at is not None:
+            return Response(upload_state(upload))
+
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        content_range = request.META.get("HTTP_CONTENT_RANGE")
+        if content_range:
+            match = CONTENT_RANGE_RE.match(content_range.strip())
+            if not match or (match[3] != "*" and int(match[3]) != upload.size):
+                return Response({"error": f"Content-Range must be bytes first-last/{upload.size}"}, status=400)
+            start = int(match[1])
+            if int(match[2]) - start + 1 != length:
+                return Response({"error": "Content-Range does not match Content-Length"}, status=400)
+        else:
+            try:
+                start = int(request.query_params.get("offset", 0))
+            except ValueError:
+                return Response({"error": "offset must be an integer"}, status=400)
+        if length <= 0 or start < 0 or start + length > upload.size:
+            return Response(
+                {"error": f"chunk must be non-empty and lie within the {upload.size}-byte file"},
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            )
+
+        # Read the raw body as it streams in; request.data is never parsed
+        upload = write_chunk(upload, start, request._request, length)
+        if upload is None:
+            raise Http404  # expired while the chunk was arriving
+        return Response(upload_state(upload))
+
+
+# Map tile formats served by IndexTileView
+TILE_CONTENT_TYPES = {"png": "image/png", "webp": "image/webp"}
+
+
+class IndexTilePyramidView(APIView):
+    """Describe the index tile pyramid of one image."""
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, image_id):
+        drone_image = get_object_or_404(
+            DroneImage, id=image_id, raster_levels__gt=0, session__owner=request.user
+        )
+        with default_storage.open(f"{drone_image.raster_path}/pyramid.json") as f:
+            pyramid = json.load(f)
+        pyramid["indices"] = list(RASTER_CHANNELS)
+        pyramid["formats"] = list(TILE_CONTENT_TYPES)
+        return Response(pyramid)
+
+
+class IndexTileView(APIView):
+    """
+    Serve a coloured VARI/ExG/stress map tile.
+
+    Tiles are rendered from the stored index rasters (never the original
+    image) on first request and then served from an on-disk tile cache.
+    A tile never changes, so clients may cache it indefinitely.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def perform_content_negotiation(self, request, force=False):
+        # Tiles are images whatever the Accept header of a map client says
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, image_id, index, z, x, y, fmt):
+        if index not in RASTER_CHANNELS or fmt not in TILE_CONTENT_TYPES:
+            raise Http404
+        drone_image = get_object_or_404(
+            DroneImage, id=image_id, raster_levels__gt=0, session__owner=request.user
+        )
+        if z >= drone_image.raster_levels:
+            raise Http404
+
+        raster_key = os.path.basename(drone_image.raster_path)
+        cache_name = f"tile_cache/{raster_key}/{index}/{z}/{x}_{y}.{fmt}"
+        if not default_storage.exists(cache_name):
+            source = f"{drone_image.raster_path}/{z}/{x}_{y}.png"
+            if not default_storage.exists(source):
+                raise Http404
+            buffer = io.BytesIO()
+            render_index_tile(default_storage.path(source), index).save(buffer, format=fmt.upper())
+            cache_path = default_storage.path(cache_name)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Write then rename so concurrent requests never serve a partial tile
+            tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, cache_path)
+
+        response = FileResponse(default_storage.open(cache_name), content_type=TILE_CONTENT_TYPES[fmt])
+        response["Cache-Control"] = "private, max-age=31536000, immutable"
+        return response
+
+
+class ZonalStatsView(APIView):
+    """Per-cell grid statistics of one image, computed during analysis."""
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, image_id):
+        drone_image = get_object_or_404(
+            DroneImage, id=image_id, zonal_stats__isnull=False, session__owner=request.user
+        )
+        cells = drone_image.zonal_array().astype(float)
+        return Response({
+            "image_id": drone_image.id,
+            "rows": drone_image.zonal_rows,
+            "cols": drone_image.zonal_cols,
+            # One rows x cols matrix per computed index, row-major from the top-left
+            "metrics": {
+                metric: cells[:, :, k].round(METRIC_DECIMALS[metric]).tolist()
+                for k, metric in enumerate(drone_image.index_names())
+            },
+        })
+
 
+def page_size(data):
+    """Parse the "limit" of a history page: (limit, error)."""
+    try:
+        limit = int(data.get("limit") or HISTORY_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= MAX_HISTORY_PAGE_SIZE:
+        return None, f"limit must be between 1 and {MAX_HISTORY_PAGE_SIZE}"
+    return limit, None
 
 
+def parse_bound(value, end_of_day=False):
+    """
+    ISO date or datetime query value as an aware datetime (None if blank).
+
+    A bare date means the start of that day, or with end_of_day the start
+    of the next one, so created_before=2026-05-01 includes all of May 1st.
+    """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day + timedelta(days=end_of_day), time.min)
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class SessionHistoryView(APIView):
+    """
+    The user's past sessions, newest first, with their aggregate metrics.
+
+    Query parameters: limit, cursor (next_cursor of the previous page),
+    created_after / created_before (ISO date or datetime), status, and
+    min_<metric> / max_<metric> for the HISTORY_THRESHOLD_FIELDS.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        limit, error = page_size(params)
+        if error:
+            return Response({"error": error}, status=400)
+
+        try:
+            created_after = parse_bound(params.get("created_after"))
+            created_before = parse_bound(params.get("created_before"), end_of_day=True)
+        except ValueError:
+            return Response({"error": "created_after and created_before must be ISO dates or datetimes"}, status=400)
+
+        status_filter = params.get("status") or None
+        if status_filter and status_filter not in dict(AnalysisSession.STATUS_CHOICES):
+            return Response({"error": f"unknown status {status_filter}"}, status=400)
+
+        thresholds = {}
+        for field in HISTORY_THRESHOLD_FIELDS:
+            bounds = [params.get(f"{bound}_{field}") for bound in ("min", "max")]
+            if any(bounds):
+                try:
+                    thresholds[field] = tuple(float(b) if b else None for b in bounds)
+                except ValueError:
+                    return Response({"error": f"min_{field} and max_{field} must be numbers"}, status=400)
+
+        try:
+            rows, next_cursor = session_history(
+                request.user, limit, cursor=params.get("cursor"),
+                created_after=created_after, created_before=created_before,
+                status=status_filter, thresholds=thresholds,
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response({"results": rows, "next_cursor": next_cursor})
+
+
+class SessionImageHistoryView(APIView):
+    """The images of one of the user's sessions with their metrics, by id."""
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        session = get_object_or_404(AnalysisSession, session_id=session_id, owner=request.user)
+        limit, error = page_size(request.query_params)
+        if error:
+            return Response({"error": error}, status=400)
+        try:
+            rows, next_cursor = session_image_history(
+                session, limit, cursor=request.query_params.get("cursor")
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response({"results": rows, "next_cursor": next_cursor})
+
+
+class TrendView(APIView):
+    """
+    Daily or weekly canopy, stress and yield means of the user's sessions.
+
+    Query parameters: period ("week" by default, or "day") and start / end
+    (ISO dates, inclusive, matched against each period's first day).
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        period = params.get("period") or MetricRollup.PERIOD_WEEK
+        if period not in dict(MetricRollup.PERIOD_CHOICES):
+            return Response({"error": "period must be day or week"}, status=400)
+        bounds = {}
+        for name in ("start", "end"):
+            value = params.get(name)
+            try:
+                bounds[name] = parse_date(value) if value else None
+            except ValueError:
+                bounds[name] = None
+            if value and bounds[name] is None:
+                return Response({"error": f"{name} must be an ISO date"}, status=400)
+        return Response({
+            "period": period,
+            "results": metric_trends(request.user, period, **bounds),
+        })
+
+
+class ExportView(APIView):
+    """
+    Stream the user's sessions or images as CSV, NDJSON or Parquet.
+
+    /api/export/<sessions|images>.<csv|ndjson|parquet>, with optional
+    created_after / created_before (ISO date or datetime) and, for images,
+    session. Rows are written as they are read (see api.exports), so the
+    export never sits in memory whole.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, kind, fmt):
+        if kind not in EXPORT_COLUMNS:
+            raise Http404
+        if fmt not in export_formats():
+            return Response({"error": f"format must be one of {', '.join(export_formats())}"}, status=400)
+
+        params = request.query_params
+        try:
+            created_after = parse_bound(params.get("created_after"))
+            created_before = parse_bound(params.get("created_before"), end_of_day=True)
+            session_id = int(params["session"]) if params.get("session") else None
+        except ValueError:
+            return Response({"error": "invalid created_after, created_before or session"}, status=400)
+
+        rows = export_queryset(request.user, kind, created_after, created_before, session_id)
+        response = StreamingHttpResponse(
+            export_stream(rows, kind, fmt), content_type=EXPORT_CONTENT_TYPES[fmt]
+        )
+        response["Content-Disposition"] = f'attachment; filename="{kind}.{fmt}"'
+        return response
+
+
+class MetricsView(APIView):
+    """Operational counters of this worker process (admin only)."""
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            "counters": counters.snapshot(),
+            # Persistent total across processes and restarts
+            "reused_images": DroneImage.objects.filter(reused=True).count(),
+        })
+
+
+class ChatbotReadyView(APIView):
+    """Readiness probe: 200 once this process has the chatbot model loaded, else 503."""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        ready = inference.is_ready()
+        return Response(
+            {"ready": ready, "model": inference.model_name()},
+            status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
 
-# Global model cache
-MODEL_CACHE_KEY = "flan_t5_model"
-TOKENIZER_CACHE_KEY = "flan_t5_tokenizer"
 
 class ChatbotView(APIView):
     authentication_classes = [JWTAuthentication]
@@ -119,8 +788,8 @@ class ChatbotView(APIView):
         user = request.user
         user_role = user.role if hasattr(user, 'role') else 'farmer'
         
-        # Get latest analyzed session
-        latest_session = AnalysisSession.objects.order_by("-created_at").first()
+        # Get this user's latest completed session (pending or failed ones have no metrics)
+        latest_session = get_latest_session(user, AnalysisSession.STATUS_COMPLETED)
         
         # DEBUG: Print session details
         print(f"\n{'='*50}")
@@ -155,8 +824,10 @@ class ChatbotView(APIView):
                 "debug": context_data  # Add debug info to response
             })
         
-        # Generate response
-        bot_response = self.generate_response_with_timeout(user_message, context_data)
+        # Then answers already generated for the same question and data
+        bot_response = chatcache.get(user_message, context_data)
+        if bot_response is None:
+            bot_response = self.generate_response_with_timeout(user_message, context_data)
         
         return Response({
             "response": bot_response,
@@ -166,24 +837,6 @@ class ChatbotView(APIView):
         })
     
 
-    def get_model_and_tokenizer(self):
-        """Get or load model and tokenizer with caching"""
-        model = cache.get(MODEL_CACHE_KEY)
-        tokenizer = cache.get(TOKENIZER_CACHE_KEY)
-        
-        if not model or not tokenizer:
-            print("Loading model and tokenizer...")
-            # Use a smaller model for faster responses
-            model_name = "google/flan-t5-small"  # Smaller and faster than base
-            tokenizer = AutoTokenizer.from_pretrained(model_name)
-            model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-            
-            # Cache for future requests
-            cache.set(MODEL_CACHE_KEY, model, timeout=3600)  # 1 hour cache
-            cache.set(TOKENIZER_CACHE_KEY, tokenizer, timeout=3600)
-        
-        return model, tokenizer
-
     def check_quick_responses(self, user_message, context):
         """Handle common questions without model inference for speed"""
         user_message_lower = user_message.lower()
@@ -283,65 +936,26 @@ class ChatbotView(APIView):
             return "For fertilizer recommendations: 1) Test your soil first, 2) Use balanced NPK fertilizer, 3) Apply during growth stages, 4) Avoid excessive nitrogen. Different crops need different nutrients at various growth stages."
 
     def generate_response_with_timeout(self, user_message, context, timeout_seconds=3):
-        """Generate response with timeout to prevent hanging"""
-        import threading
-        import queue
-        
-        result_queue = queue.Queue()
-        
-        def generate_thread():
-            try:
-                response = self.generate_response(user_message, context)
-                result_queue.put(response)
-            except Exception as e:
-                result_queue.put(f"I encountered an issue. {self.get_fallback_response(user_message, context)}")
-        
-        thread = threading.Thread(target=generate_thread)
-        thread.daemon = True
-        thread.start()
-        thread.join(timeout_seconds)
-        
-        if thread.is_alive():
-            # Thread timed out, return quick response
-            return f"I'm processing your question about '{user_message[:50]}...'. While I analyze, here's quick advice: {self.get_quick_advice(user_message)}"
-        
+        """Generate response, answering with quick advice when the model is busy or too slow"""
         try:
-            return result_queue.get_nowait()
-        except queue.Empty:
-            return self.get_fallback_response(user_message, context)
+            return self.generate_response(user_message, context, timeout=timeout_seconds)
+        except (queue.Full, TimeoutError):
+            # Queue full or deadline passed; the model stops working on this prompt
+            return self.busy_response(user_message)
+
+    def busy_response(self, user_message):
+        """Quick advice while the model is busy or too slow"""
+        return f"I'm processing your question about '{user_message[:50]}...'. While I analyze, here's quick advice: {self.get_quick_advice(user_message)}"
 
-    def generate_response(self, user_message, context):
+    def generate_response(self, user_message, context, timeout=None):
         """Generate intelligent response using FLAN-T5 with optimization"""
         
         # Build prompt
         prompt = self.build_prompt(user_message, context)
         
         try:
-            # Get model and tokenizer
-            model, tokenizer = self.get_model_and_tokenizer()
-            
-            # Tokenize with optimized settings
-            inputs = tokenizer(
-                prompt, 
-                return_tensors="pt", 
-                max_length=256,  # Reduced from 512
-                truncation=True
-            )
-            
-            # Generate with optimized parameters
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=150,  # Reduced from 200
-                temperature=0.7,
-                do_sample=False,  # Changed to False for speed
-                top_p=0.85,
-                repetition_penalty=1.1,
-                no_repeat_ngram_size=2,
-                length_penalty=0.8,
-                early_stopping=True
-            )
-            
-            response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+            # Batched with concurrent chats by the inference thread
+            response = inference.generate(prompt, timeout=timeout)
             
             # Clean up response
             response = self.clean_response(response, user_message)
@@ -350,8 +964,11 @@ class ChatbotView(APIView):
             if len(response.split()) < 10:
                 response = f"{response} {self.get_quick_advice(user_message)}"
             
+            chatcache.put(user_message, context, response)
             return response
             
+        except (queue.Full, TimeoutError):
+            raise
         except Exception as e:
             print(f"Model error: {e}")
             return self.get_fallback_response(user_message, context)
@@ -437,4 +1054,101 @@ Answer briefly and helpfully:"""
             "exg_index": round(float(session.exg), 3) if session.exg else 0,
             "gli_index": round(float(session.gli), 3) if session.gli else 0,
             "analysis_date": session.created_at.strftime("%Y-%m-%d") if session.created_at else "Unknown"
-        }
\ No newline at end of file
+        }
+
+
+def sse_event(data, event=None):
+    """One Server-Sent Event carrying data as JSON."""
+    name = f"event: {event}\n" if event else ""
+    return f"{name}data: {json.dumps(data)}\n\n"
+
+
+class ChatbotStreamView(ChatbotView):
+    """
+    Chatbot answer streamed as Server-Sent Events while it is generated:
+    {"token": ...} events with pieces of text, then a "done" event with the
+    cleaned full response and the time to first token. An answer cut short
+    by the deadline is sent as far as it got, with "truncated": true (the
+    busy text only when nothing was generated). A client that disconnects
+    stops the generation.
+    """
+    stream_timeout_seconds = 30
+
+    def post(self, request):
+        started = monotonic()
+        user_message = request.data.get("message", "").strip()
+        if not user_message:
+            return Response({"error": "No message provided"}, status=400)
+
+        user = request.user
+        user_role = user.role if hasattr(user, 'role') else 'farmer'
+        context_data = self.prepare_context(
+            get_latest_session(user, AnalysisSession.STATUS_COMPLETED), user_role
+        )
+
+        answer = self.check_quick_responses(user_message, context_data)
+        if answer is None:
+            answer = chatcache.get(user_message, context_data)
+        pieces = None
+        if answer is None:
+            try:
+                pieces = inference.stream(self.build_prompt(user_message, context_data),
+                                          timeout=self.stream_timeout_seconds)
+            except queue.Full:
+                answer = self.busy_response(user_message)
+            except Exception as e:
+                print(f"Model error: {e}")
+                answer = self.get_fallback_response(user_message, context_data)
+
+        response = StreamingHttpResponse(
+            self.stream_events(started, user_message, context_data, pieces, answer),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx: pass events through as they come
+        return response
+
+    def stream_events(self, started, user_message, context_data, pieces, answer):
+        first_token, truncated = None, False
+        if pieces is not None:
+            parts = []
+            try:
+                for piece in pieces:
+                    if first_token is None:
+                        first_token = monotonic() - started
+                    parts.append(piece)
+                    yield sse_event({"token": piece})
+                # Generation also ends quietly at the deadline
+                truncated = monotonic() - started >= self.stream_timeout_seconds
+            except TimeoutError:
+                truncated = True
+            except Exception as e:
+                print(f"Model error: {e}")
+                answer = self.get_fallback_response(user_message, context_data)
+            finally:
+                # Runs on client disconnect too; closing stops the generation
+                pieces.close()
+            if answer is None and truncated and not parts:
+                answer = self.busy_response(user_message)
+            elif answer is None:
+                # A cut-short answer keeps what was streamed and is not cached
+                answer = self.clean_response("".join(parts), user_message)
+                if not truncated:
+                    if len(answer.split()) < 10:
+                        answer = f"{answer} {self.get_quick_advice(user_message)}"
+                    chatcache.put(user_message, context_data, answer)
+        if first_token is None:
+            first_token = monotonic() - started
+            yield sse_event({"token": answer})
+
+        ttft_ms = round(first_token * 1000)
+        counters.incr("chatbot.streams")
+        counters.incr("chatbot.ttft_ms_total", ttft_ms)
+        counters.gauge("chatbot.last_ttft_ms", ttft_ms)
+        yield sse_event({
+            "response": answer,
+            "context_used": context_data["has_data"],
+            "user_role": context_data["user_role"],
+            "time_to_first_token_ms": ttft_ms,
+            "truncated": truncated,
+        }, event="done")
@@ -0,0 +1,230 @@
+"""
+Offline benchmark of the crop-analysis pipeline.
+
+    python benchmarks/bench_analysis.py [--sizes 1 4 16] [--formats jpg png tif]
+                                        [--repeat 3] [--output results.json]
+                                        [--compare baseline.json]
+
+Synthetic field images are generated once per size and format in a
+temporary directory. Every case then runs in its own interpreter, so
+the peak RSS it reports is that case's alone. Each case times:
+
+    total     analyze_drone_image() end to end (full mode; tiled for TIFF
+              when --tiled is given)
+    decode    load_rgb() / open_windowed() plus reading every band
+    indices   IndexAccumulator over all bands, default indices but stress
+    stress    IndexAccumulator over all bands, stress (and canopy) only
+
+Timings are the best of --repeat runs. estimate_yield() and
+generate_recommendations() are timed as calls per second. Results are
+written as JSON, and --compare prints the change against an earlier
+results file. Nothing here touches Django settings or the database.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api.indices import DEFAULT_INDICES  # noqa: E402
+from api.utils import (  # noqa: E402
+    IndexAccumulator,
+    analyze_drone_image,
+    estimate_yield,
+    generate_recommendations,
+    iter_bands,
+    load_rgb,
+    open_windowed,
+    tifffile,
+)
+
+FORMATS = {"jpg": "JPEG", "png": "PNG", "tif": "TIFF"}
+
+
+def synthetic_field(megapixels, seed=0):
+    """Crop rows with soil between them, brown patches and sensor noise."""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    rows = (np.arange(width) // 24) % 2 == 0
+    img[:, rows] = (60, 140, 50)   # canopy
+    img[:, ~rows] = (120, 95, 70)  # soil
+    for _ in range(max(1, int(megapixels * 4))):
+        y, x = rng.integers(0, height), rng.integers(0, width)
+        img[y:y + 150, x:x + 150] = (150, 100, 40)  # stressed patch
+    noise = rng.integers(-20, 21, size=(height, width, 1), dtype=np.int16)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def best_of(repeat, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_case(path, tiled, repeat):
+    """Time one image in this process; returns the case's result dict."""
+    cv2.setNumThreads(1)
+    baseline_rss = peak_rss_mb()
+
+    def read():
+        arr = open_windowed(path) if tiled else load_rgb(path)
+        return [np.ascontiguousarray(band) for band in iter_bands(arr)]
+
+    def stage(indices, bands):
+        acc = IndexAccumulator(indices=indices)
+        for band in bands:
+            acc.add(band)
+
+    total = best_of(repeat, lambda: analyze_drone_image(path, tiled=tiled))
+    decode = best_of(repeat, read)
+    bands = read()
+    indices = best_of(repeat, lambda: stage([i for i in DEFAULT_INDICES if i != "stress_pct"], bands))
+    stress = best_of(repeat, lambda: stage(["stress_pct"], bands))
+    pixels = sum(band.shape[0] * band.shape[1] for band in bands)
+
+    return {
+        "megapixels": round(pixels / 1e6, 3),
+        "mp_per_s": round(pixels / 1e6 / total, 2),
+        "seconds": {
+            "total": round(total, 4),
+            "decode": round(decode, 4),
+            "indices": round(indices, 4),
+            "stress": round(stress, 4),
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "import_rss_mb": round(baseline_rss, 1),
+    }
+
+
+def bench_helpers(seconds=0.5):
+    """Calls per second of the per-session helpers."""
+    summary = {"canopy_cover": 62.0, "stress_percentage": 8.5, "yield_estimate": 3.1,
+               "vari": 0.12, "gli": 0.08, "exg": 24.0}
+    rates = {}
+    # generate_recommendations() prints; keep that out of the report but in the timing
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, fn in [("estimate_yield", lambda: estimate_yield(62.0, 8.5)),
+                         ("generate_recommendations", lambda: generate_recommendations(summary))]:
+            calls, start = 0, time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                fn()
+                calls += 1
+            rates[name] = round(calls / (time.perf_counter() - start))
+    return rates
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as fh:
+        baseline = {(c["format"], c["size_mp"], c["mode"]): c for c in json.load(fh)["cases"]}
+    print(f"\nchange against {baseline_path} (negative time = faster):")
+    for case in results["cases"]:
+        old = baseline.get((case["format"], case["size_mp"], case["mode"]))
+        if old is None:
+            continue
+        changes = ", ".join(
+            f"{stage} {(case['seconds'][stage] / old['seconds'][stage] - 1) * 100:+.1f}%"
+            for stage in case["seconds"] if old["seconds"].get(stage)
+        )
+        rss = case["peak_rss_mb"] - old["peak_rss_mb"]
+        print(f"  {case['format']:4s} {case['size_mp']:>5g} MP {case['mode']:5s}  "
+              f"{changes}, rss {rss:+.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark analyze_drone_image offline.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16],
+                        help="image sizes in megapixels")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS))
+    parser.add_argument("--tiled", action="store_true", help="also run TIFFs in tiled mode")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--run-case", nargs=2, metavar=("PATH", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        path, mode = args.run_case
+        print(json.dumps(run_case(path, mode == "tiled", args.repeat)))
+        return
+
+    cases = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            arr = synthetic_field(size)
+            for fmt in args.formats:
+                path = os.path.join(workdir, f"field-{size:g}mp.{fmt}")
+                Image.fromarray(arr).save(path, FORMATS[fmt], **({"quality": 90} if fmt == "jpg" else {}))
+                modes = ["full"]
+                if fmt == "tif" and args.tiled and tifffile is not None:
+                    modes.append("tiled")
+                for mode in modes:
+                    out = subprocess.run(
+                        [sys.executable, __file__, "--run-case", path, mode, "--repeat", str(args.repeat)],
+                        capture_output=True, text=True, check=True,
+                    ).stdout
+                    case = {"format": fmt, "size_mp": size, "mode": mode,
+                            "file_mb": round(os.path.getsize(path) / (1 << 20), 2)}
+                    case.update(json.loads(out.strip().splitlines()[-1]))
+                    cases.append(case)
+                    s = case["seconds"]
+                    print(f"{fmt:4s} {size:>5g} MP {mode:5s} {case['mp_per_s']:7.2f} MP/s  "
+                          f"total {s['total']:.3f}s  decode {s['decode']:.3f}s  "
+                          f"indices {s['indices']:.3f}s  stress {s['stress']:.3f}s  "
+                          f"peak {case['peak_rss_mb']:.0f} MB")
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "cases": cases,
+        "helpers_per_s": bench_helpers(),
+    }
+    print("helpers:", ", ".join(f"{k} {v}/s" for k, v in results["helpers_per_s"].items()))
+    with open(args.output, "w") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare ways of computing the brown-pixel stress mask.
+
+    python benchmarks/bench_stress.py [--megapixels 4] [--repeat 20]
+
+Times the OpenCV HSV path used by IndexAccumulator (with and without
+reused buffers) against a precomputed 2^24-entry RGB lookup table, both
+as one byte per colour and packed to one bit per colour. The table is
+built from the same cvtColor/inRange rule, so every variant is checked
+to give the same mask.
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.utils import BROWN_HSV_LOWER, BROWN_HSV_UPPER  # noqa: E402
+
+
+def build_tables():
+    """Brown mask of every 8-bit RGB colour, as bytes (0/255) and packed bits."""
+    colours = np.arange(1 << 24, dtype=np.uint32).reshape(4096, 4096)
+    cube = np.empty((4096, 4096, 3), dtype=np.uint8)
+    cube[:, :, 0] = colours >> 16
+    cube[:, :, 1] = (colours >> 8) & 0xFF
+    cube[:, :, 2] = colours & 0xFF
+    hsv = cv2.cvtColor(cube, cv2.COLOR_RGB2HSV)
+    table = cv2.inRange(hsv, BROWN_HSV_LOWER, BROWN_HSV_UPPER).ravel()
+    return table, np.packbits(table > 0)
+
+
+def rgb_index(band):
+    index = band[:, :, 0].astype(np.int32) << 16
+    index |= band[:, :, 1].astype(np.int32) << 8
+    index |= band[:, :, 2]
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=4)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)
+    side = int((args.megapixels * 1e6) ** 0.5)
+    rng = np.random.default_rng(0)
+    band = rng.integers(0, 256, (side, side, 3), dtype=np.uint8)
+
+    start = time.perf_counter()
+    table, packed = build_tables()
+    print(f"table build: {time.perf_counter() - start:.2f}s "
+          f"({table.nbytes >> 20} MiB bytes, {packed.nbytes >> 20} MiB packed)")
+
+    hsv = np.empty_like(band)
+    mask = np.empty(band.shape[:2], dtype=np.uint8)
+
+    def hsv_alloc():
+        return cv2.inRange(cv2.cvtColor(band, cv2.COLOR_RGB2HSV), BROWN_HSV_LOWER, BROWN_HSV_UPPER)
+
+    def hsv_reused():
+        cv2.cvtColor(band, cv2.COLOR_RGB2HSV, dst=hsv)
+        return cv2.inRange(hsv, BROWN_HSV_LOWER, BROWN_HSV_UPPER, dst=mask)
+
+    def lut_bytes():
+        return np.take(table, rgb_index(band), out=mask, mode="clip")
+
+    def lut_bits():
+        index = rgb_index(band)
+        bits = packed[index >> 3] >> (7 - (index & 7)).astype(np.uint8)
+        return (bits & 1) * np.uint8(255)
+
+    expected = hsv_alloc()
+    for name, fn in [("hsv (allocating)", hsv_alloc), ("hsv (reused buffers)", hsv_reused),
+                     ("lut, 16 MiB bytes", lut_bytes), ("lut, 2 MiB bits", lut_bits)]:
+        if not np.array_equal(fn(), expected):
+            raise SystemExit(f"{name}: mask differs from cvtColor/inRange")
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            fn()
+        per_mp = (time.perf_counter() - start) / args.repeat / (band.shape[0] * band.shape[1] / 1e6)
+        print(f"{name:22s} {per_mp * 1000:7.2f} ms/MP")
+
+
+if __name__ == "__main__":
+    main()
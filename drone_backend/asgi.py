@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drone_backend.settings')
 
 application = get_asgi_application()
+
+# Only serving processes load the chatbot model ahead of the first chat
+from api.inference import preload_if_configured  # noqa: E402
+
+preload_if_configured()
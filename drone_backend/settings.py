@@ -189,3 +189,68 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
 }
+
+
+# Crop analysis
+# Images with more pixels than this are analyzed window by window (tiled
+# mode) so stitched orthomosaics larger than RAM can be processed. Only
+# TIFF (and .npy) files can be read that way; larger uploads in other
+# formats are rejected.
+ANALYSIS_TILED_PIXEL_THRESHOLD = 64_000_000
+
+# Worker processes used to analyze uploaded images in parallel, per web
+# worker process: every Django worker (and run_analysis_worker) starts its
+# own pool, so set this to cores / web workers. None uses a small default
+# (2, see api.pool.DEFAULT_POOL_WORKERS); 0 analyzes inline in the request
+# thread.
+ANALYSIS_POOL_WORKERS = None
+
+# Default rows x cols grid for per-cell (zonal) statistics; None disables
+ANALYSIS_ZONAL_GRID = (8, 8)
+
+# Uploaded bytes per request kept in memory so they can be analyzed without
+# reading them back from storage; larger uploads are re-read from disk
+ANALYSIS_INGEST_BUFFER_BYTES = 64 * 1024 * 1024
+
+# Largest single file accepted by the resumable (chunked) upload endpoints
+CHUNKED_UPLOAD_MAX_BYTES = 20 * 1024 ** 3
+
+# Per user: unfinished chunked uploads and their declared bytes (a new
+# batch must fit under both), and how long an upload may sit without a
+# chunk before run_analysis_worker drops it and its sparse file
+CHUNKED_UPLOAD_MAX_ACTIVE = 500
+CHUNKED_UPLOAD_MAX_ACTIVE_BYTES = 100 * 1024 ** 3
+CHUNKED_UPLOAD_EXPIRY = timedelta(hours=24)
+
+# Near-duplicate frames (requests with dedupe=true): an upload whose grey
+# thumbnail registers against an earlier frame of the same session, over
+# at least ANALYSIS_DUPLICATE_MIN_OVERLAP of the frame, with a mismatch
+# (1 - correlation) of at most ANALYSIS_DUPLICATE_MAX_MISMATCH, and whose
+# canopy and stress are within ANALYSIS_DUPLICATE_MAX_COVER_DELTA points of
+# that frame's, is grouped with it (None disables grouping). Only the first
+# ANALYSIS_DUPLICATE_SAMPLE frames of each group are analyzed; the others
+# take their metrics, so the cover delta bounds what a group member can be
+# off by. The defaults group consecutive frames of a 70-80% overlap survey.
+ANALYSIS_DUPLICATE_MIN_OVERLAP = 0.65
+ANALYSIS_DUPLICATE_MAX_MISMATCH = 0.3
+ANALYSIS_DUPLICATE_MAX_COVER_DELTA = 2.0
+ANALYSIS_DUPLICATE_SAMPLE = 1
+
+# Chatbot
+# Hugging Face seq2seq model answering chat questions, loaded once per process
+CHATBOT_MODEL_NAME = "google/flan-t5-small"
+# Load (and warm up) the model in a background thread when the WSGI/ASGI
+# application is loaded, i.e. in serving processes only, instead of on
+# the first chat message
+CHATBOT_PRELOAD_MODEL = False
+# Concurrent chat prompts arriving within this window are answered by one
+# batched generate call of at most CHATBOT_BATCH_MAX_SIZE prompts
+CHATBOT_BATCH_WINDOW_MS = 10
+CHATBOT_BATCH_MAX_SIZE = 8
+# Prompts waiting for the model beyond this are turned away with a quick
+# fallback answer instead of queueing
+CHATBOT_QUEUE_MAX_SIZE = 32
+# Generated answers kept per question and session metrics (0 disables), and
+# for how many seconds
+CHATBOT_CACHE_MAX_ENTRIES = 1024
+CHATBOT_CACHE_TTL = 3600